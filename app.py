@@ -11,9 +11,11 @@ from flask import Flask, redirect, url_for, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from passlib.hash import pbkdf2_sha256
-from cache_config import cache, initialize_cache
+from cache_config import cache, initialize_cache, cache_custom_figures
+from data_processing import FrameAggregates
 from watchdog_handler import start_watchdog
 from callbacks import register_callbacks
+from figure_payload import theme_template
 from colorlog import ColoredFormatter
 import signal
 import sys
@@ -281,71 +283,106 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
-# initialize cache AFTER creating server but BEFORE loading layouts
-cache.init_app(server, config={
-    'CACHE_TYPE': 'redis',
-    'CACHE_DEFAULT_TIMEOUT': 3600,
-    'CACHE_REDIS_URL': os.getenv('REDIS_URL')
-})
-
-with server.app_context():
-    initialize_cache()
-
 # Initialize SocketIO
 socketio = SocketIO(server, cors_allowed_origins='*')
 
 WATCH_DIR = "/home/iaes/DiodeSensor/FM1"
 OUTPUT_DIR = "/home/iaes/DiodeSensor/FM1/output"
 
-# Create data collector components
-aggregator = NetworkDataAggregator(WATCH_DIR, OUTPUT_DIR)
-data_handler = NetworkDataHandler(aggregator)
-
-# Import layouts after cache is initialized
-from layouts import (
-    overview_layout,
-    one_hour_layout,
-    twenty_four_hour_layout,
-    custom_layout
-    #seven_days_layout,
-)
-
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], server=server, suppress_callback_exceptions=True)
-
 
-# Register the callbacks with the Dash app
-register_callbacks(app, data_handler)
+def create_dashboard():
+    """Set up the cache, the collector components and the Dash app; returns (app, aggregator, data_handler)"""
+    # initialize cache AFTER creating server but BEFORE loading layouts
+    cache.init_app(server, config={
+        'CACHE_TYPE': 'redis',
+        'CACHE_DEFAULT_TIMEOUT': 3600,
+        'CACHE_REDIS_URL': os.getenv('REDIS_URL')
+    })
+
+    with server.app_context():
+        initialize_cache()
+
+    # Create data collector components
+    # PARSER_WORKERS=1 parses custom searches in-process, which is easier to debug
+    aggregator = NetworkDataAggregator(
+        WATCH_DIR, OUTPUT_DIR,
+        workers=int(os.getenv('PARSER_WORKERS', os.cpu_count() or 1)),
+        columnar=os.getenv('COLUMNAR_OUTPUT', '0') == '1',
+        snapshots=os.getenv('SNAPSHOT_OUTPUT', '0') == '1',
+        partial_every=int(os.getenv('CUSTOM_PARTIAL_EVERY', 10)),
+        export_custom=os.getenv('CUSTOM_EXPORT', '1') == '1',
+        record_store=os.getenv('RECORD_STORE', '0') == '1',
+        archive=os.getenv('SENSOR_ARCHIVE', '0') == '1',
+        compression=os.getenv('NDJSON_COMPRESSION', ''),
+    )
+
+    def build_custom_figures():
+        # one fold per custom job; its matched frames are added as they are found
+        folded = FrameAggregates()
+
+        def finish(filename):
+            # custom jobs run on scheduler threads, outside any request
+            with server.app_context():
+                cache_custom_figures(filename, folded)
+        return folded.add, finish
+
+    data_handler = NetworkDataHandler(aggregator, incremental=False, figure_builder=build_custom_figures)
+
+    # Import layouts after cache is initialized
+    from layouts import (
+        overview_layout,
+        one_hour_layout,
+        twenty_four_hour_layout,
+        custom_layout
+        #seven_days_layout,
+    )
+
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], server=server, suppress_callback_exceptions=True)
+
+
+    # Register the callbacks with the Dash app
+    register_callbacks(app, data_handler)
+
+
+    # Add interval and store
+    app.layout = html.Div(
+        [
+            dcc.Interval(id='interval-component', interval=30_000, n_intervals=0),
+            dcc.Store(id='figs-store', data={}),
+            dcc.Store(id='last-visual-update', data={}),
+            # the figure template, sent once here instead of inside each figure (see figure_payload)
+            dcc.Store(id='theme-store', data=theme_template()),
+            dcc.Location(id='url', refresh=False),
+            html.Div(id='page-content')
+        ]
+    )
+
+    @app.callback(
+        Output('page-content', 'children'),
+        [Input('url', 'pathname')]
+    )
+    def display_page(pathname):
+        if not current_user.is_authenticated:    
+            return dcc.Location(id='redirect', href='/login')
+        
+        if pathname == '/1_hour_data':
+            return one_hour_layout
+        elif pathname == '/24_hours_data':
+            return twenty_four_hour_layout
+        elif pathname == '/custom_data':  # New condition
+            return custom_layout
+        #elif pathname == '/7_days_data':
+        #    return seven_days_layout
+        else:
+            return overview_layout
 
+    return app, aggregator, data_handler
 
-# Add interval and store
-app.layout = html.Div(
-    [
-        dcc.Interval(id='interval-component', interval=30_000, n_intervals=0),
-        dcc.Store(id='figs-store', data={}),
-        dcc.Store(id='last-visual-update', data={}),
-        dcc.Location(id='url', refresh=False),
-        html.Div(id='page-content')
-    ]
-)
 
-@app.callback(
-    Output('page-content', 'children'),
-    [Input('url', 'pathname')]
-)
-def display_page(pathname):
-    if not current_user.is_authenticated:    
-        return dcc.Location(id='redirect', href='/login')
-    
-    if pathname == '/1_hour_data':
-        return one_hour_layout
-    elif pathname == '/24_hours_data':
-        return twenty_four_hour_layout
-    elif pathname == '/custom_data':  # New condition
-        return custom_layout
-    #elif pathname == '/7_days_data':
-    #    return seven_days_layout
-    else:
-        return overview_layout
+# the parser pool spawns its workers, and each one re-imports this module as __mp_main__;
+# they only run collector functions, so only the real process builds the dashboard
+if __name__ != "__mp_main__":
+    app, aggregator, data_handler = create_dashboard()
 
 
 if __name__ == "__main__":
@@ -358,6 +395,7 @@ if __name__ == "__main__":
     watchdog_thread.start()
 
     # ======== START COLLECTOR TASK PROCESSOR ========
+    aggregator.index.start_watching()
     task_thread = threading.Thread(target=data_handler.process_tasks, daemon=True)
     task_thread.start()
 
@@ -0,0 +1,59 @@
+"""Compare the per-record cleaner with the column-wise batch cleaner.
+
+Usage: python benchmarks/bench_clean_batch.py [rows] [batch_size]
+
+The records in jsondata/fakedata are repeated until the requested row
+count is reached, then cleaned and serialized to NDJSON both ways.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from collector import clean_entry, clean_batch, frame_to_ndjson, CLEAN_BATCH_SIZE
+
+FAKEDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jsondata", "fakedata", "2.json")
+
+
+def load_records(rows):
+    with open(FAKEDATA, "r") as f:
+        sample = [entry for entry in json.load(f)[1:] if isinstance(entry, dict)]
+    repeats = rows // len(sample) + 1
+    return (sample * repeats)[:rows]
+
+
+def bench_per_record(records):
+    start = time.perf_counter()
+    size = 0
+    for entry in records:
+        size += len(json.dumps(clean_entry(entry)) + "\n")
+    return time.perf_counter() - start, size
+
+
+def bench_batch(records, batch_size):
+    start = time.perf_counter()
+    clean_time = 0.0
+    size = 0
+    for offset in range(0, len(records), batch_size):
+        block_start = time.perf_counter()
+        frame = clean_batch(records[offset:offset + batch_size])
+        clean_time += time.perf_counter() - block_start
+        size += len(frame_to_ndjson(frame))
+    return time.perf_counter() - start, clean_time, size
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else CLEAN_BATCH_SIZE
+    records = load_records(rows)
+
+    per_record_time, per_record_size = bench_per_record(records)
+    batch_time, batch_clean_time, batch_size_bytes = bench_batch(records, batch_size)
+
+    print(f"rows: {rows:,}  batch size: {batch_size:,}")
+    print(f"per-record clean + json.dumps: {per_record_time:8.2f}s  {rows / per_record_time:12,.0f} rows/s  {per_record_size / 1024 ** 2:8.1f} MB")
+    print(f"batch clean + serialize:       {batch_time:8.2f}s  {rows / batch_time:12,.0f} rows/s  {batch_size_bytes / 1024 ** 2:8.1f} MB")
+    print(f"  of which cleaning:           {batch_clean_time:8.2f}s  {rows / batch_clean_time:12,.0f} rows/s")
+    print(f"speedup: {per_record_time / batch_time:.2f}x overall, {per_record_time / batch_clean_time:.2f}x vs cleaning alone")
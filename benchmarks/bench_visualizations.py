@@ -0,0 +1,195 @@
+"""Compare the overview figures built straight from the records with the aggregate-first builders.
+
+Usage: python benchmarks/bench_visualizations.py [rows] [repeats]
+
+The records in jsondata/fakedata are repeated until the requested row
+count is reached and loaded into a frame the way the dashboard loader
+does (typed_frame). baseline_visualizations below is create_visualizations
+as it was before the figures were built from aggregate_frame(); both are
+run on the same frame and the best of the repeats is reported.
+"""
+import os
+import sys
+import json
+import time
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.colors as colors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data_processing import (
+    TIME_FIELDS, typed_frame, compact_frame, connection_key, detect_anomalies,
+    prepare_frame, aggregate_frame, aggregated_visualizations,
+)
+
+FAKEDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jsondata", "fakedata", "2.json")
+
+required_hourly_columns = [
+    "12AM", "1AM", "2AM", "3AM", "4AM", "5AM", "6AM", "7AM",
+    "8AM", "9AM", "10AM", "11AM", "12PM", "1PM", "2PM", "3PM",
+    "4PM", "5PM", "6PM", "7PM", "8PM", "9PM", "10PM", "11PM",
+]
+required_daily_columns = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+
+def load_frame(rows):
+    with open(FAKEDATA, "r") as f:
+        sample = [entry for entry in json.load(f)[1:] if isinstance(entry, dict)]
+    repeats = rows // len(sample) + 1
+    return typed_frame((sample * repeats)[:rows])
+
+
+def baseline_visualizations(all_data, total_cyber9_reports):
+    df = all_data.copy(deep=False)
+    required_columns = {
+        'DSTIP': 'Unknown', 'SRCIP': 'Unknown', 'PROTOCOL': 'Unknown', 'TOTPACKETS': 0, 'TOTDATA': "0 MB",
+        'SRCPORT': 0, 'DSTPORT': 0, 'SRCCC': '', 'DSTCC': '', 'SRCMAC': '', 'DSTMAC': ''
+    }
+    for col, default in required_columns.items():
+        if col not in df.columns:
+            df[col] = default
+    if 'ROWS' not in df.columns:
+        df['ROWS'] = 1
+    for col in TIME_FIELDS:
+        if col not in df.columns:
+            df[col] = 0
+        elif df[col].dtype.kind not in 'iu':
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    for col in ['DSTIP', 'SRCIP', 'PROTOCOL']:
+        if df[col].isna().any():
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and 'Unknown' not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories('Unknown')
+            df[col] = df[col].fillna('Unknown')
+    compact_frame(df)
+
+    if df["TOTDATA"].dtype.kind == 'f':
+        df["TOTDATA_MB"] = df["TOTDATA"].fillna(0)
+    else:
+        df["TOTDATA"] = df["TOTDATA"].astype(str)
+        df["TOTDATA_MB"] = pd.to_numeric(df["TOTDATA"].str.replace(" MB", ""), errors='coerce').fillna(0)
+
+    custom_colorscale = [(0, "red"), (0.33, "yellow"), (0.67, "green"), (1, "blue")]
+
+    fig_indicator_packets = go.Figure(go.Indicator(mode="number", value=df["TOTPACKETS"].sum(), title={"text": "Total Packets"}))
+    fig_indicator_packets.update_layout(font=dict(color="white"), template="plotly_dark", height=250)
+    fig_indicator_data_points = go.Figure(go.Indicator(mode="number", value=int(df["ROWS"].sum()), title={"text": "Total Connections"}))
+    fig_indicator_data_points.update_layout(font=dict(color="white"), template="plotly_dark", height=250)
+    fig_indicator_cyber_reports = go.Figure(go.Indicator(mode="number", value=total_cyber9_reports, title={"text": "Total Cyber9 Line Reports"}))
+    fig_indicator_cyber_reports.update_layout(font=dict(color="white"), template="plotly_dark", height=250)
+
+    treemap_data = df.groupby(['SRCIP', 'DSTIP', 'PROTOCOL'], observed=True, as_index=False)['TOTPACKETS'].sum()
+    treemap_data = treemap_data.astype({'SRCIP': str, 'DSTIP': str, 'PROTOCOL': str})
+    fig_treemap = px.treemap(treemap_data, path=['SRCIP', 'DSTIP', 'PROTOCOL'], template="plotly_dark",
+                             values='TOTPACKETS', height=600, title='Source, Destination IP and Protocol Distribution')
+
+    df["TOTDATA"] = df["TOTDATA_MB"]
+    total_data_by_srcip = df.groupby("SRCIP", observed=True, as_index=False)["TOTDATA"].sum()
+    top_10_data = total_data_by_srcip.nlargest(10, "TOTDATA")
+    total_data_by_srcip["SRCIP_GROUPED"] = total_data_by_srcip["SRCIP"].astype(str).where(
+        total_data_by_srcip["SRCIP"].isin(top_10_data["SRCIP"]), "Others"
+    )
+    grouped_data = total_data_by_srcip.groupby("SRCIP_GROUPED", as_index=False)["TOTDATA"].sum()
+    fig3 = px.pie(grouped_data, names="SRCIP_GROUPED", values="TOTDATA", title="Total Data by Top 10 Source IP",
+                  color_discrete_sequence=[c[1] for c in custom_colorscale], template="plotly_dark")
+
+    hourly_activity = df[required_hourly_columns].sum().values.reshape(1, -1)
+    fig4 = go.Figure(data=go.Heatmap(z=hourly_activity, x=required_hourly_columns, y=["Activity"],
+                                     colorscale="jet", colorbar=dict(title="Number of Packets")))
+    fig4.update_layout(title="Hourly Packet Activity Heatmap (with Overlay Line Plot)", xaxis_title="Hour",
+                       yaxis_title="Activity (log scale)", template="plotly_dark")
+    hourly_totals = df[required_hourly_columns].sum(axis=0)
+    fig4.add_trace(go.Scatter(x=required_hourly_columns, y=hourly_totals, mode="lines+markers",
+                              line=dict(color="black"), name="Total Packets per Hour", yaxis="y2"))
+    fig4.update_layout(yaxis2=dict(title="", overlaying="y", side="right", showgrid=False))
+
+    daily_activity = df[required_daily_columns].sum().values.reshape(1, -1)
+    fig5 = go.Figure(data=go.Heatmap(z=daily_activity, x=required_daily_columns, y=["Activity"],
+                                     colorscale="jet", colorbar=dict(title="Number of Packets")))
+    fig5.update_layout(title="Daily Activity Heatmap", xaxis_title="Day", yaxis_title="Activity", template="plotly_dark")
+
+    sankey_data = df.groupby(["SRCIP", "DSTIP"], observed=True, as_index=False)["TOTDATA_MB"].sum()
+    top_connections = sankey_data.nlargest(10, "TOTDATA_MB").astype({"SRCIP": str, "DSTIP": str})
+    all_nodes = list(set(top_connections["SRCIP"]).union(set(top_connections["DSTIP"])))
+    node_map = {node: idx for idx, node in enumerate(all_nodes)}
+    node = dict(pad=15, thickness=20, line=dict(color="black", width=0.5), label=all_nodes, color="blue")
+    sources = [node_map[src] for src in top_connections["SRCIP"]]
+    targets = [node_map[dst] for dst in top_connections["DSTIP"]]
+    fig_sankey = go.Figure(data=[go.Sankey(node=node, link=dict(source=sources, target=targets,
+                                                                  value=top_connections["TOTDATA_MB"]))])
+    fig_sankey.update_layout(title_text="Top 10 IP Data Flows", font_size=10, template="plotly_dark")
+
+    low, high = top_connections["TOTDATA_MB"].min(), top_connections["TOTDATA_MB"].max()
+    top_connections["norm_data"] = (top_connections["TOTDATA_MB"] - low) / (high - low)
+    color_values = colors.sample_colorscale("jet", top_connections["norm_data"])
+    fig_sankey_heatmap = go.Figure(data=[go.Sankey(node=node, link=dict(
+        source=sources, target=targets, value=top_connections["TOTDATA_MB"], color=color_values))])
+    fig_sankey_heatmap.add_trace(go.Scatter(
+        x=[None], y=[None], mode="markers", hoverinfo="none",
+        marker=dict(colorscale="jet", cmin=low, cmax=high, colorbar=dict(
+            title="TOTDATA_MB", titleside="right", tickmode="array", tickvals=[low, high], ticktext=["Low", "High"])),
+    ))
+    fig_sankey_heatmap.update_layout(title_text="Sankey Diagram with Heatmap", font_size=10, template="plotly_dark",
+                                     xaxis=dict(showgrid=False, zeroline=False, visible=False),
+                                     yaxis=dict(showgrid=False, zeroline=False, visible=False))
+
+    fig_protocol_pie = px.pie(df, names="PROTOCOL", values="ROWS", title="Protocol Usage", hole=0.3,
+                              color_discrete_sequence=px.colors.sequential.RdBu, template="plotly_dark")
+    fig_protocol_pie.update_traces(textinfo="percent+label")
+
+    fig_parallel = px.parallel_categories(
+        df.nlargest(10, "TOTPACKETS"), dimensions=["SRCIP", "DSTIP", "PROTOCOL"], color="TOTPACKETS",
+        color_continuous_scale=px.colors.sequential.Jet, template="plotly_dark",
+        labels={"SRCIP": "Source IP", "DSTIP": "Destination IP", "PROTOCOL": "Protocol", "TOTPACKETS": "Total Packets"},
+        title="Top 10 Connections by Total Packets",
+    )
+
+    protocol_agg = df.groupby("PROTOCOL", observed=True, as_index=False)[required_hourly_columns].sum()
+    protocol_agg_melted = protocol_agg.melt(id_vars=["PROTOCOL"], var_name="Hour", value_name="Total Packets")
+    fig_stacked_area = px.area(protocol_agg_melted, x="Hour", y="Total Packets", color="PROTOCOL",
+                               title="Network Traffic by Protocol (Hourly)", template="plotly_dark")
+    fig_stacked_area.update_layout(xaxis_title="Hour", yaxis_title="Total Packets", legend_title="Protocol")
+
+    df['CONNECTION'] = connection_key(df)
+    df['UNIQUE_CONNECTIONS'] = df['CONNECTION'].nunique()
+    anomalies = detect_anomalies(df)
+    fig_anomalies = px.scatter(anomalies, x='SRCIP', y='DSTIP', size='TOTDATA_MB', color='PROTOCOL',
+                               hover_data=['TOTPACKETS', 'TOTDATA_MB', 'SRCIP', 'DSTIP'],
+                               title='Detected Anomalies for TCP connections', template='plotly_dark')
+    fig_anomalies.update_layout(height=600)
+
+    return (fig_indicator_packets, fig_indicator_data_points, fig_indicator_cyber_reports, fig_treemap,
+            fig3, fig4, fig5, fig_sankey, fig_sankey_heatmap, fig_protocol_pie, fig_parallel,
+            fig_stacked_area, fig_anomalies)
+
+
+def bench_baseline(frame):
+    start = time.perf_counter()
+    figs = baseline_visualizations(frame, 1)
+    return time.perf_counter() - start, len(figs)
+
+
+def bench_aggregated(frame):
+    start = time.perf_counter()
+    aggregates = aggregate_frame(prepare_frame(frame))
+    aggregate_time = time.perf_counter() - start
+    figs, _ = aggregated_visualizations(aggregates, 1)
+    return time.perf_counter() - start, aggregate_time, len(figs)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    frame = load_frame(rows)
+
+    baseline_time = min(bench_baseline(frame)[0] for _ in range(repeats))
+    aggregated_runs = [bench_aggregated(frame) for _ in range(repeats)]
+    aggregated_time, aggregate_time, _ = min(aggregated_runs)
+
+    print(f"rows: {rows:,}  repeats: {repeats}")
+    print(f"baseline create_visualizations:    {baseline_time:8.2f}s  {rows / baseline_time:12,.0f} rows/s")
+    print(f"aggregate_frame + figure builders: {aggregated_time:8.2f}s  {rows / aggregated_time:12,.0f} rows/s")
+    print(f"  of which aggregation:            {aggregate_time:8.2f}s")
+    print(f"speedup: {baseline_time / aggregated_time:.2f}x")
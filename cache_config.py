@@ -1,10 +1,15 @@
 import os
+import time
 import threading
 import logging
 from flask_caching import Cache
 from colorlog import ColoredFormatter
-from data_processing import read_and_process_file
-import plotly.graph_objects as go
+from data_processing import (
+    read_and_process_file, resolve_data_file, read_data, build_folded_visualizations, count_files_in_directory,
+    C9REPORTS_FOLDER,
+)
+from ndjson_codec import NDJSON_SUFFIXES, logical_path
+from figure_payload import minimize_figure, empty_figures
 from collections import defaultdict
 import math
 import pickle
@@ -66,7 +71,8 @@ def update_cache_for_file(filename):
 
     file_path = os.path.join("/home/iaes/DiodeSensor/FM1/output", filename)
     with file_locks[file_path]:
-        mod_time = os.path.getmtime(file_path)
+        # the parquet copy is what actually gets read when the collector publishes one
+        mod_time = os.path.getmtime(resolve_data_file(file_path))
         prev_time = last_file_timestamp.get(filename, 0)
         if mod_time <= prev_time:
             logger.info(f"file {filename} didn't get newer. skipping.")
@@ -74,28 +80,54 @@ def update_cache_for_file(filename):
 
         logger.info(f"generating figs for {filename}")
         try:
-            data, figs, total_reports = read_and_process_file(file_path)
-            
-            # Convert figures to dicts before storage
-            figs_dicts = [f.to_dict() for f in figs]  # <--- CRITICAL FIX
-            
-            payload = pickle.dumps({
-                'data': data,
-                'total_reports': total_reports,
-                'timestamp': mod_time,
-            })
-            set_in_chunks(f'cached_data_{filename}', payload)
-            
-            # Store figure dictionaries instead of raw figures
-            figs_payload = pickle.dumps(figs_dicts)  # <--- CHANGED
-            set_in_chunks(f'visualizations_{filename}', figs_payload)
-            
-            cache.set(f'last_update_timestamp_{filename}', mod_time)
-            last_file_timestamp[filename] = mod_time
+            data, figs, total_reports, flows = read_and_process_file(file_path)
+            store_figures(filename, figs, total_reports, mod_time, flows)
             logger.info(f"cache updated for {filename}")
         except Exception as e:
             logger.error(f"error reading and caching {filename}: {e}")
 
+def store_figures(filename, figs, total_reports, mod_time, flows=None):
+    # compact dicts without the template (see figure_payload), which is what the browser gets too
+    figs_dicts = [minimize_figure(f) for f in figs]
+
+    # the records themselves stay on disk: columnar snapshots are mapped by every
+    # worker straight from the page cache, so only the metadata goes to redis
+    payload = pickle.dumps({
+        'total_reports': total_reports,
+        'timestamp': mod_time,
+    })
+    set_in_chunks(f'cached_data_{filename}', payload)
+
+    # Store figure dictionaries instead of raw figures
+    figs_payload = pickle.dumps(figs_dicts)  # <--- CHANGED
+    set_in_chunks(f'visualizations_{filename}', figs_payload)
+    # per-flow packet totals, what a treemap drill-down is rendered from
+    if flows is not None:
+        set_in_chunks(f'treemap_flows_{filename}', pickle.dumps(flows))
+
+    cache.set(f'last_update_timestamp_{filename}', mod_time)
+    last_file_timestamp[filename] = mod_time
+
+def cache_custom_figures(filename, folded):
+    """Build and cache a custom job's figures from the FrameAggregates it folded its records into, skipping the file round trip"""
+    logger.info(f"generating figs for {filename} from {folded.rows} records folded in memory")
+    total_reports = count_files_in_directory(C9REPORTS_FOLDER)
+    figs, flows = build_folded_visualizations(folded, total_reports)
+    # stamped after the export (if any) was written, so update_cache_for_file sees nothing newer
+    store_figures(filename, figs, total_reports, time.time(), flows)
+
+def cached_figures(filename):
+    """Figure dicts already in the cache for a file, or None"""
+    figs_payload = get_from_chunks(f'visualizations_{filename}')
+    if not figs_payload:
+        return None
+    return pickle.loads(figs_payload)
+
+def cached_flows(filename):
+    """Per-flow packet totals cached with a file's figures, or None"""
+    payload = get_from_chunks(f'treemap_flows_{filename}')
+    return pickle.loads(payload) if payload else None
+
 def get_cached_data(filename):
     payload = get_from_chunks(f'cached_data_{filename}')
     if not payload:
@@ -105,7 +137,8 @@ def get_cached_data(filename):
     if payload is None:
         return None, 0
     stored = pickle.loads(payload)
-    return stored['data'], stored['total_reports']
+    data, _ = read_data(os.path.join("/home/iaes/DiodeSensor/FM1/output", filename))
+    return data, stored['total_reports']
 
 def get_visualizations(filename, force_refresh=True):
     print(f"[DEBUG] Loading visuals for {filename}")  # Diagnostic output
@@ -118,20 +151,24 @@ def get_visualizations(filename, force_refresh=True):
     
     if not figs_payload:
         print(f"[ERROR] No figure payload found for {filename}")
-        return [go.Figure()] * 13
+        return empty_figures()
     
     try:
         figs_dicts = pickle.loads(figs_payload)
         print(f"[DEBUG] Loaded {len(figs_dicts)} figure dicts")  # Count verification
-        return [go.Figure(f) for f in figs_dicts]
+        # kept as dicts: they go to dcc.Graph as they are, and go.Figure would reject the typed arrays
+        return figs_dicts
     except Exception as e:
         print(f"[CRITICAL] Figure loading failed: {str(e)}")
-        return [go.Figure()] * 13
+        return empty_figures()
 
 def initialize_cache():
     logger.info("initializing cache fresh...")
     data_dir = "/home/iaes/DiodeSensor/FM1/output"
-    for filename in os.listdir(data_dir):
-        if filename.endswith('.json'):
+    # a dataset may be stored compressed (all_data.json.gz); its cache entry goes by the .json name
+    datasets = {logical_path(filename) for filename in os.listdir(data_dir) if filename.endswith(NDJSON_SUFFIXES)}
+    for filename in sorted(datasets):
+        # custom results get their figures from the job, or on demand when reopened
+        if not filename.startswith('custom_'):
             logger.info(f"loading {filename} into cache once...")
             update_cache_for_file(filename)
@@ -3,16 +3,43 @@ import time
 from dash.dependencies import Input, Output, State
 from dash import no_update, callback, ctx
 from flask_caching import logger
-import plotly.graph_objects as go
-from cache_config import get_visualizations, update_cache_for_file, cache
-from datetime import datetime, timedelta
+from cache_config import get_visualizations, update_cache_for_file, cache, cached_figures, cached_flows
+from figure_payload import minimize_figure, empty_figures
+from datetime import datetime
 import os
-from data_processing import read_data, create_visualizations, count_files_in_directory
+from data_processing import (
+    read_data, create_visualizations, count_files_in_directory, C9REPORTS_FOLDER,
+    treemap_figure, FLOW_COLUMNS, OTHERS,
+)
 import hashlib
 import json
+import uuid
+from flask_login import current_user
 from collector import NetworkDataHandler  
 import dash_bootstrap_components as dbc
-from dash import dcc, html
+from dash import html
+
+# figures arrive without their template (see figure_payload); the browser adds the shared one from theme-store
+APPLY_THEME_JS = """
+function(data, template) {
+    var figs = (data && data.figs) || [];
+    var themed = [];
+    for (var i = 0; i < 13; i++) {
+        var fig = figs[i] || {data: [], layout: {}};
+        themed.push({data: fig.data, layout: Object.assign({}, fig.layout, {template: template})});
+    }
+    return themed;
+}
+"""
+
+APPLY_THEME_ONE_JS = """
+function(fig, template) {
+    if (!fig) {
+        return window.dash_clientside.no_update;
+    }
+    return {data: fig.data, layout: Object.assign({}, fig.layout, {template: template})};
+}
+"""
 
 
 def register_callbacks(app, handler):
@@ -25,10 +52,11 @@ def register_callbacks(app, handler):
     def update_overview_figs(n):
         figs = get_visualizations('all_data.json') or []
         if len(figs) < 13:
-            figs = [go.Figure()] * 13
-        return {'figs': [f.to_dict() for f in figs]}
+            figs = empty_figures()
+        return {'figs': figs}
 
-    @app.callback(
+    app.clientside_callback(
+        APPLY_THEME_JS,
         [
             Output('overview-indicator-packets', 'figure'),
             Output('overview-indicator-data-points', 'figure'),
@@ -44,12 +72,9 @@ def register_callbacks(app, handler):
             Output('overview-stacked-area', 'figure'),
             Output('overview-anomalies-scatter', 'figure'),
         ],
-        Input('overview-figs-store', 'data')
+        Input('overview-figs-store', 'data'),
+        State('theme-store', 'data')
     )
-    def display_overview_figs(data):
-        if not data or 'figs' not in data:
-            return [go.Figure()] * 13
-        return [go.Figure(f) for f in data['figs']]
 
     # 1-hour callbacks
     @app.callback(
@@ -59,10 +84,11 @@ def register_callbacks(app, handler):
     def update_1h_figs(n):
         figs = get_visualizations('1_hour_data.json') or []
         if len(figs) < 13:
-            figs = [go.Figure()] * 13
-        return {'figs': [f.to_dict() for f in figs]}
+            figs = empty_figures()
+        return {'figs': figs}
 
-    @app.callback(
+    app.clientside_callback(
+        APPLY_THEME_JS,
         [
             Output('1h-indicator-packets', 'figure'),
             Output('1h-indicator-data-points', 'figure'),
@@ -78,12 +104,9 @@ def register_callbacks(app, handler):
             Output('1h-stacked-area', 'figure'),
             Output('1h-anomalies-scatter', 'figure'),
         ],
-        Input('1h-figs-store', 'data')
+        Input('1h-figs-store', 'data'),
+        State('theme-store', 'data')
     )
-    def display_1h_figs(data):
-        if not data or 'figs' not in data:
-            return [go.Figure()] * 13
-        return [go.Figure(f) for f in data['figs']]
 
     # 24-hour callbacks
     @app.callback(
@@ -93,10 +116,11 @@ def register_callbacks(app, handler):
     def update_24h_figs(n):
         figs = get_visualizations('24_hours_data.json') or []
         if len(figs) < 13:
-            figs = [go.Figure()] * 13
-        return {'figs': [f.to_dict() for f in figs]}
+            figs = empty_figures()
+        return {'figs': figs}
 
-    @app.callback(
+    app.clientside_callback(
+        APPLY_THEME_JS,
         [
             Output('24h-indicator-packets', 'figure'),
             Output('24h-indicator-data-points', 'figure'),
@@ -112,12 +136,40 @@ def register_callbacks(app, handler):
             Output('24h-stacked-area', 'figure'),
             Output('24h-anomalies-scatter', 'figure'),
         ],
-        Input('24h-figs-store', 'data')
+        Input('24h-figs-store', 'data'),
+        State('theme-store', 'data')
     )
-    def display_24h_figs(data):
-        if not data or 'figs' not in data:
-            return [go.Figure()] * 13
-        return [go.Figure(f) for f in data['figs']]
+
+    # Treemap drill-down: a click re-renders the treemap around the clicked branch
+    for prefix, filename in (('overview', 'all_data.json'), ('1h', '1_hour_data.json'), ('24h', '24_hours_data.json')):
+        @app.callback(
+            Output(f'{prefix}-treemap-store', 'data'),
+            Input(f'{prefix}-treemap', 'clickData'),
+            prevent_initial_call=True
+        )
+        def drill_treemap(click_data, filename=filename):
+            return treemap_drilldown(filename, click_data)
+
+    @app.callback(
+        Output('custom-treemap-store', 'data'),
+        Input('custom-treemap', 'clickData'),
+        State('custom-figs-store', 'data'),
+        prevent_initial_call=True
+    )
+    def drill_custom_treemap(click_data, store_data):
+        # partial results are not cached, so only a finished search drills down
+        if (store_data or {}).get('status') != 'ready':
+            return no_update
+        return treemap_drilldown(store_data.get('filename'), click_data)
+
+    for prefix in ('overview', '1h', '24h', 'custom'):
+        app.clientside_callback(
+            APPLY_THEME_ONE_JS,
+            Output(f'{prefix}-treemap', 'figure', allow_duplicate=True),
+            Input(f'{prefix}-treemap-store', 'data'),
+            State('theme-store', 'data'),
+            prevent_initial_call=True
+        )
 
     # Custom timeframe callbacks
     @app.callback(
@@ -153,7 +205,7 @@ def register_callbacks(app, handler):
                 if start_dt >= end_dt:
                     raise ValueError("end time must be after start time")
             except ValueError as e:
-                return {'status': 'error', 'message': str(e)}
+                return {'status': 'error', 'message': str(e), 'client': (store_data or {}).get('client')}
 
             # build filter dict, ignore blanks
             filters = {
@@ -164,11 +216,13 @@ def register_callbacks(app, handler):
                 'DSTPORT': filter_dstport.strip() if filter_dstport else None,
             }
 
-            # pass filters to task scheduler (assume you update your handler accordingly)
-            task_id = handler.add_custom_task(start_dt, end_dt, filters=filters)
+            # a new search from this tab replaces the one it was waiting on
+            user, client = search_owner(store_data)
+            task_id = handler.add_custom_task(start_dt, end_dt, filters=filters, user=user, client=client)
             return {
                 'status': 'processing',
                 'task_id': task_id,
+                'client': client,
                 'filename': None,
                 'message': 'processing request...',
                 'timestamp': time.time()
@@ -178,25 +232,45 @@ def register_callbacks(app, handler):
             current_data = store_data or {}
             if current_data.get('status') == 'processing':
                 task_id = current_data.get('task_id')
+                user, client = search_owner(current_data)
+                # polling is what keeps a queued or running search alive
+                handler.heartbeat(task_id, user=user, client=client)
                 with handler.lock:
-                    task = handler.active_tasks.get(task_id, {})
+                    task = dict(handler.active_tasks.get(task_id, {}))
                 
                 if task.get('status') == 'complete':
                     return {
                         'status': 'ready',
                         'task_id': task_id,
+                        'client': client,
                         'filename': task.get('filename'),
                         'message': None,
                         'timestamp': time.time()  # Force refresh
                     }
-                elif task.get('status') == 'failed':
+                elif task.get('status') in ('failed', 'rejected', 'cancelled'):
                     return {
                         'status': 'error',
                         'task_id': task_id,
+                        'client': client,
                         'filename': None,
                         'message': task.get('message', 'Failed to generate dataset'),
                         'timestamp': time.time()
                     }
+                elif task.get('status') in ('pending', 'processing'):
+                    # still running: hand the progress to display_custom_figs
+                    partial = task.get('partial')
+                    previous = current_data.get('partial') or {}
+                    return dict(
+                        current_data,
+                        client=client,
+                        state=task['status'],
+                        progress=task.get('progress') or 0.0,
+                        eta=task.get('eta'),
+                        cost=task.get('cost'),
+                        partial=partial,
+                        # figures are only redrawn when the job published a newer snapshot
+                        partial_changed=bool(partial) and partial.get('version') != previous.get('version'),
+                    )
             
             return no_update
         
@@ -204,7 +278,7 @@ def register_callbacks(app, handler):
 
     @app.callback(
     [
-        Output('custom-visuals-container', 'children'),
+        Output('custom-visuals-store', 'data'),
         Output('custom-status-alert', 'children'),
         Output('custom-status-check', 'interval')
     ],
@@ -216,9 +290,23 @@ def register_callbacks(app, handler):
             return no_update, no_update, no_update
             
         if data['status'] == 'processing':
+            visuals = no_update
+            partial = data.get('partial')
+            if data.get('partial_changed'):
+                cube = handler.partial_result(data.get('task_id'))
+                if cube is not None:
+                    figs = create_visualizations(cube, count_files_in_directory(C9REPORTS_FOLDER))
+                    visuals = {'figs': [minimize_figure(fig) for fig in figs]}
+            status = custom_progress(data)
+            if partial:
+                status.append(html.Div(
+                    f"Showing partial results from {partial['done']} of {partial['total']} sensor files; "
+                    "the figures refine as the search continues.",
+                    className="mt-2 fst-italic"
+                ))
             return (
-                no_update,
-                dbc.Alert("Generating dataset... This may take a few minutes.", color="info"),
+                visuals,
+                dbc.Alert(status, color="info"),
                 1000
             )
         
@@ -226,33 +314,17 @@ def register_callbacks(app, handler):
             try:
                 filename = data['filename']
                 filepath = os.path.join("/home/iaes/DiodeSensor/FM1/output", filename)
-                
-                if not os.path.exists(filepath):
-                    raise FileNotFoundError("Dataset file not found")
-
-                # Get fresh figures and ensure proper conversion
-                figs = get_visualizations(filename, force_refresh=True)
-                visuals = [go.Figure(fig) if isinstance(fig, dict) else fig for fig in figs]
 
-                # Create components in EXACT layout order
-                components = [
-                    dcc.Graph(figure=visuals[0], id='custom-indicator-packets', className="card"),
-                    dcc.Graph(figure=visuals[1], id='custom-indicator-data-points', className="card"),
-                    dcc.Graph(figure=visuals[2], id='custom-indicator-cyber-reports', className="card"),
-                    dcc.Graph(figure=visuals[3], id='custom-treemap', className="card"),
-                    dcc.Graph(figure=visuals[4], id='custom-pie-chart', className="card"),
-                    dcc.Graph(figure=visuals[5], id='custom-hourly-heatmap', className="card"),
-                    dcc.Graph(figure=visuals[6], id='custom-daily-heatmap', className="card"),
-                    dcc.Graph(figure=visuals[7], id='custom-sankey-diagram', className="card"),
-                    dcc.Graph(figure=visuals[8], id='custom-sankey-heatmap-diagram', className="card"),
-                    dcc.Graph(figure=visuals[9], id='custom-protocol-pie-chart', className="card"),
-                    dcc.Graph(figure=visuals[10], id='custom-parallel-categories', className="card"),
-                    dcc.Graph(figure=visuals[11], id='custom-stacked-area', className="card"),
-                    dcc.Graph(figure=visuals[12], id='custom-anomalies-scatter', className="card")
-                ]
+                # the job normally cached the figures itself; fall back to the exported file
+                figs = cached_figures(filename)
+                if figs is None:
+                    if not os.path.exists(filepath):
+                        raise FileNotFoundError("Dataset file not found")
+                    # Get fresh figures and ensure proper conversion
+                    figs = get_visualizations(filename, force_refresh=True)
 
                 return (
-                    components,
+                    {'figs': figs},
                     dbc.Alert("Data loaded successfully!", color="success", duration=4000),
                     no_update
                 )
@@ -260,7 +332,7 @@ def register_callbacks(app, handler):
             except Exception as e:
                 logger.error(f"Display error: {str(e)}", exc_info=True)
                 return (
-                    [dcc.Graph(className="card") for _ in range(13)],
+                    {'figs': empty_figures()},
                     dbc.Alert(f"Display error: {str(e)}", color="danger"),
                     no_update
                 )
@@ -274,28 +346,94 @@ def register_callbacks(app, handler):
         
         return no_update, no_update, no_update
 
+    app.clientside_callback(
+        APPLY_THEME_JS,
+        [
+            Output('custom-indicator-packets', 'figure'),
+            Output('custom-indicator-data-points', 'figure'),
+            Output('custom-indicator-cyber-reports', 'figure'),
+            Output('custom-treemap', 'figure'),
+            Output('custom-pie-chart', 'figure'),
+            Output('custom-hourly-heatmap', 'figure'),
+            Output('custom-daily-heatmap', 'figure'),
+            Output('custom-sankey-diagram', 'figure'),
+            Output('custom-sankey-heatmap-diagram', 'figure'),
+            Output('custom-protocol-pie-chart', 'figure'),
+            Output('custom-parallel-categories', 'figure'),
+            Output('custom-stacked-area', 'figure'),
+            Output('custom-anomalies-scatter', 'figure'),
+        ],
+        Input('custom-visuals-store', 'data'),
+        State('theme-store', 'data'),
+        prevent_initial_call=True
+    )
+
     @app.callback(
         Output('cleanup-dummy', 'data'),
         Input('cleanup-interval', 'n_intervals')
     )
     def trigger_cleanup(n):
-        clean_old_custom_files()
+        clean_old_custom_files(handler.aggregator.result_cache)
         return no_update
 
-def clean_old_custom_files():
-    """Remove custom JSON files older than 1 hour"""
-    output_dir = "/home/iaes/DiodeSensor/FM1/output"
-    now = datetime.now()
-    
-    for entry in os.scandir(output_dir):
-        if entry.name.startswith("custom_") and entry.name.endswith(".json"):
-            try:
-                # Clear associated cache entries
-                cache.delete(f'cached_data_{entry.name}')
-                cache.delete(f'visualizations_{entry.name}')
-                file_time = datetime.fromtimestamp(entry.stat().st_mtime)
-                if (now - file_time) > timedelta(hours=1):
-                    os.remove(entry.path)
-                    print(f"Cleaned up old custom file: {entry.name}")
-            except Exception as e:
-                print(f"Error cleaning file {entry.name}: {e}")
\ No newline at end of file
+def clean_old_custom_files(result_cache):
+    """Evict expired custom results and drop their cached figures"""
+    try:
+        evicted = result_cache.evict()
+    except Exception as e:
+        print(f"Error cleaning custom results: {e}")
+        return
+    for filename in evicted:
+        cache.delete(f'cached_data_{filename}')
+        cache.delete(f'visualizations_{filename}')
+        cache.delete(f'treemap_flows_{filename}')
+        print(f"Cleaned up old custom file: {filename}")
+
+def treemap_drilldown(filename, click_data):
+    """The treemap rooted at the clicked node, or one level up when its root was clicked"""
+    point = ((click_data or {}).get('points') or [{}])[0]
+    node = point.get('id')
+    if not node or not filename:
+        return no_update
+    # ids are the node's path below the root, see data_processing.treemap_figure
+    path = node.split('/')[1:]
+    if not point.get('parent'):
+        if not path:
+            return no_update
+        root = path[:-1]
+    elif OTHERS in path or len(path) >= len(FLOW_COLUMNS):
+        # folded branches and single protocols have nothing further to show
+        return no_update
+    else:
+        root = path
+    flows = cached_flows(filename)
+    if flows is None:
+        return no_update
+    return minimize_figure(treemap_figure(flows, root=root))
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+def custom_progress(data):
+    """Status text and progress bar for a custom search that is queued or running"""
+    cost = data.get('cost')
+    size = f" ({cost['files']} sensor files, {cost['bytes'] / 1024 ** 2:.0f} MB)" if cost else ""
+    if data.get('state') == 'pending':
+        return [html.Div(f"Queued{size}, waiting for a free worker..."), dbc.Progress(value=0, className="mt-2")]
+    percent = round((data.get('progress') or 0.0) * 100)
+    text = f"Generating dataset{size}: {percent}%"
+    if data.get('eta') is not None:
+        text += f", about {format_duration(data['eta'])} left"
+    return [
+        html.Div(text),
+        dbc.Progress(value=percent, label=f"{percent}%", striped=True, animated=True, className="mt-2"),
+    ]
+
+def search_owner(store_data):
+    """(user, client) a custom search belongs to; the client id tells one user's tabs apart"""
+    user = current_user.get_id() if current_user.is_authenticated else None
+    client = (store_data or {}).get('client') or uuid.uuid4().hex
+    return user, client
@@ -1,119 +1,804 @@
 import os
 import json
+import atexit
 import gc
 from datetime import datetime, timedelta
 import time
 import psutil
-import hashlib
 from collections import deque
 import threading
+import multiprocessing
+import shutil
+import tempfile
+import contextlib
+import sqlite3
+import ijson
+import orjson
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from rolling_windows import RollingWindowEngine, append_file
+from sensor_index import SensorFileIndex
+from custom_query import CompiledQuery, compile_filters
+from result_cache import CustomResultCache, custom_task_id, source_digest
+from record_store import RecordStore
+from sensor_archive import SensorArchive, archive_available, split_member, read_member
+from task_scheduler import CustomTaskScheduler, JobCancelled, check_cancelled
+from ndjson_codec import (
+    CODECS, available as codec_available, codec_for, compress, decompress,
+    stored_path, logical_path, dataset_path, remove_variants, decode_frame,
+)
+from connection_merge import MergedTimeframeWriter, read_spool_frame
+from rollups import RollupStore, build_cube, merge_cubes, write_cube, rollups_available, remove_rollup_pointer
+from columnar import (
+    available as columnar_available, columnar_path, ndjson_to_parquet,
+    snapshot_pointer_path, publish_snapshot, remove_snapshot,
+)
 
 def log_memory_usage():
     process = psutil.Process(os.getpid())
     print(f"\033[38;2;255;165;0mMemory usage: {process.memory_info().rss / 1024 ** 2:.2f} MB\033[0m")
 
+# Define expected fields and their cleaning functions
+FIELD_CLEANERS = {
+    "PROTOCOL": lambda x: x.strip(),
+    "SRCIP": lambda x: x.strip(),
+    "DSTIP": lambda x: x.strip(),
+    "TOTPACKETS": lambda x: int(x) if str(x).isdigit() else 0,
+    "TOTDATA": lambda x: float(str(x).replace(" MB", "").strip()) if "MB" in str(x) else 0.0,
+    "SRCPORT": lambda x: x.strip(),
+    "DSTPORT": lambda x: x.strip()
+}
+
+TIME_FIELDS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"] + [
+    f"{h}{ampm}" for ampm in ["AM", "PM"] for h in ["12"] + [str(i) for i in range(1,12)]
+]
+
+def clean_entry(entry):
+    """Clean and validate individual data entries"""
+    cleaned = {}
+    for field, cleaner in FIELD_CLEANERS.items():
+        try:
+            cleaned[field] = cleaner(entry.get(field, ""))
+        except Exception as e:
+            print(f"\033[33mError cleaning {field}: {e}\033[0m")
+            cleaned[field] = None
+
+    # Clean time fields with validation
+    for field in TIME_FIELDS:
+        try:
+            cleaned[field] = int(entry.get(field, 0))
+        except ValueError:
+            cleaned[field] = 0
+
+    return cleaned
+
+STRING_FIELDS = ["PROTOCOL", "SRCIP", "DSTIP", "SRCPORT", "DSTPORT"]
+CLEANED_COLUMNS = list(FIELD_CLEANERS) + TIME_FIELDS
+CLEAN_BATCH_SIZE = 20000
+COMPACT_HOURS_PER_CYCLE = 48
+
+def _int_or_zero(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def _clean_string_column(field, values):
+    try:
+        return [value.strip() for value in values]
+    except AttributeError:
+        pass
+    # something in the block is not a string; match the per-record path, which maps it to None
+    cleaned = [value.strip() if isinstance(value, str) else None for value in values]
+    print(f"\033[33mError cleaning {field}: {cleaned.count(None)} non-string values\033[0m")
+    return cleaned
+
+def _clean_packets_column(values):
+    array = np.asarray(values)
+    if array.dtype.kind == "i":
+        return np.where(array >= 0, array, 0)
+    return np.array([FIELD_CLEANERS["TOTPACKETS"](value) for value in values], dtype=object)
+
+def _clean_data_column(values):
+    text = [str(value) for value in values]
+    has_mb = np.array(["MB" in value for value in text], dtype=bool)
+    parsed = pd.to_numeric(
+        pd.Series([value.replace(" MB", "").strip() for value in text], dtype=object), errors="coerce"
+    ).to_numpy(dtype=float)
+    cleaned = np.where(has_mb, parsed, 0.0)
+    invalid = np.isnan(cleaned) & has_mb
+    if invalid.any():
+        print(f"\033[33mError cleaning TOTDATA: {int(invalid.sum())} unparseable values\033[0m")
+        cleaned = cleaned.astype(object)
+        cleaned[invalid] = None
+    return cleaned
+
+def _clean_int_columns(columns):
+    """Convert the hourly/daily counters in one 2-D array, falling back per column on odd input"""
+    try:
+        matrix = np.array(columns)
+    except ValueError:
+        matrix = None
+    if matrix is not None and matrix.dtype.kind == "i":
+        return list(matrix)
+    cleaned = []
+    for values in columns:
+        array = np.asarray(values)
+        if array.dtype.kind == "i":
+            cleaned.append(array)
+        else:
+            # mixed or non-integer input keeps the exact per-record int() semantics
+            cleaned.append(np.array([_int_or_zero(value) for value in values], dtype=object))
+    return cleaned
+
+def clean_batch(entries):
+    """Clean a block of raw records column-wise into a DataFrame with the clean_entry schema"""
+    if not entries:
+        return pd.DataFrame(columns=CLEANED_COLUMNS)
+    columns = {}
+    for field in STRING_FIELDS:
+        columns[field] = _clean_string_column(field, [entry.get(field, "") for entry in entries])
+    columns["TOTPACKETS"] = _clean_packets_column([entry.get("TOTPACKETS", "") for entry in entries])
+    columns["TOTDATA"] = _clean_data_column([entry.get("TOTDATA", "") for entry in entries])
+    counters = _clean_int_columns([[entry.get(field, 0) for entry in entries] for field in TIME_FIELDS])
+    columns.update(zip(TIME_FIELDS, counters))
+    return pd.DataFrame(columns, columns=CLEANED_COLUMNS)
+
+def frame_to_ndjson(frame):
+    """Serialize a cleaned frame as NDJSON lines (shortest round-trip floats, like json.dumps)"""
+    if frame.empty:
+        return b""
+    columns = list(frame.columns)
+    rows = zip(*(frame[column].tolist() for column in columns))
+    return b"\n".join([orjson.dumps(dict(zip(columns, row))) for row in rows]) + b"\n"
+
+def frame_from_ndjson(data):
+    """Parse NDJSON lines written by frame_to_ndjson back into a cleaned frame"""
+    return decode_frame(data, CLEANED_COLUMNS)
+
+class InvalidSensorFile(ValueError):
+    """Raised when a sensor file is not a header row followed by records"""
+
+def iter_sensor_entries(file_path):
+    """Stream raw records from one sensor JSON file without loading it whole.
+
+    The header row is validated as soon as it is read. Parse errors are
+    raised to the caller, which decides what to do with records already seen.
+    """
+    with open(file_path, "rb") as f:
+        items = ijson.items(f, "item", use_float=True)
+        header = next(items, None)
+        if header is None:
+            raise InvalidSensorFile("Invalid format")
+
+        # Validate header row
+        if not isinstance(header, list) or len(header) < 20:
+            raise InvalidSensorFile("Invalid header")
+
+        has_rows = False
+        for entry in items:
+            has_rows = True
+            if isinstance(entry, dict):
+                yield entry
+        if not has_rows:
+            raise InvalidSensorFile("Invalid format")
+
+def iter_sensor_records(file_path):
+    """Stream cleaned records from one sensor JSON file, one at a time"""
+    if split_member(file_path):
+        frame = read_member(file_path, CLEANED_COLUMNS)
+        # archived records are already clean; nulls come back as NaN in float columns
+        yield from frame.astype(object).where(frame.notna(), None).to_dict("records")
+        return
+    for entry in iter_sensor_entries(file_path):
+        yield clean_entry(entry)
+
+def iter_sensor_batches(file_path, batch_size=CLEAN_BATCH_SIZE):
+    """Stream cleaned blocks of at most batch_size records from one sensor file as DataFrames"""
+    if split_member(file_path):
+        # an archived file (see sensor_archive) comes back cleaned from its partition
+        frame = read_member(file_path, CLEANED_COLUMNS)
+        for start in range(0, len(frame), batch_size):
+            yield frame.iloc[start:start + batch_size]
+        return
+    block = []
+    for entry in iter_sensor_entries(file_path):
+        block.append(entry)
+        if len(block) >= batch_size:
+            yield clean_batch(block)
+            block = []
+    if block:
+        yield clean_batch(block)
+
+def report_sensor_error(file_path, error):
+    name = os.path.basename(file_path)
+    if isinstance(error, InvalidSensorFile):
+        print(f"\033[33m{error} in {name}\033[0m")
+    elif isinstance(error, ijson.JSONError):
+        print(f"\033[33mInvalid JSON in {name}\033[0m")
+    else:
+        print(f"\033[31mError processing {name}: {error}\033[0m")
+
+def read_sensor_file(file_path):
+    """Read one sensor JSON file (header row followed by records) into cleaned records"""
+    try:
+        return list(iter_sensor_records(file_path))
+    except Exception as e:
+        report_sensor_error(file_path, e)
+        return []
+
+def file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def record_matches_filters(record, filters):
+    return compile_filters(filters).matches(record)
+
+def frame_matches_filters(frame, filters):
+    """Vectorized record_matches_filters over a cleaned frame"""
+    return compile_filters(filters).mask(frame)
+
+def spool_sensor_file(file_path, spool_path, filters=None, collect=False, vectorized=True, cube_path=None):
+    """Stream one sensor file's cleaned records into an NDJSON spool file and return the record count.
+
+    With vectorized set, records are cleaned in column-wise blocks
+    (clean_batch); otherwise one at a time with clean_entry. With a
+    cube_path, the file's unfiltered records are also rolled up there
+    (see rollups.build_cube). A file that fails part way leaves an empty
+    spool and no cube, so a bad sensor file contributes nothing, as if it
+    had been rejected up front. Module level so it can run in a worker
+    process.
+    """
+    count = 0
+    cubes = []
+    query = compile_filters(filters)
+    try:
+        with open(spool_path, "wb") as out:
+            if vectorized:
+                for frame in iter_sensor_batches(file_path):
+                    if cube_path:
+                        cubes.append(build_cube(frame))
+                    if query:
+                        frame = frame[query.mask(frame)]
+                    out.write(frame_to_ndjson(frame))
+                    count += len(frame)
+            else:
+                block = []
+                for item in iter_sensor_records(file_path):
+                    if cube_path:
+                        block.append(item)
+                        if len(block) >= CLEAN_BATCH_SIZE:
+                            cubes.append(build_cube(pd.DataFrame(block)))
+                            block = []
+                    if query and not query.matches(item):
+                        continue
+                    out.write((json.dumps(item) + "\n").encode())
+                    count += 1
+                if block:
+                    cubes.append(build_cube(pd.DataFrame(block)))
+        if cubes:
+            write_cube(merge_cubes(cubes), cube_path)
+        return count
+    except Exception as e:
+        report_sensor_error(file_path, e)
+        open(spool_path, "w").close()
+        return 0
+    finally:
+        if collect:
+            gc.collect()
+
+class TimeframeWriter:
+    """NDJSON output for one timeframe, written to a temp file and swapped in on commit"""
+    def __init__(self, timeframe_key, output_path, codec=None):
+        self.timeframe_key = timeframe_key
+        self.output_path = output_path
+        self.codec = codec
+        self.stored_path = stored_path(output_path, codec)
+        # Use temporary file to prevent partial writes
+        self.temp_path = self.stored_path + ".tmp"
+        self.count = 0
+        self.file = open(self.temp_path, "wb")
+
+    def append_spool(self, spool_path, count):
+        append_file(spool_path, self.file, self.codec)
+        self.count += count
+
+    def commit(self):
+        try:
+            self.file.close()
+            if self.count > 0:
+                os.replace(self.temp_path, self.stored_path)
+                remove_variants(self.output_path, keep=self.stored_path)
+                print(f"\033[32mGenerated {self.timeframe_key} data with {self.count} records\033[0m")
+                return True
+            print(f"\033[33mNo data found for {self.timeframe_key}, skipping file creation\033[0m")
+            os.remove(self.temp_path)
+        except Exception as e:
+            print(f"\033[31mError generating {self.timeframe_key} data: {e}\033[0m")
+            self.discard()
+        return False
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class PartialCustomResult:
+    """Rollup cube of what a running custom search has matched so far.
+
+    Every `every` sensor files the cube is handed to publish(cube, done,
+    total), so long searches can show provisional figures while the scan
+    goes on. Nothing is published for the last file; the finished result
+    takes over from there.
+    """
+    def __init__(self, publish, every, total_files):
+        self.publish = publish
+        self.every = every
+        self.total_files = total_files
+        self.cube = None
+        self.pending = []
+        self.files = 0
+
+    def add(self, frame):
+        self.files += 1
+        if len(frame):
+            self.pending.append(build_cube(frame))
+        if self.files % self.every == 0 and self.files < self.total_files:
+            self.cube = merge_cubes(([self.cube] if self.cube is not None else []) + self.pending)
+            self.pending = []
+            self.publish(self.cube, self.files, self.total_files)
+
+
 class NetworkDataAggregator:
-    def __init__(self, watch_directory, output_folder):
+    def __init__(self, watch_directory, output_folder, workers=1, vectorized=True, columnar=False, snapshots=False,
+                 rollups=False, merge_connections=False, partial_every=0, export_custom=True, record_store=False,
+                 archive=False, compression=None):
         self.watch_directory = watch_directory
         self.output_folder = output_folder
         os.makedirs(self.output_folder, exist_ok=True)
+        # collector bookkeeping lives in a subdirectory so the dashboard's watcher ignores it
+        self.state_dir = os.path.join(self.output_folder, ".state")
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.index = SensorFileIndex(
+            watch_directory, os.path.join(self.state_dir, "sensor_index.json"), self.extract_timestamp
+        )
 
-        # Define expected fields and their cleaning functions
-        self.field_cleaners = {
-            "PROTOCOL": lambda x: x.strip(),
-            "SRCIP": lambda x: x.strip(),
-            "DSTIP": lambda x: x.strip(),
-            "TOTPACKETS": lambda x: int(x) if str(x).isdigit() else 0,
-            "TOTDATA": lambda x: float(str(x).replace(" MB", "").strip()) if "MB" in str(x) else 0.0,
-            "SRCPORT": lambda x: x.strip(),
-            "DSTPORT": lambda x: x.strip()
-        }
+        # the collector and the dashboard both spool under .state/spool, so each process
+        # gets a directory of its own and only ever removes that one
+        spool_root = os.path.join(self.state_dir, "spool")
+        os.makedirs(spool_root, exist_ok=True)
+        self.spool_dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=spool_root)
+        atexit.register(self.remove_spool)
+
+        self.field_cleaners = FIELD_CLEANERS
+        # worker processes for parsing sensor files; 1 keeps everything in-process
+        self.workers = max(1, int(workers or 1))
+        # clean records in column-wise blocks instead of one dict at a time
+        self.vectorized = vectorized
+        # also publish each dataset as typed Parquet for the dashboard to load without parsing
+        self.columnar = columnar
+        # and as versioned Arrow snapshots the dashboard can memory-map
+        self.snapshots = snapshots
+        if (columnar or snapshots) and not columnar_available():
+            print("\033[33mpyarrow is not installed, writing NDJSON only\033[0m")
+            self.columnar = self.snapshots = False
+        # fold the cumulative snapshots in each timeframe into one row per connection
+        self.merge_connections = merge_connections
+        # per-file and per-hour rollup cubes the dashboard merges instead of scanning records
+        self.rollups = None
+        if rollups and merge_connections:
+            # cubes add up every snapshot and would disagree with the merged timeframes
+            print("\033[33mRollup cubes are not used with merged connections\033[0m")
+        elif rollups:
+            if rollups_available():
+                self.rollups = RollupStore(self.output_folder)
+            else:
+                print("\033[33mpyarrow is not installed, rollup cubes disabled\033[0m")
+        # gzip or zstd for the NDJSON outputs, one frame per sensor file; the suffix names the codec
+        self.compression = compression or None
+        if self.compression not in (None, *CODECS):
+            print(f"\033[33mUnknown compression {self.compression}, writing plain NDJSON\033[0m")
+            self.compression = None
+        elif not codec_available(self.compression):
+            print(f"\033[33m{self.compression} needs pyarrow, using gzip instead\033[0m")
+            self.compression = "gzip"
+        # finished custom searches, reused while the same query still covers the same files
+        self.result_cache = CustomResultCache(
+            self.output_folder, self.state_dir, codec=self.compression,
+            max_bytes=int(float(os.getenv("CUSTOM_CACHE_MB", 2048)) * 1024 ** 2),
+            max_age=float(os.getenv("CUSTOM_CACHE_HOURS", 24)) * 3600,
+            remove_siblings=self.remove_columnar,
+        )
+        # publish provisional figures of custom searches every this many files (0 turns it off)
+        self.partial_every = partial_every
+        # without the export a custom search only feeds its records to the caller's sink
+        self.export_custom = export_custom
+        # indexed copy of the cleaned records that custom searches query instead of scanning
+        self.record_store = None
+        if record_store:
+            self.record_store = RecordStore(
+                self.state_dir, CLEANED_COLUMNS, retention_days=float(os.getenv("RECORD_STORE_DAYS", 14))
+            )
+        # closed hours compacted into Parquet partitions; custom searches read and prune those
+        self.archive = None
+        if archive:
+            if archive_available():
+                raw_days = float(os.getenv("ARCHIVE_RAW_DAYS", 0))
+                self.archive = SensorArchive(
+                    self.state_dir,
+                    retention_days=float(os.getenv("ARCHIVE_DAYS", 90)),
+                    # the standard timeframes still read raw files, so keep a week and a day of them
+                    raw_days=max(raw_days, 8) if raw_days else 0,
+                    file_timestamp=self.extract_timestamp,
+                )
+            else:
+                print("\033[33mpyarrow is not installed, sensor archive disabled\033[0m")
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.pool = None
+        # custom jobs run on several threads and share the pool
+        self.pool_lock = threading.Lock()
 
     def process_file(self, file_path):
         """Process individual JSON files with header handling"""
         try:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                
-                if not isinstance(data, list) or len(data) < 2:
-                    print(f"\033[33mInvalid format in {os.path.basename(file_path)}\033[0m")
-                    return []
-
-                # Validate header row
-                header = data[0]
-                if not isinstance(header, list) or len(header) < 20:
-                    print(f"\033[33mInvalid header in {os.path.basename(file_path)}\033[0m")
-                    return []
-
-                # Process records
-                return [self.clean_entry(entry) for entry in data[1:] if isinstance(entry, dict)]
-                
-        except json.JSONDecodeError:
-            print(f"\033[33mInvalid JSON in {os.path.basename(file_path)}\033[0m")
-            return []
-        except Exception as e:
-            print(f"\033[31mError processing {os.path.basename(file_path)}: {e}\033[0m")
-            return []
+            return read_sensor_file(file_path)
         finally:
             gc.collect()
 
     def clean_entry(self, entry):
         """Clean and validate individual data entries"""
-        cleaned = {}
-        for field, cleaner in self.field_cleaners.items():
-            try:
-                cleaned[field] = cleaner(entry.get(field, ""))
-            except Exception as e:
-                print(f"\033[33mError cleaning {field}: {e}\033[0m")
-                cleaned[field] = None
-        
-        # Clean time fields with validation
-        time_fields = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"] + [
-            f"{h}{ampm}" for ampm in ["AM", "PM"] for h in ["12"] + [str(i) for i in range(1,12)]
-        ]
-        for field in time_fields:
+        return clean_entry(entry)
+
+    def get_pool(self):
+        with self.pool_lock:
+            if self.pool is None:
+                # spawn rather than fork: the web process runs this next to flask and watchdog threads
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self.pool
+
+    def close(self):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+                self.pool = None
+
+    def remove_spool(self):
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def iter_spooled_files(self, file_paths, filters=None):
+        """Yield (file_path, record_count, spool_path) for each file in order.
+
+        Files are streamed into NDJSON spool files, by the worker pool when
+        enabled, so neither side ever holds a whole sensor file in memory.
+        A spool file is removed once the consumer moves on to the next one.
+        Unfiltered passes also roll up any file the rollup store is missing
+        and load it into the record store.
+        """
+        file_paths = list(file_paths)
+        # compiled once here and shipped to the workers ready to evaluate
+        filters = compile_filters(filters) or None
+
+        def cube_path_for(file_path):
+            if self.rollups is None or filters or split_member(file_path) or not self.rollups.needs(file_path):
+                return None
+            return self.new_spool_path(suffix=".parquet")
+
+        def finish(file_path, cube_path, spool_path):
+            if self.record_store is not None and not filters and not split_member(file_path) \
+                    and self.record_store.needs(file_path):
+                try:
+                    with open(spool_path, "rb") as spool:
+                        frame = frame_from_ndjson(spool.read())
+                    self.record_store.add_file(file_path, self.extract_timestamp(os.path.basename(file_path)), frame)
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    print(f"\033[33mCould not store records of {os.path.basename(file_path)}: {e}\033[0m")
+            if cube_path is None:
+                return
             try:
-                cleaned[field] = int(entry.get(field, 0))
-            except ValueError:
-                cleaned[field] = 0
-        
-        return cleaned
+                self.rollups.add_file(file_path, self.extract_timestamp(os.path.basename(file_path)), cube_path)
+            except (OSError, ValueError) as e:
+                print(f"\033[33mCould not roll up {os.path.basename(file_path)}: {e}\033[0m")
+            finally:
+                if os.path.exists(cube_path):
+                    os.remove(cube_path)
+
+        def run_serially(paths):
+            for file_path in paths:
+                spool_path = self.new_spool_path()
+                cube_path = cube_path_for(file_path)
+                try:
+                    count = spool_sensor_file(
+                        file_path, spool_path, filters, collect=True, vectorized=self.vectorized, cube_path=cube_path
+                    )
+                    finish(file_path, cube_path, spool_path)
+                    yield file_path, count, spool_path
+                finally:
+                    os.remove(spool_path)
+                    if cube_path and os.path.exists(cube_path):
+                        os.remove(cube_path)
+
+        if self.workers <= 1 or len(file_paths) <= 1:
+            yield from run_serially(file_paths)
+            return
+
+        pool = self.get_pool()
+        pending = deque()
+        position = 0
+        try:
+            while position < len(file_paths) or pending:
+                # keep a bounded number of files in flight so spools never pile up
+                while position < len(file_paths) and len(pending) < self.workers * 2:
+                    file_path = file_paths[position]
+                    spool_path = self.new_spool_path()
+                    cube_path = cube_path_for(file_path)
+                    future = pool.submit(
+                        spool_sensor_file, file_path, spool_path, filters, vectorized=self.vectorized, cube_path=cube_path
+                    )
+                    pending.append((file_path, spool_path, cube_path, future))
+                    position += 1
+                file_path, spool_path, cube_path, future = pending[0]
+                count = future.result()
+                pending.popleft()
+                try:
+                    finish(file_path, cube_path, spool_path)
+                    yield file_path, count, spool_path
+                finally:
+                    os.remove(spool_path)
+        except BrokenProcessPool as e:
+            print(f"\033[31mParser pool failed ({e}), continuing serially\033[0m")
+            self.close()
+            remaining = [path for path, _, _, _ in pending] + file_paths[position:]
+            for _, spool_path, cube_path, _ in pending:
+                for path in (spool_path, cube_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+            pending.clear()
+            yield from run_serially(remaining)
+        finally:
+            for _, spool_path, cube_path, future in pending:
+                future.cancel()
+                try:
+                    future.result()
+                except Exception:
+                    pass
+                for path in (spool_path, cube_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+
+    def update_rollups(self, cutoffs):
+        """Bring the rollup cubes and each timeframe's .rollup pointer up to date"""
+        outputs = {key: os.path.join(self.output_folder, f"{key}_data.json") for key in cutoffs}
+        if self.rollups is None:
+            # a stale pointer would keep the dashboard on old cubes
+            for output_path in outputs.values():
+                remove_rollup_pointer(output_path)
+            return
+
+        oldest_cutoff = min(cutoffs.values())
+        current = self.index.lookup(start=oldest_cutoff)
+        self.rollups.sync(current, oldest_cutoff)
+        # files the window pass did not parse this cycle, e.g. right after rollups were enabled
+        missing = [file_path for _, file_path in current if self.rollups.needs(file_path)]
+        if missing:
+            print(f"\033[36mRolling up {len(missing)} sensor files\033[0m")
+            for _ in self.iter_spooled_files(missing):
+                pass
+        self.rollups.flush_hours()
+        for timeframe_key, cutoff in cutoffs.items():
+            self.rollups.publish_window(outputs[timeframe_key], cutoff)
+        self.rollups.save_manifest()
+        print(f"\033[32mRollups cover {len(self.rollups.manifest['hours'])} hours\033[0m")
+
+    def update_record_store(self):
+        """Expire old files from the record store and load the ones it is missing"""
+        if self.record_store is None:
+            return
+        oldest = datetime.now() - timedelta(days=self.record_store.retention_days)
+        current = self.index.lookup(start=oldest)
+        self.record_store.sync(current, oldest)
+        known = self.record_store.file_info()
+        missing = [file_path for _, file_path in current if self.record_store.needs(file_path, known)]
+        if missing:
+            print(f"\033[36mLoading {len(missing)} sensor files into the record store\033[0m")
+            for _ in self.iter_spooled_files(missing):
+                pass
+        print(f"\033[32mRecord store covers {len(current)} sensor files\033[0m")
+
+    def compact_archive(self, max_hours=COMPACT_HOURS_PER_CYCLE):
+        """Compact closed hours into archive partitions, then apply the retention limits"""
+        if self.archive is None:
+            return
+        now = datetime.now()
+        self.archive.refresh()
+        current = self.index.lookup()
+        pending = self.archive.pending(current, now)
+        # oldest first, a bounded number per cycle so a long backlog does not stall the timeframes
+        for hour in sorted(pending)[:max_hours]:
+            frames = []
+            paths = [file_path for _, file_path in pending[hour]]
+            timestamps = dict((file_path, timestamp) for timestamp, file_path in pending[hour])
+            for file_path, count, spool_path in self.iter_spooled_files(paths):
+                with open(spool_path, "rb") as spool:
+                    frames.append((timestamps[file_path], file_path, frame_from_ndjson(spool.read())))
+            self.archive.write_partition(hour, frames)
+            self.archive.save_manifest()
+        if pending:
+            print(f"\033[32mArchived {min(len(pending), max_hours)} of {len(pending)} pending hours\033[0m")
+        expired = self.archive.expire(now)
+        removed = self.archive.remove_raw(current, now)
+        if expired or removed:
+            self.archive.save_manifest()
+            print(f"\033[36mArchive retention removed {len(expired)} partitions and {removed} raw sensor files\033[0m")
+
+    def sensor_files(self, start_datetime, end_datetime):
+        """Paths of the sensor files in range, oldest first, archived copies preferred over raw ones"""
+        files = self.index.lookup(start_datetime, end_datetime)
+        if self.archive is None:
+            return [file_path for _, file_path in files]
+        self.archive.refresh()
+        members = self.archive.lookup(start_datetime, end_datetime)
+        archived = {os.path.basename(path) for _, path in members}
+        # a raw file that changed after it was archived is read raw until it is compacted again
+        stale = {
+            os.path.basename(file_path) for timestamp, file_path in files
+            if os.path.basename(file_path) in archived and not self.archive.archived(timestamp, file_path)
+        }
+        entries = [(timestamp, path) for timestamp, path in members if os.path.basename(path) not in stale]
+        entries += [(timestamp, path) for timestamp, path in files
+                    if os.path.basename(path) not in archived or os.path.basename(path) in stale]
+        entries.sort(key=lambda entry: (entry[0], os.path.basename(entry[1])))
+        return [path for _, path in entries]
+
+    def sensor_size(self, file_path):
+        if split_member(file_path):
+            return self.archive.member_size(file_path)
+        return file_size(file_path)
+
+    def may_match(self, file_path, query):
+        """False for an archived file whose partition summary rules the query out"""
+        return not (query and split_member(file_path) and self.archive is not None) \
+            or self.archive.may_match(file_path, query)
+
+    def publish_columnar(self, output_path, only_if_stale=False):
+        """Write the Parquet sibling and Arrow snapshot of a finished NDJSON dataset"""
+        output_path = logical_path(output_path)
+        parquet_path = columnar_path(output_path)
+        pointer_path = snapshot_pointer_path(output_path)
+        # leftovers from an earlier run would shadow the fresh NDJSON in the dashboard
+        if not self.columnar and os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        if not self.snapshots and os.path.exists(pointer_path):
+            remove_snapshot(pointer_path)
+
+        def stale(path):
+            return not only_if_stale or not os.path.exists(path) \
+                or os.path.getmtime(path) < os.path.getmtime(dataset_path(output_path))
+
+        try:
+            if self.columnar and stale(parquet_path):
+                ndjson_to_parquet(output_path, parquet_path)
+            if self.snapshots and stale(pointer_path):
+                publish_snapshot(output_path)
+        except Exception as e:
+            print(f"\033[31mError writing columnar copy of {os.path.basename(output_path)}: {e}\033[0m")
+
+    def remove_columnar(self, output_path):
+        """Remove the Parquet copy and snapshots published for a dataset"""
+        output_path = logical_path(output_path)
+        parquet_path = columnar_path(output_path)
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        pointer_path = snapshot_pointer_path(output_path)
+        if os.path.exists(pointer_path):
+            remove_snapshot(pointer_path)
+
+    def new_spool_path(self, suffix=".ndjson"):
+        fd, spool_path = tempfile.mkstemp(suffix=suffix, dir=self.spool_dir)
+        os.close(fd)
+        return spool_path
 
     def generate_timeframe_data(self, timeframe_key, cutoff_time):
         """Generate dataset for specific timeframe"""
-        output_path = os.path.join(self.output_folder, f"{timeframe_key}_data.json")
-        
-        # Use temporary file to prevent partial writes
-        temp_path = output_path + ".tmp"
-        processed_count = 0
-        
+        self.generate_timeframes({timeframe_key: cutoff_time})
+
+    def generate_timeframes(self, cutoffs):
+        """Generate datasets for several timeframes in a single pass.
+
+        Every sensor file is parsed and cleaned once and its records are
+        fanned out to each timeframe whose cutoff the file falls within.
+        """
+        if not cutoffs:
+            return
+        if self.merge_connections:
+            return self.generate_merged_timeframes(cutoffs)
+
+        oldest_cutoff = min(cutoffs.values())
+        writers = {}
         try:
-            with open(temp_path, "w") as output_file:
-                for entry in os.scandir(self.watch_directory):
-                    if entry.is_file() and entry.name.endswith("jsonALLConnections.json"):
-                        try:
-                            timestamp = self.extract_timestamp(entry.name)
-                            if timestamp >= cutoff_time:
-                                items = self.process_file(entry.path)
-                                for item in items:
-                                    output_file.write(json.dumps(item) + "\n")
-                                processed_count += len(items)
-                                gc.collect()
-                        except ValueError as e:
-                            print(f"\033[33mSkipping {entry.name}: {e}\033[0m")
-                            continue
-            
-            if processed_count > 0:
-                os.replace(temp_path, output_path)
-                print(f"\033[32mGenerated {timeframe_key} data with {processed_count} records\033[0m")
-            else:
-                print(f"\033[33mNo data found for {timeframe_key}, skipping file creation\033[0m")
-                os.remove(temp_path)
-                
+            for timeframe_key in cutoffs:
+                output_path = os.path.join(self.output_folder, f"{timeframe_key}_data.json")
+                writers[timeframe_key] = TimeframeWriter(timeframe_key, output_path, self.compression)
+
+            files = self.index.lookup(start=oldest_cutoff)
+            timestamps = {file_path: timestamp for timestamp, file_path in files}
+            for file_path, count, spool_path in self.iter_spooled_files(timestamps):
+                for timeframe_key, writer in writers.items():
+                    if timestamps[file_path] >= cutoffs[timeframe_key]:
+                        writer.append_spool(spool_path, count)
         except Exception as e:
-            print(f"\033[31mError generating {timeframe_key} data: {e}\033[0m")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            print(f"\033[31mError generating {', '.join(cutoffs)} data: {e}\033[0m")
+            for writer in writers.values():
+                writer.discard()
+            return
+
+        for writer in writers.values():
+            if writer.commit():
+                self.publish_columnar(writer.output_path)
+
+    def merged_sources(self, oldest_cutoff):
+        """[(timestamp, file_path)] a merged pass reads: the window, plus the last snapshot before it"""
+        files = self.index.lookup(start=oldest_cutoff)
+        earlier = self.index.lookup(end=oldest_cutoff)
+        if earlier and earlier[-1][0] < oldest_cutoff:
+            files = [earlier[-1]] + files
+        return files
+
+    def iter_spooled_frames(self, file_paths, columns):
+        """Yield (file_path, frame) of cleaned records for each file in order"""
+        for file_path, count, spool_path in self.iter_spooled_files(file_paths):
+            yield file_path, read_spool_frame(spool_path, columns)
+
+    def generate_merged_timeframes(self, cutoffs, read_frames=None):
+        """generate_timeframes, but each timeframe keeps one row per connection.
+
+        Each timeframe is seeded with the last snapshot before its cutoff so
+        the first interval's deltas have a baseline. Frames come from
+        read_frames(file_paths, columns), by default freshly parsed sensor
+        files. Returns the timeframes whose output was written.
+        """
+        oldest_cutoff = min(cutoffs.values())
+        timestamps = {file_path: timestamp for timestamp, file_path in self.merged_sources(oldest_cutoff)}
+        read_frames = read_frames or self.iter_spooled_frames
+
+        writers = {}
+        baselines = {}
+        for timeframe_key, cutoff in cutoffs.items():
+            output_path = os.path.join(self.output_folder, f"{timeframe_key}_data.json")
+            writers[timeframe_key] = MergedTimeframeWriter(
+                timeframe_key, output_path, CLEANED_COLUMNS, self.compression
+            )
+            before = [file_path for file_path, timestamp in timestamps.items() if timestamp < cutoff]
+            baselines[timeframe_key] = before[-1] if before else None
+
+        try:
+            for file_path, frame in read_frames(timestamps, CLEANED_COLUMNS):
+                targets = [
+                    key for key in writers
+                    if timestamps[file_path] >= cutoffs[key] or baselines[key] == file_path
+                ]
+                for timeframe_key in targets:
+                    if baselines[timeframe_key] == file_path:
+                        writers[timeframe_key].seed(frame)
+                    else:
+                        writers[timeframe_key].add(frame, timestamps[file_path])
+        except Exception as e:
+            print(f"\033[31mError generating {', '.join(cutoffs)} data: {e}\033[0m")
+            for writer in writers.values():
+                writer.discard()
+            return []
+
+        committed = []
+        for timeframe_key, writer in writers.items():
+            if writer.commit(frame_to_ndjson):
+                self.publish_columnar(writer.output_path)
+                committed.append(timeframe_key)
+        return committed
 
     def extract_timestamp(self, filename):
         """Extract timestamp from filename with validation"""
@@ -129,138 +814,376 @@ class NetworkDataAggregator:
         except Exception as e:
             raise ValueError(f"Invalid timestamp in filename: {filename}") from e
         
-    def generate_custom_dataset(self, start_datetime, end_datetime, filters=None):
-        timeframe_str = f"{start_datetime:%Y%m%d%H%M%S}_{end_datetime:%Y%m%d%H%M%S}"
-        filename_hash = hashlib.md5(timeframe_str.encode()).hexdigest()[:8]
-        output_path = os.path.join(self.output_folder, f"custom_{filename_hash}.json")
-        temp_path = output_path + ".tmp"
-        if os.path.exists(output_path):
-            print(f"using existing dataset: {output_path}")
-            return output_path
+    def estimate_custom_cost(self, start_datetime, end_datetime):
+        """Sensor files and bytes a custom search over this range would have to read"""
+        files = self.sensor_files(start_datetime, end_datetime)
+        return {"files": len(files), "bytes": sum(self.sensor_size(file_path) for file_path in files)}
+
+    def generate_custom_dataset(self, start_datetime, end_datetime, filters=None, cancel=None, progress=None,
+                                partial=None, sink=None):
+        """Build (or reuse) a custom search result.
+
+        Raises JobCancelled once cancel is set; progress(done, total) is
+        called as sensor files (or cached segments) are worked through,
+        and partial(cube, done, total) with the provisional result of
+        long scans (see PartialCustomResult). A freshly built result also
+        hands each file's matched records to sink(frame); a reused one
+        does not.
+        """
+        query = compile_filters(filters)
+        task_id = custom_task_id(start_datetime, end_datetime, query)
+        json_files = self.sensor_files(start_datetime, end_datetime)
+        sources = source_digest(json_files)
 
-        json_files = []
-        for entry in os.scandir(self.watch_directory):
-            if entry.is_file() and entry.name.endswith("jsonALLConnections.json"):
+        # identical searches running at the same time share one scan
+        while True:
+            with self.inflight_lock:
+                done = self.inflight.get(task_id)
+                if done is None:
+                    self.inflight[task_id] = threading.Event()
+                    break
+            done.wait()
+            cached = self.result_cache.get(task_id, sources)
+            if cached:
+                return cached
+            # the other scan was cancelled or found nothing; take over unless this one is cancelled too
+            check_cancelled(cancel)
+
+        try:
+            cached = self.result_cache.get(task_id, sources)
+            if cached:
+                print(f"using cached dataset: {cached}")
+                self.publish_columnar(cached, only_if_stale=True)
+                return cached
+            parent_id, parent = self.result_cache.find_superset(
+                start_datetime, end_datetime, query, self.custom_sources
+            )
+            # deriving writes a new result file, which is exactly what an unexported search avoids
+            if parent is not None and self.export_custom:
+                derived = self.derive_custom_dataset(
+                    task_id, parent_id, parent, sources, query, start_datetime, end_datetime,
+                    cancel, progress, partial, sink
+                )
+                if derived:
+                    return derived
+            if self.record_store is not None and self.record_store.covers(json_files):
                 try:
-                    file_dt = self.extract_timestamp(entry.name)
-                    if start_datetime <= file_dt <= end_datetime:
-                        json_files.append(entry.path)
-                except Exception as e:
-                    continue
-
-        all_data = []
-        for file_path in json_files:
-            file_data = self.process_file(file_path)
-            for record in file_data:
-                if filters and not self.record_matches_filters(record, filters):
-                    continue
-                all_data.append(record)
-        if not all_data:
-            print("no data collected for custom timeframe with given filters")
+                    return self.query_custom_dataset(
+                        task_id, json_files, sources, query, start_datetime, end_datetime,
+                        cancel, progress, partial, sink
+                    )
+                except sqlite3.Error as e:
+                    print(f"\033[33mRecord store query failed, scanning sensor files instead: {e}\033[0m")
+            return self.build_custom_dataset(
+                task_id, json_files, sources, query, start_datetime, end_datetime, cancel, progress, partial, sink
+            )
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(task_id).set()
+
+    def custom_sources(self, start_datetime, end_datetime):
+        return source_digest(self.sensor_files(start_datetime, end_datetime))
+
+    def partial_result(self, partial, total_files):
+        if partial is None or not self.partial_every or total_files <= self.partial_every:
             return None
+        return PartialCustomResult(partial, self.partial_every, total_files)
+
+    def build_custom_dataset(self, task_id, json_files, sources, query, start_datetime, end_datetime,
+                             cancel=None, progress=None, partial=None, sink=None):
+        output_path = self.result_cache.path_for(task_id)
+        temp_path = output_path + ".tmp"
+        total_count = 0
+        # byte range of each sensor file's matches, so narrower searches can be cut from this one
+        segments = []
+        offset = 0
+        sizes = {file_path: self.sensor_size(file_path) for file_path in json_files}
+        total_bytes = sum(sizes.values())
+        # archived hours whose summaries rule the filters out are not even opened
+        scanned = [file_path for file_path in json_files if self.may_match(file_path, query)]
+        done_bytes = total_bytes - sum(sizes[file_path] for file_path in scanned)
+        partial = self.partial_result(partial, len(scanned))
         try:
-            with open(temp_path, "w") as f:
-                for entry in all_data:
-                    f.write(json.dumps(entry) + "\n")
-            os.replace(temp_path, output_path)
-            return output_path
+            with open(temp_path, "wb") if self.export_custom else contextlib.nullcontext() as f:
+                for file_path, count, spool_path in self.iter_spooled_files(scanned, filters=query):
+                    check_cancelled(cancel)
+                    if f is not None:
+                        length = append_file(spool_path, f, self.compression)
+                        name = os.path.basename(file_path)
+                        segments.append([name, self.extract_timestamp(name).isoformat(), offset, offset + length])
+                        offset += length
+                    total_count += count
+                    done_bytes += sizes[file_path]
+                    if progress:
+                        progress(done_bytes, total_bytes)
+                    if partial or sink:
+                        with open(spool_path, "rb") as spool:
+                            frame = frame_from_ndjson(spool.read())
+                        if partial:
+                            partial.add(frame)
+                        if sink and len(frame):
+                            sink(frame)
+            return self.finish_custom_dataset(
+                task_id, temp_path, total_count, sources, query, start_datetime, end_datetime, segments
+            )
+        except JobCancelled:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        except Exception as e:
+            # raised on, so the scheduler marks the search failed instead of "no data found"
+            print(f"\033[31mCustom search {task_id} failed: {e}\033[0m")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def query_custom_dataset(self, task_id, json_files, sources, query, start_datetime, end_datetime,
+                             cancel=None, progress=None, partial=None, sink=None):
+        """Answer a custom search from the record store instead of re-reading the sensor files"""
+        output_path = self.result_cache.path_for(task_id)
+        temp_path = output_path + ".tmp"
+        total_count = 0
+        segments = []
+        offset = 0
+        partial = self.partial_result(partial, len(json_files))
+        matched = []
+        try:
+            with open(temp_path, "wb") if self.export_custom else contextlib.nullcontext() as f:
+                for done, (name, frame) in enumerate(self.record_store.iter_matches(json_files, query), 1):
+                    check_cancelled(cancel)
+                    if f is not None:
+                        data = compress(frame_to_ndjson(frame), self.compression)
+                        f.write(data)
+                        segments.append([name, self.extract_timestamp(name).isoformat(), offset, offset + len(data)])
+                        offset += len(data)
+                    total_count += len(frame)
+                    if progress:
+                        progress(done, len(json_files))
+                    if partial:
+                        partial.add(frame)
+                    if sink and len(frame):
+                        matched.append(frame)
+            # handed over only once the whole query worked; on failure the caller scans instead
+            for frame in matched:
+                sink(frame)
+            result = self.finish_custom_dataset(
+                task_id, temp_path, total_count, sources, query, start_datetime, end_datetime, segments
+            )
+            if result:
+                print(f"answered {os.path.basename(output_path)} from the record store")
+            return result
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def derive_custom_dataset(self, task_id, parent_id, parent, sources, query, start_datetime, end_datetime,
+                              cancel=None, progress=None, partial=None, sink=None):
+        """Cut a custom result out of a cached wider one instead of re-reading the sensor files"""
+        parent_path = self.result_cache.path_for(parent_id)
+        output_path = self.result_cache.path_for(task_id)
+        temp_path = output_path + ".tmp"
+        parent_codec = codec_for(parent_path)
+        # the parent already applied its own filters; only re-filter if this query adds to them
+        refilter = query.key() != CompiledQuery.from_key(parent["filters"]).key()
+        total_count = 0
+        segments = []
+        offset = 0
+        wanted = [
+            segment for segment in parent["segments"]
+            if start_datetime <= datetime.fromisoformat(segment[1]) <= end_datetime
+        ]
+        total_bytes = sum(end - start for _, _, start, end in wanted)
+        done_bytes = 0
+        partial = self.partial_result(partial, len(wanted))
+        matched = []
+        try:
+            with open(parent_path, "rb") as src, open(temp_path, "wb") as f:
+                for name, timestamp, start, end in wanted:
+                    check_cancelled(cancel)
+                    src.seek(start)
+                    # each segment is a frame of its own, so it decompresses without the rest
+                    data = decompress(src.read(end - start), parent_codec)
+                    frame = None
+                    if refilter:
+                        frame = frame_from_ndjson(data)
+                        frame = frame[query.mask(frame)]
+                        data = frame_to_ndjson(frame)
+                    if (partial or sink) and frame is None:
+                        frame = frame_from_ndjson(data)
+                    if partial:
+                        partial.add(frame)
+                    if sink and len(frame):
+                        matched.append(frame)
+                    count = data.count(b"\n")
+                    data = compress(data, self.compression)
+                    f.write(data)
+                    length = len(data)
+                    segments.append([name, timestamp, offset, offset + length])
+                    offset += length
+                    total_count += count
+                    done_bytes += end - start
+                    if progress:
+                        progress(done_bytes, total_bytes)
+            # handed over only once the derivation worked; on failure the caller rescans
+            for frame in matched:
+                sink(frame)
+            print(f"derived {os.path.basename(output_path)} from cached {os.path.basename(parent_path)}")
+            return self.finish_custom_dataset(
+                task_id, temp_path, total_count, sources, query, start_datetime, end_datetime, segments
+            )
+        except JobCancelled:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
         except Exception as e:
+            print(f"\033[33mCould not derive from {os.path.basename(parent_path)}, rescanning: {e}\033[0m")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+
+    def finish_custom_dataset(self, task_id, temp_path, total_count, sources, query, start_datetime, end_datetime, segments):
+        output_path = self.result_cache.path_for(task_id)
+        if not total_count:
+            print("no data collected for custom timeframe with given filters")
             if os.path.exists(temp_path):
                 os.remove(temp_path)
             return None
+        if not os.path.exists(temp_path):
+            # not exported: the name only identifies the result for the caller
+            return output_path
+        os.replace(temp_path, output_path)
+        self.publish_columnar(output_path)
+        self.result_cache.put(
+            task_id, sources, total_count,
+            start=start_datetime.isoformat(), end=end_datetime.isoformat(),
+            filters=query.key(), segments=segments,
+        )
+        return output_path
 
     def record_matches_filters(self, record, filters):
-        for key, value in filters.items():
-            if value and record.get(key, "").strip().lower() != value.lower():
-                return False
-        return True
+        return record_matches_filters(record, filters)
 
 
 class NetworkDataHandler:
-    def __init__(self, aggregator):
+    def __init__(self, aggregator, incremental=True, figure_builder=None):
         self.aggregator = aggregator
-        self.task_queue = deque()
-        self.lock = threading.Lock()
-        self.active_tasks = {}
+        # figure_builder() gives a custom job an (add(frame), finish(filename)) pair, so its records
+        # go straight into the dashboard's figure cache instead of being re-read from the exported file
+        self.figure_builder = figure_builder
+        # incremental mode keeps the timeframe outputs up to date from a manifest
+        # instead of rebuilding them from every sensor file each cycle
+        self.window_engine = RollingWindowEngine(aggregator) if incremental else None
+        # custom searches run on a small worker pool; see task_scheduler.py
+        self.scheduler = CustomTaskScheduler(
+            self.run_custom_job,
+            workers=int(os.getenv("CUSTOM_WORKERS", 2)),
+            max_queue=int(os.getenv("CUSTOM_QUEUE_LIMIT", 20)),
+            per_user=int(os.getenv("CUSTOM_PER_USER", 1)),
+            heartbeat_timeout=float(os.getenv("CUSTOM_HEARTBEAT_SECONDS", 60)),
+            max_bytes=int(float(os.getenv("CUSTOM_MAX_MB", 0)) * 1024 ** 2),
+            heavy_bytes=int(float(os.getenv("CUSTOM_HEAVY_MB", 512)) * 1024 ** 2),
+        )
         self.timeframes = {
             "all": timedelta(days=7),
             "1_hour": timedelta(hours=1),
             "24_hours": timedelta(hours=24)
         }
 
-    def add_custom_task(self, start_datetime, end_datetime, filters=None):
-        timeframe_str = f"{start_datetime:%Y%m%d%H%M%S}_{end_datetime:%Y%m%d%H%M%S}"
-        filename_hash = hashlib.md5(timeframe_str.encode()).hexdigest()[:8]
-        task_id = f"custom_{filename_hash}"
-        
-        with self.lock:
-            if task_id not in self.active_tasks:
-                self.active_tasks[task_id] = {
-                    'status': 'pending',
-                    'filename': f"{task_id}.json",
-                    'created_at': datetime.now(),
-                    'message': None
-                }
-                # include filters in the task tuple
-                self.task_queue.append(('custom', start_datetime, end_datetime, task_id, filters))
-        
-        return task_id
+    @property
+    def lock(self):
+        return self.scheduler.lock
 
-    def process_tasks(self):
-        while True:
-            now = datetime.now()
-            with self.lock:
-                to_remove = [
-                    task_id for task_id, task in self.active_tasks.items()
-                    if (now - task['created_at']).total_seconds() > 3600
-                ]
-                for task_id in to_remove:
-                    del self.active_tasks[task_id]
+    @property
+    def active_tasks(self):
+        return self.scheduler.active_tasks
 
-            if self.task_queue:
-                with self.lock:
-                    task = self.task_queue.popleft()
-                
-                if task[0] == 'custom':
-                    # now task tuple is: ('custom', start, end, task_id, filters)
-                    _, start, end, task_id, filters = task
-                    try:
-                        with self.lock:
-                            self.active_tasks[task_id]['status'] = 'processing'
-                        
-                        result = self.aggregator.generate_custom_dataset(start, end, filters=filters)
-                        
-                        with self.lock:
-                            if result:
-                                self.active_tasks[task_id]['status'] = 'complete'
-                                self.active_tasks[task_id]['filename'] = os.path.basename(result)
-                            else:
-                                self.active_tasks[task_id]['status'] = 'failed'
-                                self.active_tasks[task_id]['message'] = 'No data found in timeframe'
-                    except Exception as e:
-                        with self.lock:
-                            self.active_tasks[task_id]['status'] = 'failed'
-                            self.active_tasks[task_id]['message'] = str(e)
-                    finally:
-                        gc.collect()
-            
-            time.sleep(2)
+    def add_custom_task(self, start_datetime, end_datetime, filters=None, user=None, client=None):
+        # keyed on the normalized query, so the same search with other filters gets its own task
+        task_id = custom_task_id(start_datetime, end_datetime, compile_filters(filters))
+        # cheap searches go first, and oversized ones are turned away before they start
+        cost = self.aggregator.estimate_custom_cost(start_datetime, end_datetime)
+        # an identical search that is queued, running or still cached is shared, anything else reruns
+        return self.scheduler.submit(
+            task_id, (start_datetime, end_datetime, filters), waiter=(user, client), priority=cost["bytes"],
+            reusable=lambda task: task_id in self.aggregator.result_cache, cost=cost,
+        )
+
+    def run_custom_job(self, start_datetime, end_datetime, filters, cancel=None, progress=None, partial=None):
+        matched = []
+        add, finish = self.figure_builder() if self.figure_builder else (None, None)
+
+        def fold(frame):
+            # each frame goes into the figure aggregates as it comes, none of them are kept
+            add(frame)
+            matched.append(len(frame))
+        result = self.aggregator.generate_custom_dataset(
+            start_datetime, end_datetime, filters=filters, cancel=cancel, progress=progress, partial=partial,
+            sink=fold if add else None,
+        )
+        # nothing matched means the result was reused and its figures are (or were) cached already
+        if result and matched:
+            check_cancelled(cancel)
+            finish(os.path.basename(result))
+        return result
+
+    def partial_result(self, task_id):
+        """Provisional rollup cube of a running custom search, if it has published one"""
+        return self.scheduler.partial_result(task_id)
+
+    def heartbeat(self, task_id, user=None, client=None):
+        self.scheduler.heartbeat(task_id, waiter=(user, client))
+
+    def cancel_custom_task(self, task_id, user=None, client=None):
+        self.scheduler.cancel(task_id, waiter=(user, client))
+
+    def process_tasks(self):
+        """Run the custom search workers; blocks until the scheduler is stopped"""
+        self.scheduler.start()
+        for thread in self.scheduler.threads:
+            thread.join()
 
     def process_existing_files(self):
-        """Process standard timeframes"""
+        """Process standard timeframes in a single pass over the sensor files"""
         now = datetime.now()
-        for timeframe, delta in self.timeframes.items():
-            cutoff = now - delta
-            try:
-                self.aggregator.generate_timeframe_data(timeframe, cutoff)
-            except Exception as e:
-                print(f"\033[31mError processing {timeframe} data: {e}\033[0m")
+        cutoffs = {timeframe: now - delta for timeframe, delta in self.timeframes.items()}
+        try:
+            if self.window_engine:
+                self.window_engine.update(cutoffs)
+            else:
+                self.aggregator.generate_timeframes(cutoffs)
+        except Exception as e:
+            print(f"\033[31mError processing {', '.join(cutoffs)} data: {e}\033[0m")
+        try:
+            self.aggregator.update_rollups(cutoffs)
+        except Exception as e:
+            print(f"\033[31mError updating rollups: {e}\033[0m")
+        try:
+            self.aggregator.update_record_store()
+        except Exception as e:
+            print(f"\033[31mError updating the record store: {e}\033[0m")
+        try:
+            self.aggregator.compact_archive()
+        except Exception as e:
+            print(f"\033[31mError compacting the sensor archive: {e}\033[0m")
 
 if __name__ == "__main__":
     WATCH_DIR = "/home/iaes/DiodeSensor/FM1"
     OUTPUT_DIR = "/home/iaes/DiodeSensor/FM1/output"
 
-    aggregator = NetworkDataAggregator(WATCH_DIR, OUTPUT_DIR)
+    aggregator = NetworkDataAggregator(
+        WATCH_DIR, OUTPUT_DIR,
+        workers=int(os.getenv("PARSER_WORKERS", os.cpu_count() or 1)),
+        columnar=os.getenv("COLUMNAR_OUTPUT", "0") == "1",
+        snapshots=os.getenv("SNAPSHOT_OUTPUT", "0") == "1",
+        rollups=os.getenv("ROLLUP_CUBES", "0") == "1",
+        merge_connections=os.getenv("MERGE_CONNECTIONS", "0") == "1",
+        partial_every=int(os.getenv("CUSTOM_PARTIAL_EVERY", 10)),
+        record_store=os.getenv("RECORD_STORE", "0") == "1",
+        archive=os.getenv("SENSOR_ARCHIVE", "0") == "1",
+        compression=os.getenv("NDJSON_COMPRESSION", ""),
+    )
+    aggregator.index.start_watching()
     handler = NetworkDataHandler(aggregator)
 
     # Start task processor in separate thread
@@ -274,6 +1197,7 @@ if __name__ == "__main__":
             
             # Process standard timeframes
             handler.process_existing_files()
+            aggregator.index.maybe_save()
             
             log_memory_usage()
             gc.collect()
@@ -283,4 +1207,7 @@ if __name__ == "__main__":
             time.sleep(sleep_time)
             
     except KeyboardInterrupt:
-        print("\033[31mProcess terminated by user\033[0m")
\ No newline at end of file
+        print("\033[31mProcess terminated by user\033[0m")
+    finally:
+        aggregator.index.stop_watching()
+        aggregator.close()
\ No newline at end of file
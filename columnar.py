@@ -0,0 +1,205 @@
+import os
+import json
+from ndjson_codec import open_ndjson, dataset_path
+from state_files import save_json
+
+try:
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+    import pyarrow.parquet as pq
+except ImportError:  # columnar output is optional, NDJSON keeps working without pyarrow
+    pa = None
+
+DAILY_COLUMNS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+HOURLY_COLUMNS = [f"{h}{ampm}" for ampm in ["AM", "PM"] for h in ["12"] + [str(i) for i in range(1, 12)]]
+CONVERT_BLOCK_SIZE = 64 * 1024 * 1024
+SNAPSHOT_DIR = ".snapshots"
+# versions kept on disk so a reader still mapping the previous one is not pulled from under it
+SNAPSHOT_KEEP = 2
+
+if pa is not None:
+    SCHEMA = pa.schema(
+        [(column, pa.string()) for column in ["PROTOCOL", "SRCIP", "DSTIP"]]
+        + [("TOTPACKETS", pa.int64()), ("TOTDATA", pa.float64())]
+        + [(column, pa.string()) for column in ["SRCPORT", "DSTPORT"]]
+        + [(column, pa.int64()) for column in DAILY_COLUMNS + HOURLY_COLUMNS]
+    )
+    PARSE_OPTIONS = pa_json.ParseOptions(explicit_schema=SCHEMA, unexpected_field_behavior="ignore")
+    # the dashboard keeps the time counters as int32 (data_processing.compact_frame), so snapshots
+    # carry them that way and the mapped columns are used as they are instead of cast into a copy
+    SNAPSHOT_SCHEMA = pa.schema(
+        [pa.field(field.name, pa.int32()) if field.name in DAILY_COLUMNS + HOURLY_COLUMNS else field
+         for field in SCHEMA]
+    )
+else:
+    SCHEMA = None
+    SNAPSHOT_SCHEMA = None
+
+
+def available():
+    return pa is not None
+
+
+def columnar_path(ndjson_path):
+    """all_data.json -> all_data.parquet"""
+    return os.path.splitext(ndjson_path)[0] + ".parquet"
+
+
+def _conform(table):
+    """Add any schema column the block did not contain and put columns in schema order"""
+    for field in SCHEMA:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(len(table), field.type))
+    return table.select(SCHEMA.names)
+
+
+def iter_ndjson_tables(ndjson_path, block_size=CONVERT_BLOCK_SIZE):
+    """Yield schema-conformed Arrow tables for newline-aligned blocks of an NDJSON dataset, compressed or not"""
+    with open_ndjson(dataset_path(ndjson_path)) as f:
+        leftover = b""
+        while True:
+            chunk = f.read(block_size)
+            data = leftover + chunk
+            if chunk:
+                cut = data.rfind(b"\n") + 1
+                if cut == 0:
+                    leftover = data
+                    continue
+                data, leftover = data[:cut], data[cut:]
+            else:
+                leftover = b""
+            if data.strip():
+                yield _conform(pa_json.read_json(pa.BufferReader(data), parse_options=PARSE_OPTIONS))
+            if not chunk:
+                break
+
+
+def ndjson_to_parquet(ndjson_path, parquet_path=None, block_size=CONVERT_BLOCK_SIZE):
+    """Convert a cleaned NDJSON dataset to a typed Parquet file next to it.
+
+    The NDJSON is read in newline-aligned blocks with pyarrow's C++ JSON
+    reader and written one row group per block, so memory stays bounded
+    by the block size. The Parquet file is swapped in atomically.
+    """
+    parquet_path = parquet_path or columnar_path(ndjson_path)
+    temp_path = parquet_path + ".tmp"
+    writer = pq.ParquetWriter(temp_path, SCHEMA, compression="zstd")
+    try:
+        for table in iter_ndjson_tables(ndjson_path, block_size):
+            writer.write_table(table)
+        writer.close()
+        os.replace(temp_path, parquet_path)
+        return parquet_path
+    except Exception:
+        writer.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_parquet_frame(parquet_path):
+    """Load a Parquet dataset straight into a DataFrame (memory-mapped read)"""
+    return pq.read_table(parquet_path, memory_map=True).to_pandas()
+
+
+def snapshot_pointer_path(ndjson_path):
+    """all_data.json -> all_data.snapshot"""
+    return os.path.splitext(ndjson_path)[0] + ".snapshot"
+
+
+def read_snapshot_pointer(pointer_path):
+    try:
+        with open(pointer_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_versions(snapshot_dir, base):
+    """Return {version: path} for the snapshot files of one dataset"""
+    versions = {}
+    try:
+        entries = os.scandir(snapshot_dir)
+    except FileNotFoundError:
+        return versions
+    with entries:
+        for entry in entries:
+            stem, _, version = entry.name[:-len(".arrow")].rpartition(".")
+            if entry.name.endswith(".arrow") and stem == base and version.isdigit():
+                versions[int(version)] = entry.path
+    return versions
+
+
+def publish_snapshot(ndjson_path, keep=SNAPSHOT_KEEP, block_size=CONVERT_BLOCK_SIZE):
+    """Publish an NDJSON dataset as a new memory-mappable Arrow IPC snapshot.
+
+    The snapshot is written uncompressed under a new version number in
+    .snapshots/, then the dataset's pointer file is swapped to it
+    atomically. Readers that still have an older version mapped keep
+    working; only versions beyond the last `keep` are removed.
+
+    The blocks are combined into a single record batch, so every column
+    is one contiguous buffer pandas can view without copying; that costs
+    the collector the dataset's Arrow size while publishing. Counters are
+    int32 (SNAPSHOT_SCHEMA) unless one does not fit.
+    """
+    output_dir = os.path.dirname(ndjson_path)
+    base = os.path.splitext(os.path.basename(ndjson_path))[0]
+    pointer_path = snapshot_pointer_path(ndjson_path)
+    snapshot_dir = os.path.join(output_dir, SNAPSHOT_DIR)
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    versions = _snapshot_versions(snapshot_dir, base)
+    pointer = read_snapshot_pointer(pointer_path) or {}
+    version = max([pointer.get("version", 0)] + list(versions)) + 1
+    snapshot_name = f"{base}.{version}.arrow"
+    snapshot_path = os.path.join(snapshot_dir, snapshot_name)
+    temp_path = snapshot_path + ".tmp"
+
+    tables = list(iter_ndjson_tables(ndjson_path, block_size))
+    table = pa.concat_tables(tables).combine_chunks() if tables else SCHEMA.empty_table()
+    try:
+        table = table.cast(SNAPSHOT_SCHEMA)
+    except pa.ArrowInvalid:
+        pass  # a counter past int32, which compact_frame would keep as int64 too
+    try:
+        with pa.OSFile(temp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temp_path, snapshot_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    save_json(pointer_path, {"version": version, "path": os.path.join(SNAPSHOT_DIR, snapshot_name), "rows": len(table)})
+
+    for old_version, old_path in versions.items():
+        if old_version <= version - keep:
+            os.remove(old_path)
+    return pointer_path
+
+
+def remove_snapshot(pointer_path):
+    """Drop a dataset's pointer file and every snapshot version behind it"""
+    output_dir = os.path.dirname(pointer_path)
+    base = os.path.splitext(os.path.basename(pointer_path))[0]
+    if os.path.exists(pointer_path):
+        os.remove(pointer_path)
+    for path in _snapshot_versions(os.path.join(output_dir, SNAPSHOT_DIR), base).values():
+        os.remove(path)
+
+
+def open_snapshot(pointer_path):
+    """Map the current snapshot read-only and wrap it as a DataFrame.
+
+    Numeric columns without nulls come back as NumPy views over the
+    mapped file, so every dashboard process shares the page cache copy
+    instead of holding its own.
+    """
+    pointer = read_snapshot_pointer(pointer_path)
+    if pointer is None:
+        raise FileNotFoundError(f"No snapshot pointer at {pointer_path}")
+    snapshot_path = os.path.join(os.path.dirname(pointer_path), pointer["path"])
+    source = pa.memory_map(snapshot_path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
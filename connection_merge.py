@@ -0,0 +1,171 @@
+import os
+import numpy as np
+import pandas as pd
+from ndjson_codec import compress, stored_path, remove_variants, decode_frame
+
+KEY_FIELDS = ["PROTOCOL", "SRCIP", "DSTIP", "SRCPORT", "DSTPORT"]
+# cumulative counters the per-interval deltas are computed from
+DELTA_FIELDS = {"TOTPACKETS": "DELTAPACKETS", "TOTDATA": "DELTADATA"}
+FLOAT_FIELDS = {"TOTDATA", "DELTADATA"}
+MERGE_FIELDS = ["DELTAPACKETS", "DELTADATA", "FIRSTSEEN", "LASTSEEN", "SNAPSHOTS"]
+
+
+def read_spool_frame(spool_path, columns):
+    """Load an NDJSON spool file back into a cleaned frame"""
+    with open(spool_path, "rb") as f:
+        return decode_frame(f.read(), columns)
+
+
+def connection_keys(frame):
+    """One string key per (PROTOCOL, SRCIP, DSTIP, SRCPORT, DSTPORT) tuple"""
+    parts = [frame[field].fillna("").astype(str) for field in KEY_FIELDS]
+    key = parts[0]
+    for part in parts[1:]:
+        key = key + "\x1f" + part
+    return key
+
+
+class ConnectionMerger:
+    """Fold cumulative ALLConnections snapshots into one row per connection.
+
+    The sensor reports running totals, so a connection that stays up is
+    repeated in every snapshot. Each connection keeps the counters of the
+    latest snapshot it appeared in, plus DELTAPACKETS/DELTADATA: the sum
+    of its increases between consecutive snapshots. A connection missing
+    from the baseline, or one whose counters went backwards (a reset),
+    counts its full value for that interval.
+
+    Rows live in one array per column, found through a dict of connection
+    keys, so a snapshot only touches its own connections' rows.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.numeric = [column for column in self.columns if column not in KEY_FIELDS]
+        self.rows = {}
+        self.size = 0
+        self.arrays = {}
+
+    def _snapshot(self, frame):
+        """Collapse a snapshot to one row per connection, indexed by key"""
+        frame = frame.copy()
+        for column in self.numeric:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce").fillna(0)
+        frame.index = connection_keys(frame)
+        # duplicates inside one snapshot are separate flows of the same tuple, so add them up
+        if frame.index.has_duplicates:
+            keys = frame[KEY_FIELDS].groupby(level=0, sort=False).first()
+            sums = frame[self.numeric].groupby(level=0, sort=False).sum()
+            frame = keys.join(sums)[self.columns]
+        return frame
+
+    def seed(self, frame):
+        """Use a snapshot from before the window as the baseline for the first deltas"""
+        snapshot = self._snapshot(frame)
+        self._upsert(snapshot, timestamp=None)
+
+    def add(self, frame, timestamp):
+        snapshot = self._snapshot(frame)
+        if snapshot.empty:
+            return
+        self._upsert(snapshot, timestamp=timestamp.isoformat())
+
+    def _grow(self, size):
+        """Make room for size rows, doubling so appends stay linear overall"""
+        capacity = len(self.arrays[KEY_FIELDS[0]]) if self.arrays else 0
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        for column in KEY_FIELDS + self.numeric + MERGE_FIELDS:
+            kind = object if column in KEY_FIELDS or column in ("FIRSTSEEN", "LASTSEEN") else float
+            array = np.empty(capacity, dtype=kind)
+            if column in self.arrays:
+                array[:self.size] = self.arrays[column][:self.size]
+            self.arrays[column] = array
+
+    def _upsert(self, snapshot, timestamp):
+        counted = timestamp is not None
+        keys = snapshot.index
+        rows = np.fromiter((self.rows.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        new = rows < 0
+        added = np.arange(self.size, self.size + int(new.sum()))
+        self._grow(self.size + len(added))
+        self.rows.update(zip(keys[new], added))
+        rows[new] = added
+        self.size += len(added)
+        for field in DELTA_FIELDS:
+            # a connection we have no counters for yet
+            self.arrays[field][added] = np.nan
+        for column in ("DELTAPACKETS", "DELTADATA", "SNAPSHOTS"):
+            self.arrays[column][added] = 0
+        for column in ("FIRSTSEEN", "LASTSEEN"):
+            self.arrays[column][added] = None
+
+        if counted:
+            for field, delta_field in DELTA_FIELDS.items():
+                current = snapshot[field].to_numpy(dtype=float)
+                prior = self.arrays[field][rows]
+                increase = current - prior
+                # new connection or counter reset: the whole current value is this interval's traffic
+                increase = np.where(np.isnan(prior) | (increase < 0), current, increase)
+                self.arrays[delta_field][rows] += increase
+            self.arrays["SNAPSHOTS"][rows] += 1
+            first = self.arrays["FIRSTSEEN"]
+            first[rows[pd.isna(first[rows])]] = timestamp
+            self.arrays["LASTSEEN"][rows] = timestamp
+        for column in self.columns:
+            self.arrays[column][rows] = snapshot[column].to_numpy()
+
+    def result(self):
+        """The merged connections, leaving out anything only seen in the baseline"""
+        if not self.size:
+            return pd.DataFrame(columns=self.columns + MERGE_FIELDS)
+        merged = pd.DataFrame({column: self.arrays[column][:self.size] for column in self.columns + MERGE_FIELDS})
+        merged = merged[merged["SNAPSHOTS"] > 0].reset_index(drop=True)
+        # counters went through float for the delta arithmetic; give the integer ones back their type
+        for column in self.numeric + ["DELTAPACKETS", "SNAPSHOTS"]:
+            if column not in FLOAT_FIELDS:
+                merged[column] = merged[column].astype("int64")
+        return merged
+
+
+class MergedTimeframeWriter:
+    """Timeframe output that holds one merged row per connection, written out on commit"""
+    def __init__(self, timeframe_key, output_path, columns, codec=None):
+        self.timeframe_key = timeframe_key
+        self.output_path = output_path
+        self.codec = codec
+        self.stored_path = stored_path(output_path, codec)
+        self.temp_path = self.stored_path + ".tmp"
+        self.merger = ConnectionMerger(columns)
+        self.records = 0
+        self.count = 0
+
+    def seed(self, frame):
+        self.merger.seed(frame)
+
+    def add(self, frame, timestamp):
+        self.merger.add(frame, timestamp)
+        self.records += len(frame)
+
+    def commit(self, to_ndjson):
+        try:
+            merged = self.merger.result()
+            self.count = len(merged)
+            if self.count == 0:
+                print(f"\033[33mNo data found for {self.timeframe_key}, skipping file creation\033[0m")
+                return False
+            with open(self.temp_path, "wb") as f:
+                f.write(compress(to_ndjson(merged), self.codec))
+            os.replace(self.temp_path, self.stored_path)
+            remove_variants(self.output_path, keep=self.stored_path)
+            print(f"\033[32mGenerated {self.timeframe_key} data with {self.count} connections "
+                  f"(merged from {self.records} records)\033[0m")
+            return True
+        except Exception as e:
+            print(f"\033[31mError generating {self.timeframe_key} data: {e}\033[0m")
+            self.discard()
+            return False
+
+    def discard(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
@@ -0,0 +1,171 @@
+import pandas as pd
+
+PORT_FIELDS = {"SRCPORT", "DSTPORT"}
+
+
+class FieldFilter:
+    """One field's terms: a value matches if it hits any include term and no exclude term.
+
+    Terms come from a comma-separated string (or a list). A leading "!"
+    negates a term, and on port fields "a-b" is an inclusive range.
+    Plain values compare case-insensitively after stripping whitespace.
+    """
+    def __init__(self, field, spec):
+        self.field = field
+        self.include_values, self.include_ranges = set(), []
+        self.exclude_values, self.exclude_ranges = set(), []
+        terms = spec if isinstance(spec, (list, tuple, set)) else str(spec).split(",")
+        for term in terms:
+            term = str(term).strip()
+            negate = term.startswith("!")
+            term = term[1:].strip() if negate else term
+            if not term:
+                continue
+            values, ranges = (self.exclude_values, self.exclude_ranges) if negate else (self.include_values, self.include_ranges)
+            bounds = self.parse_range(term) if field in PORT_FIELDS else None
+            if bounds:
+                ranges.append(bounds)
+            else:
+                values.add(term.lower())
+
+    @staticmethod
+    def parse_range(term):
+        low, sep, high = term.partition("-")
+        if not sep or not low.strip().isdigit() or not high.strip().isdigit():
+            return None
+        low, high = int(low), int(high)
+        return (low, high) if low <= high else (high, low)
+
+    @property
+    def empty(self):
+        return not (self.include_values or self.include_ranges or self.exclude_values or self.exclude_ranges)
+
+    def key(self):
+        """Canonical form, the same for every spelling of an equivalent filter"""
+        return (
+            tuple(sorted(self.include_values)), tuple(sorted(self.include_ranges)),
+            tuple(sorted(self.exclude_values)), tuple(sorted(self.exclude_ranges)),
+        )
+
+    @classmethod
+    def from_key(cls, field, key):
+        field_filter = cls(field, [])
+        include_values, include_ranges, exclude_values, exclude_ranges = key
+        field_filter.include_values = set(include_values)
+        field_filter.include_ranges = [tuple(bounds) for bounds in include_ranges]
+        field_filter.exclude_values = set(exclude_values)
+        field_filter.exclude_ranges = [tuple(bounds) for bounds in exclude_ranges]
+        return field_filter
+
+    def implies(self, other):
+        """True if every value this filter accepts is also accepted by other"""
+        if self.key() == other.key():
+            return True
+        if other.exclude_values or other.exclude_ranges or not (self.include_values or self.include_ranges):
+            return False
+        for value in self.include_values:
+            number = int(value) if value.isascii() and value.isdigit() else None
+            if not self._hits(value, number, other.include_values, other.include_ranges):
+                return False
+        return all(
+            any(o_low <= low and high <= o_high for o_low, o_high in other.include_ranges)
+            for low, high in self.include_ranges
+        )
+
+    def _hits(self, text, number, values, ranges):
+        return text in values or (number is not None and any(low <= number <= high for low, high in ranges))
+
+    def matches(self, value):
+        text = "" if value is None else str(value).strip().lower()
+        # plain ASCII digits only, like the record store's GLOB '[0-9]*' check
+        number = int(text) if text.isascii() and text.isdigit() else None
+        if (self.include_values or self.include_ranges) and not self._hits(text, number, self.include_values, self.include_ranges):
+            return False
+        return not self._hits(text, number, self.exclude_values, self.exclude_ranges)
+
+    def may_match(self, values):
+        """False only if none of these (lowercased) values can pass; None means unknown"""
+        return values is None or any(self.matches(value) for value in values)
+
+    def _column_hits(self, text, numbers, values, ranges):
+        hit = text.isin(values) if values else pd.Series(False, index=text.index)
+        for low, high in ranges:
+            hit |= numbers.between(low, high)
+        return hit
+
+    def mask(self, column):
+        text = column.astype(str).str.strip().str.lower().where(column.notna(), "")
+        numbers = None
+        if self.include_ranges or self.exclude_ranges:
+            # "80.0", "8e1" or "+80" would pass to_numeric, but matches() and the record store skip them
+            numbers = pd.to_numeric(text.where(text.str.fullmatch(r"[0-9]+"), None), errors="coerce")
+        mask = pd.Series(True, index=column.index)
+        if self.include_values or self.include_ranges:
+            mask &= self._column_hits(text, numbers, self.include_values, self.include_ranges)
+        if self.exclude_values or self.exclude_ranges:
+            mask &= ~self._column_hits(text, numbers, self.exclude_values, self.exclude_ranges)
+        return mask
+
+
+class CompiledQuery:
+    """A custom-search filter dict compiled once into per-field predicates.
+
+    mask() evaluates all fields over a cleaned batch with pandas; matches()
+    is the per-record equivalent for the non-vectorized path. Blank
+    fields are dropped at compile time. Plain picklable state, so it can
+    be shipped to the parser workers as is.
+    """
+    def __init__(self, filters=None):
+        self.fields = []
+        for field, spec in (filters or {}).items():
+            if spec is None or spec == "":
+                continue
+            field_filter = FieldFilter(field, spec)
+            if not field_filter.empty:
+                self.fields.append(field_filter)
+        self.fields.sort(key=lambda field_filter: field_filter.field)
+
+    def __bool__(self):
+        return bool(self.fields)
+
+    def key(self):
+        return tuple((field_filter.field, field_filter.key()) for field_filter in self.fields)
+
+    @classmethod
+    def from_key(cls, key):
+        """Rebuild a query from key(), e.g. as stored in the result cache index"""
+        query = cls()
+        query.fields = [FieldFilter.from_key(field, field_key) for field, field_key in key]
+        return query
+
+    def narrows(self, other):
+        """True if every record this query matches is also matched by other"""
+        mine = {field_filter.field: field_filter for field_filter in self.fields}
+        return all(
+            field_filter.field in mine and mine[field_filter.field].implies(field_filter)
+            for field_filter in other.fields
+        )
+
+    def mask(self, frame):
+        mask = pd.Series(True, index=frame.index)
+        for field_filter in self.fields:
+            # a missing field reads as blank, like record.get() does in matches()
+            column = frame[field_filter.field] if field_filter.field in frame else pd.Series("", index=frame.index)
+            mask &= field_filter.mask(column)
+            if not mask.any():
+                break
+        return mask
+
+    def matches(self, record):
+        return all(field_filter.matches(record.get(field_filter.field)) for field_filter in self.fields)
+
+    def may_match(self, summary):
+        """False if a summary of the distinct values per field (see sensor_archive) rules out every record"""
+        return all(field_filter.may_match(summary.get(field_filter.field)) for field_filter in self.fields)
+
+
+def compile_filters(filters):
+    """Return a CompiledQuery for a filter dict, passing already compiled ones through"""
+    if isinstance(filters, CompiledQuery):
+        return filters
+    return CompiledQuery(filters)
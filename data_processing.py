@@ -4,14 +4,19 @@ import plotly.express as px
 import plotly.graph_objects as go
 import plotly.colors as colors
 import logging
-import asyncio
-import aiofiles
 import time
 from sklearn.ensemble import IsolationForest
 import numpy as np
+from pandas.api.types import union_categoricals
 from colorlog import ColoredFormatter
 import ijson
 import json
+from columnar import (
+    available as columnar_available, columnar_path, read_parquet_frame,
+    snapshot_pointer_path, open_snapshot,
+)
+from rollups import rollup_pointer_path, load_rollup
+from ndjson_codec import open_ndjson, logical_path, dataset_path, decode_records
 
 DATA_FOLDER = "/home/iaes/DiodeSensor/FM1/output/"
 C9REPORTS_FOLDER = "/home/iaes/iaesDash/source/c9reports"
@@ -43,52 +48,145 @@ required_hourly_columns = [
 
 required_daily_columns = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
 
-async def read_json_file(filepath):
-    """Process line-delimited JSON files with validation"""
-    all_data = []
+TIME_FIELDS = required_hourly_columns + required_daily_columns
+
+# bytes handed to the parser at a time; cut back to the last full line
+LOAD_BLOCK_SIZE = 16 * 1024 * 1024
+# newest records kept when reading an NDJSON dataset (0 keeps everything)
+MAX_ROWS = int(os.getenv('DASH_MAX_ROWS', 0))
+STRING_DEFAULTS = {'DSTIP': 'Unknown', 'SRCIP': 'Unknown', 'PROTOCOL': 'Unknown'}
+# numeric columns and their dtypes, the same ones the columnar copies carry (columnar.SCHEMA)
+NUMERIC_DTYPES = dict({'TOTPACKETS': 'int64', 'TOTDATA': 'float64'}, **{field: 'int64' for field in TIME_FIELDS})
+# a few thousand distinct values repeated over millions of rows: stored as int codes plus a lookup table
+CATEGORY_COLUMNS = ['PROTOCOL', 'SRCIP', 'DSTIP', 'SRCPORT', 'DSTPORT', 'SRCMAC', 'DSTMAC', 'SRCCC', 'DSTCC']
+CONNECTION_COLUMNS = ['SRCIP', 'DSTIP', 'SRCPORT', 'DSTPORT']
+INT32_MAX = np.iinfo(np.int32).max
+# branches kept per treemap level and slices per protocol chart; the rest are folded into OTHERS
+FIGURE_TOP_N = int(os.getenv('FIGURE_TOP_N', 15))
+OTHERS = 'Others'
+# levels the treemap shows below its root; clicking a branch fetches the next ones (see treemap_figure)
+TREEMAP_DEPTH = 2
+TREEMAP_ROOT = 'All'
+# the anomaly scatter keeps the anomalies with the most data
+ANOMALY_POINTS = 500
+# rows FrameAggregates keeps for the anomaly model: a uniform sample to fit it on, plus the
+# largest rows by data and by packets, which are the ones that can make it into the scatter
+ANOMALY_SAMPLE = 10000
+ANOMALY_CANDIDATES = 4 * ANOMALY_POINTS
+
+def parse_block(data):
+    """Parse a block of whole NDJSON lines into records, skipping lines that are not JSON objects"""
+    return decode_records(data, on_invalid=lambda line, e: logger.debug(f"Invalid JSON line: {line[:100]}... Error: {e}"))
+
+def typed_frame(records):
+    """Build a frame from parsed records column by column, applying the defaults and dtypes as whole columns"""
+    names = tuple(records[0])
+    if all(tuple(record) == names for record in records):
+        # collector outputs write every key in the same order, so rows transpose straight into columns
+        columns_values = zip(names, zip(*(record.values() for record in records)))
+    else:
+        names += tuple(sorted(set().union(*records).difference(names)))
+        columns_values = ((col, [record.get(col) for record in records]) for col in names)
+    columns = {}
+    for col, values in columns_values:
+        dtype = NUMERIC_DTYPES.get(col)
+        if dtype is None:
+            columns[col] = pd.Series(values, dtype=object)
+            continue
+        array = np.array(values)
+        if array.dtype.kind not in 'iuf':
+            # nulls, or older outputs carrying TOTDATA as "12.5 MB"
+            text = pd.Series(values, dtype=object).astype(str).str.replace(" MB", "", regex=False)
+            array = pd.to_numeric(text, errors='coerce').fillna(0).to_numpy()
+        # counters stay floats if a file ever held fractional ones
+        if dtype == 'float64' or array.dtype.kind != 'f' or (array % 1 == 0).all():
+            array = array.astype(dtype)
+        columns[col] = array
+    df = pd.DataFrame(columns)
+    for col, default in STRING_DEFAULTS.items():
+        df[col] = df[col].fillna(default) if col in df.columns else default
+    for col, dtype in NUMERIC_DTYPES.items():
+        if col not in df.columns:
+            df[col] = pd.Series(0, index=df.index, dtype=dtype)
+    # compacted block by block, so the loader never holds a whole dataset as Python strings
+    return compact_frame(df)
+
+def compact_frame(df):
+    """Dictionary-encode the repetitive string columns and narrow the time counters, in place.
+
+    Counters go to int32 only where every value fits; sums still come out
+    as int64. Group-bys over the encoded columns must pass observed=True,
+    or pandas groups over every combination of categories.
+    """
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in TIME_FIELDS:
+        values = df[col]
+        if values.dtype.kind in 'iu' and values.dtype != np.int32 \
+                and (values.empty or (values.min() >= 0 and values.max() <= INT32_MAX)):
+            df[col] = values.astype(np.int32)
+    return df
+
+def concat_compact(frames):
+    """pd.concat for compact frames, merging the blocks' category lookup tables instead of falling back to objects"""
+    if len(frames) == 1:
+        return frames[0]
+    names = list(dict.fromkeys(col for frame in frames for col in frame.columns))
+    columns = {}
+    for col in names:
+        parts = [frame[col] if col in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+                 for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = union_categoricals(parts, sort_categories=True)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+def connection_key(df):
+    """uint64 hash per row of source/destination address and port, in place of a concatenated string"""
+    return pd.util.hash_pandas_object(df[CONNECTION_COLUMNS], index=False)
+
+def load_ndjson_frame(filepath, max_rows=0, block_size=LOAD_BLOCK_SIZE):
+    """Read an NDJSON dataset (plain or compressed) into a typed, compact DataFrame in large blocks.
+
+    With max_rows set only the newest max_rows records are kept; the
+    collector appends in time order, so those are the last ones.
+    """
+    frames = []
+    rows = seen = 0
     try:
-        async with aiofiles.open(filepath, mode='r') as f:
-            async for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                try:
-                    # Parse JSON object
-                    item = json.loads(line)
-                    
-                    # Ensure we have a dictionary
-                    if not isinstance(item, dict):
-                        logger.debug(f"Skipping non-dictionary item: {line[:100]}...")
+        with open_ndjson(filepath) as f:
+            leftover = b""
+            while True:
+                chunk = f.read(block_size)
+                data = leftover + chunk
+                if chunk:
+                    cut = data.rfind(b"\n") + 1
+                    if cut == 0:
+                        leftover = data
                         continue
-                        
-                    # Set defaults for all required fields
-                    item.setdefault('DSTIP', 'Unknown')
-                    item.setdefault('SRCIP', 'Unknown')
-                    item.setdefault('PROTOCOL', 'Unknown')
-                    item.setdefault('TOTPACKETS', 0)
-                    item.setdefault('TOTDATA', '0 MB')
-                    
-                    # Time-related defaults
-                    time_fields = [
-                        "12AM", "1AM", "2AM", "3AM", "4AM", "5AM", "6AM", "7AM",
-                        "8AM", "9AM", "10AM", "11AM", "12PM", "1PM", "2PM", "3PM",
-                        "4PM", "5PM", "6PM", "7PM", "8PM", "9PM", "10PM", "11PM",
-                        "MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"
-                    ]
-                    for field in time_fields:
-                        item.setdefault(field, 0)
-                    
-                    all_data.append(item)
-                    
-                except json.JSONDecodeError as e:
-                    logger.debug(f"Invalid JSON line: {line[:100]}... Error: {e}")
-                    continue
-                    
+                    data, leftover = data[:cut], data[cut:]
+                records = parse_block(data)
+                if records:
+                    frames.append(typed_frame(records))
+                    rows += len(records)
+                    seen += len(records)
+                    # blocks that fall wholly outside the budget are dropped as soon as we have enough
+                    while max_rows and rows - len(frames[0]) >= max_rows:
+                        rows -= len(frames.pop(0))
+                if not chunk:
+                    break
     except Exception as e:
         logger.error(f"Error reading {filepath}: {e}")
-        
-    return all_data
+
+    if not frames:
+        return pd.DataFrame()
+    df = concat_compact(frames)
+    if max_rows and len(df) > max_rows:
+        logger.info(f"{os.path.basename(filepath)} holds {seen} records, keeping the newest {max_rows}")
+        df = df.iloc[-max_rows:].reset_index(drop=True)
+    return df
 
 def safe_json_parse(json_str):
     """Safely parse JSON with error handling."""
@@ -104,20 +202,49 @@ def safe_json_parse(json_str):
         except json.JSONDecodeError:
             return None
 
+# columnar copies the collector may publish next to an NDJSON dataset, preferred in this order
+COLUMNAR_READERS = [
+    (rollup_pointer_path, load_rollup),
+    (snapshot_pointer_path, open_snapshot),
+    (columnar_path, read_parquet_frame),
+]
+
+def resolve_data_file(file_path):
+    """Prefer a columnar copy of an NDJSON dataset when it is at least as new as the NDJSON.
+
+    Otherwise the newest stored NDJSON is used, plain or compressed (all_data.json.gz).
+    """
+    stored_path = dataset_path(file_path)
+    if not columnar_available():
+        return stored_path
+    try:
+        json_mtime = os.path.getmtime(stored_path)
+    except OSError:
+        json_mtime = 0
+    for sibling_path, _ in COLUMNAR_READERS:
+        candidate = sibling_path(logical_path(file_path))
+        try:
+            if os.path.getmtime(candidate) >= json_mtime:
+                return candidate
+        except OSError:
+            continue
+    return stored_path
+
 def read_data(file_path):
     """Read data with enhanced error handling."""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    source_path = resolve_data_file(file_path)
+    for sibling_path, reader in COLUMNAR_READERS:
+        if source_path == sibling_path(logical_path(file_path)):
+            try:
+                data = reader(source_path)
+                logger.info(f"Loaded {len(data)} rows from {os.path.basename(source_path)}")
+                return data, count_files_in_directory(C9REPORTS_FOLDER)
+            except Exception as e:
+                logger.error(f"Failed to read {source_path}, falling back to {file_path}: {e}")
+
+    data = load_ndjson_frame(dataset_path(file_path), max_rows=MAX_ROWS)
+    logger.info(f"Loaded {len(data)} rows from {os.path.basename(dataset_path(file_path))}")
 
-    try:
-        data = loop.run_until_complete(read_json_file(file_path))
-    except Exception as e:
-        logger.error(f"Failed to read {file_path}: {e}")
-        data = []
-    
     total_cyber9_reports = count_files_in_directory(C9REPORTS_FOLDER)
     return data, total_cyber9_reports
 
@@ -131,7 +258,8 @@ def count_files_in_directory(directory):
         logger.error(f"An error occurred: {e}")
         return None
 
-def detect_anomalies(df):
+def detect_anomalies(df, sample=None):
+    """Rows of df the isolation forest flags; with a boolean sample mask it is fitted on those rows only"""
     required_cols = ['TOTPACKETS', 'TOTDATA_MB', 'UNIQUE_CONNECTIONS']
     for col in required_cols:
         if col not in df.columns:
@@ -153,333 +281,471 @@ def detect_anomalies(df):
 
     features = df[required_cols]
     iso_forest = IsolationForest(contamination=0.01)
-    df['ANOMALY_IF'] = iso_forest.fit_predict(features)
+    if sample is None:
+        df['ANOMALY_IF'] = iso_forest.fit_predict(features)
+    else:
+        # a uniform sample of the dataset, so the 1% cut it learns holds for the rest too
+        df['ANOMALY_IF'] = iso_forest.fit(features[sample]).predict(features)
     anomalies = df[df['ANOMALY_IF'] == -1]
     return anomalies
 
-def create_visualizations(all_data, total_cyber9_reports):
-    try:
-        start_time = time.time()
-        logger.info("Starting data reading process...")
-        if not all_data:
-            logger.error("No data available to create visualizations.")
-            return (go.Figure(),) * 13
-
-        # Create DataFrame with fallback for missing columns
-        df = pd.DataFrame(all_data)
-
-        # Create DataFrame with guaranteed columns
-        required_columns = {
-            'DSTIP': 'Unknown',
-            'SRCIP': 'Unknown',
-            'PROTOCOL': 'Unknown',
-            'TOTPACKETS': 0,
-            'TOTDATA': "0 MB",
-            'SRCPORT': 0,
-            'DSTPORT': 0,
-            'SRCCC': '',
-            'DSTCC': '',
-            'SRCMAC': '',
-            'DSTMAC': ''
-        }
-        
-        # Initialize DataFrame with default columns
-        df = pd.DataFrame(all_data)
-        for col, default in required_columns.items():
-            if col not in df.columns:
-                df[col] = default
-                
-        # Process time fields
-        time_columns = [
-            "12AM", "1AM", "2AM", "3AM", "4AM", "5AM", "6AM", "7AM",
-            "8AM", "9AM", "10AM", "11AM", "12PM", "1PM", "2PM", "3PM",
-            "4PM", "5PM", "6PM", "7PM", "8PM", "9PM", "10PM", "11PM",
-            "MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"
-        ]
-        
-        for col in time_columns:
-            if col not in df.columns:
-                df[col] = 0
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-
-        required_hourly_columns = [
-            "12AM", "1AM", "2AM", "3AM", "4AM", "5AM", "6AM", "7AM",
-            "8AM", "9AM", "10AM", "11AM", "12PM", "1PM", "2PM", "3PM",
-            "4PM", "5PM", "6PM", "7PM", "8PM", "9PM", "10PM", "11PM",
-        ]
+# the grouping every aggregate below is derived from
+FLOW_COLUMNS = ['SRCIP', 'DSTIP', 'PROTOCOL']
+FLOW_SUMS = ['TOTPACKETS', 'TOTDATA_MB', 'ROWS'] + TIME_FIELDS
+# all the anomaly model and its figure read from a record
+ANOMALY_COLUMNS = FLOW_COLUMNS + ['TOTPACKETS', 'TOTDATA_MB']
+
+def bucket_others(frame, column, value, top_n, by=()):
+    """frame with all but the top_n values of column (by summed value, within each by group) relabelled OTHERS"""
+    by = list(by)
+    totals = frame.groupby(by + [column], sort=False)[value].sum()
+    ranks = (totals.groupby(level=by) if by else totals).rank(method='first', ascending=False)
+    kept = totals.index[ranks.values <= top_n]
+    rows = pd.MultiIndex.from_frame(frame[by + [column]]) if by else pd.Index(frame[column])
+    return frame.assign(**{column: frame[column].where(rows.isin(kept), OTHERS)})
+
+def prepare_frame(all_data):
+    """Frame with the guaranteed columns, compacted (see compact_frame)"""
+    # Create DataFrame with guaranteed columns
+    required_columns = {
+        'DSTIP': 'Unknown',
+        'SRCIP': 'Unknown',
+        'PROTOCOL': 'Unknown',
+        'TOTPACKETS': 0,
+        'TOTDATA': "0 MB",
+        'SRCPORT': 0,
+        'DSTPORT': 0,
+        'SRCCC': '',
+        'DSTCC': '',
+        'SRCMAC': '',
+        'DSTMAC': ''
+    }
 
-        required_daily_columns = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
-        
-        # Ensure required columns exist
-        required_columns = ['DSTIP', 'SRCIP', 'PROTOCOL', 'TOTPACKETS', 
-                           'TOTDATA', 'SRCPORT', 'DSTPORT']
-        # Ensure all required columns exist
-        for col in required_hourly_columns + required_daily_columns:
-            if col not in df.columns:
-                df[col] = 0  # Initialize missing columns with 0
-
-        # Now process the columns safely
-        for col in required_hourly_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-            
-        for col in required_daily_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-
-
-        # Rest of your existing processing
-        df['DSTIP'] = df['DSTIP'].fillna('Unknown')
-        df['SRCIP'] = df['SRCIP'].fillna('Unknown')
-        df['PROTOCOL'] = df['PROTOCOL'].fillna('Unknown')
+    # Initialize DataFrame with default columns. Columnar datasets already arrive as one;
+    # a shallow copy is enough since columns are only ever replaced, never written in place
+    df = all_data.copy(deep=False) if isinstance(all_data, pd.DataFrame) else pd.DataFrame(all_data)
+    for col, default in required_columns.items():
+        if col not in df.columns:
+            df[col] = default
+    # rollup cubes fold many records into one row and carry the count; raw records count once
+    if 'ROWS' not in df.columns:
+        df['ROWS'] = 1
 
+    # Process time fields; integer counters (the loader's) are kept as they are
+    for col in TIME_FIELDS:
+        if col not in df.columns:
+            df[col] = 0
+        elif df[col].dtype.kind not in 'iu':
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    for col in ['DSTIP', 'SRCIP', 'PROTOCOL']:
+        if df[col].isna().any():
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and 'Unknown' not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories('Unknown')
+            df[col] = df[col].fillna('Unknown')
+    compact_frame(df)
+
+    if df["TOTDATA"].dtype.kind == 'f':
+        df["TOTDATA_MB"] = df["TOTDATA"].fillna(0)
+    else:
         df["TOTDATA"] = df["TOTDATA"].astype(str)
         df["TOTDATA_MB"] = pd.to_numeric(df["TOTDATA"].str.replace(" MB", ""), errors='coerce').fillna(0)
+    return df
+
+def flow_sums(df):
+    return df.groupby(FLOW_COLUMNS, observed=True, as_index=False)[FLOW_SUMS].sum()
+
+def aggregate_frame(df):
+    """Every aggregate the figures need, from a single group-by over (SRCIP, DSTIP, PROTOCOL).
+
+    The per-flow sums are small next to the records, so the coarser
+    aggregates are cut from them rather than from df. Only the top
+    connections and the anomaly model still look at individual rows.
+    """
+    df['CONNECTION'] = connection_key(df)
+    df['UNIQUE_CONNECTIONS'] = df['CONNECTION'].nunique()
+    return summarize_flows(flow_sums(df), df.nlargest(10, 'TOTPACKETS'), detect_anomalies(df))
+
+def summarize_flows(flows, top_rows, anomalies):
+    flows = flows.astype({col: str for col in FLOW_COLUMNS})
+    return {
+        'total_packets': flows['TOTPACKETS'].sum(),
+        'total_rows': int(flows['ROWS'].sum()),
+        'flows': flows,
+        'by_srcip': flows.groupby('SRCIP', as_index=False)['TOTDATA_MB'].sum(),
+        'by_pair': flows.groupby(['SRCIP', 'DSTIP'], as_index=False)['TOTDATA_MB'].sum(),
+        'by_protocol': bucket_others(
+            flows.groupby('PROTOCOL', as_index=False)[['ROWS'] + required_hourly_columns].sum(),
+            'PROTOCOL', 'ROWS', FIGURE_TOP_N,
+        ).groupby('PROTOCOL', as_index=False, sort=False).sum(),
+        'hourly': flows[required_hourly_columns].sum(),
+        'daily': flows[required_daily_columns].sum(),
+        'top_rows': top_rows.astype({col: str for col in FLOW_COLUMNS}),
+        'anomalies': anomalies,
+    }
 
-        custom_colorscale = [(0, "red"), (0.33, "yellow"), (0.67, "green"), (1, "blue")]
-
-        total_packets = df["TOTPACKETS"].sum()
-        fig_indicator_packets = go.Figure(
-            go.Indicator(mode="number", value=total_packets, title={"text": "Total Packets"})
-        )
-        fig_indicator_packets.update_layout(
-            font=dict(color="white"), template="plotly_dark", height=250
-        )
-
-        total_data_points = len(df)
-        fig_indicator_data_points = go.Figure(
-            go.Indicator(mode="number", value=total_data_points, title={"text": "Total Connections"})
-        )
-        fig_indicator_data_points.update_layout(
-            font=dict(color="white"), template="plotly_dark", height=250
-        )
-
-        fig_indicator_cyber_reports = go.Figure(
-            go.Indicator(mode="number", value=total_cyber9_reports, title={"text": "Total Cyber9 Line Reports"})
+class FrameAggregates:
+    """aggregate_frame() for records that arrive a frame at a time, without keeping the frames.
+
+    Each frame is reduced to its per-flow sums, its top connections and
+    the connection hashes, then dropped. Pending flow sums are folded
+    into the running ones once they outgrow them. The anomaly model gets
+    a bounded set of rows: a uniform sample of ANOMALY_SAMPLE rows it is
+    fitted on, and the ANOMALY_CANDIDATES largest rows by data and by
+    packets it scores as well. Below ANOMALY_SAMPLE rows that is every
+    row, as in aggregate_frame().
+    """
+
+    def __init__(self):
+        self.flows = None
+        self.pending = []
+        self.top_rows = None
+        self.anomaly_rows = None
+        self.connections = np.empty(0, dtype=np.uint64)
+        self.random = np.random.default_rng()
+        self.rows = 0
+
+    def add(self, frame):
+        df = prepare_frame(frame)
+        self.pending.append(flow_sums(df))
+        if self.flows is None or sum(len(part) for part in self.pending) >= len(self.flows):
+            self.fold()
+        # plain strings, so ten rows do not drag every frame's category tables along
+        top_rows = df.nlargest(10, 'TOTPACKETS')
+        top_rows = top_rows.astype({col: str for col in top_rows.columns if isinstance(top_rows[col].dtype, pd.CategoricalDtype)})
+        self.top_rows = pd.concat([self.top_rows, top_rows]).nlargest(10, 'TOTPACKETS')
+        self.connections = np.union1d(self.connections, connection_key(df).to_numpy())
+
+        # ROW tells rows apart across frames; the smallest SAMPLE_KEYs are a uniform sample
+        rows = df[ANOMALY_COLUMNS].assign(
+            ROW=np.arange(self.rows, self.rows + len(df)), SAMPLE_KEY=self.random.random(len(df)),
         )
-        fig_indicator_cyber_reports.update_layout(
-            font=dict(color="white"), template="plotly_dark", height=250
+        self.rows += len(df)
+        rows = pd.concat([self.anomaly_rows, self.anomaly_keep(rows).astype({col: str for col in FLOW_COLUMNS})])
+        self.anomaly_rows = self.anomaly_keep(rows).reset_index(drop=True)
+
+    @staticmethod
+    def anomaly_keep(rows):
+        kept = pd.concat([
+            rows.nsmallest(ANOMALY_SAMPLE, 'SAMPLE_KEY')['ROW'],
+            rows.nlargest(ANOMALY_CANDIDATES, 'TOTDATA_MB')['ROW'],
+            rows.nlargest(ANOMALY_CANDIDATES, 'TOTPACKETS')['ROW'],
+        ])
+        return rows[rows['ROW'].isin(kept)]
+
+    def fold(self):
+        parts = self.pending if self.flows is None else [self.flows] + self.pending
+        self.flows = flow_sums(concat_compact(parts))
+        self.pending = []
+
+    def result(self):
+        self.fold()
+        rows = self.anomaly_rows
+        sample = rows['ROW'].isin(rows.nsmallest(ANOMALY_SAMPLE, 'SAMPLE_KEY')['ROW']).to_numpy()
+        rows = rows.drop(columns=['ROW', 'SAMPLE_KEY']).assign(UNIQUE_CONNECTIONS=len(self.connections))
+        return summarize_flows(self.flows, self.top_rows, detect_anomalies(rows, sample))
+
+def indicator_figure(value, title):
+    fig = go.Figure(go.Indicator(mode="number", value=value, title={"text": title}))
+    fig.update_layout(font=dict(color="white"), template="plotly_dark", height=250)
+    return fig
+
+def treemap_figure(flows, root=()):
+    """Packet treemap of the TREEMAP_DEPTH flow levels below root, e.g. root=['10.0.0.1'] for one source.
+
+    Each parent keeps its FIGURE_TOP_N largest branches and folds the rest
+    into OTHERS, so the figure never holds more than a few hundred nodes.
+    Node ids are the path from TREEMAP_ROOT ("All/<src>/<dst>"), which is
+    how a click on a node is turned into the next root (callbacks.py).
+    """
+    root = list(root)
+    for column, value in zip(FLOW_COLUMNS, root):
+        flows = flows[flows[column] == value]
+    levels = FLOW_COLUMNS[len(root):len(root) + TREEMAP_DEPTH]
+    frame = flows[levels + ['TOTPACKETS']].astype({col: str for col in levels})
+
+    root_id = '/'.join([TREEMAP_ROOT] + root)
+    ids, labels, parents, values = [root_id], [root[-1] if root else TREEMAP_ROOT], [''], [frame['TOTPACKETS'].sum()]
+    for depth, column in enumerate(levels):
+        frame = bucket_others(frame, column, 'TOTPACKETS', FIGURE_TOP_N, by=levels[:depth])
+        nodes = frame.groupby(levels[:depth + 1], as_index=False, sort=False)['TOTPACKETS'].sum()
+        node_parents = pd.Series(root_id, index=nodes.index)
+        for parent_column in levels[:depth]:
+            node_parents = node_parents + '/' + nodes[parent_column]
+        ids += (node_parents + '/' + nodes[column]).tolist()
+        labels += nodes[column].tolist()
+        parents += node_parents.tolist()
+        values += nodes['TOTPACKETS'].tolist()
+
+    fig = go.Figure(go.Treemap(
+        ids=ids, labels=labels, parents=parents, values=np.array(values), branchvalues='total',
+        hovertemplate='%{label}<br>TOTPACKETS=%{value}<extra></extra>',
+    ))
+    title = 'Source, Destination IP and Protocol Distribution'
+    fig.update_layout(template="plotly_dark", height=600, title=f"{title}: {' / '.join(root)}" if root else title)
+    return fig
+
+def top_sources_figure(by_srcip):
+    custom_colorscale = [(0, "red"), (0.33, "yellow"), (0.67, "green"), (1, "blue")]
+    top_10_data = by_srcip.nlargest(10, "TOTDATA_MB")
+    grouped_data = by_srcip.assign(
+        SRCIP_GROUPED=by_srcip["SRCIP"].where(by_srcip["SRCIP"].isin(top_10_data["SRCIP"]), OTHERS)
+    ).groupby("SRCIP_GROUPED", as_index=False)["TOTDATA_MB"].sum().rename(columns={"TOTDATA_MB": "TOTDATA"})
+    return px.pie(
+        grouped_data,
+        names="SRCIP_GROUPED",
+        values="TOTDATA",
+        title="Total Data by Top 10 Source IP",
+        color_discrete_sequence=[c[1] for c in custom_colorscale],
+        template="plotly_dark",
+    )
+
+def hourly_figure(hourly_totals):
+    hourly_activity = hourly_totals.values.reshape(1, -1)
+    fig4 = go.Figure(
+        data=go.Heatmap(
+            z=hourly_activity,
+            x=required_hourly_columns,
+            y=["Activity"],
+            colorscale="jet",
+            colorbar=dict(title="Number of Packets"),
         )
-
-        fig_treemap_src_dst_protocol = px.treemap(
-            df, path=['SRCIP', 'DSTIP', 'PROTOCOL'],
-            template="plotly_dark", values='TOTPACKETS', height=600,
-            title='Source, Destination IP and Protocol Distribution'
+    )
+    fig4.update_layout(
+        title="Hourly Packet Activity Heatmap (with Overlay Line Plot)",
+        xaxis_title="Hour",
+        yaxis_title="Activity (log scale)",
+        template="plotly_dark",
+    )
+    fig4.add_trace(
+        go.Scatter(
+            x=required_hourly_columns,
+            y=hourly_totals,
+            mode="lines+markers",
+            line=dict(color="black"),
+            name="Total Packets per Hour",
+            yaxis="y2",
         )
-
-        df["TOTDATA"] = pd.to_numeric(df["TOTDATA_MB"], errors="coerce")
-        total_data_by_srcip = df.groupby("SRCIP", as_index=False)["TOTDATA"].sum()
-        top_10_data = total_data_by_srcip.nlargest(10, "TOTDATA")
-        df["SRCIP_GROUPED"] = df["SRCIP"].where(df["SRCIP"].isin(top_10_data["SRCIP"]), "Others")
-        grouped_data = df.groupby("SRCIP_GROUPED", as_index=False)["TOTDATA"].sum()
-        fig3 = px.pie(
-            grouped_data,
-            names="SRCIP_GROUPED",
-            values="TOTDATA",
-            title="Total Data by Top 10 Source IP",
-            color_discrete_sequence=[c[1] for c in custom_colorscale],
-            template="plotly_dark",
+    )
+    fig4.update_layout(yaxis2=dict(title="", overlaying="y", side="right", showgrid=False))
+    return fig4
+
+def daily_figure(daily_totals):
+    daily_activity = daily_totals.values.reshape(1, -1)
+    fig5 = go.Figure(
+        data=go.Heatmap(
+            z=daily_activity,
+            x=required_daily_columns,
+            y=["Activity"],
+            colorscale="jet",
+            colorbar=dict(title="Number of Packets"),
         )
-
-        for col in required_hourly_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-
-        hourly_activity = df[required_hourly_columns].sum().values.reshape(1, -1)
-        fig4 = go.Figure(
-            data=go.Heatmap(
-                z=hourly_activity,
-                x=required_hourly_columns,
-                y=["Activity"],
-                colorscale="jet",
-                colorbar=dict(title="Number of Packets"),
+    )
+    fig5.update_layout(
+        title="Daily Activity Heatmap",
+        xaxis_title="Day",
+        yaxis_title="Activity",
+        template="plotly_dark",
+    )
+    return fig5
+
+def sankey_figures(by_pair):
+    """The plain and heat-coloured Sankey diagrams of the top 10 address pairs by data"""
+    top_connections = by_pair.nlargest(10, "TOTDATA_MB")
+    all_nodes = list(set(top_connections["SRCIP"]).union(set(top_connections["DSTIP"])))
+    node_map = {node: idx for idx, node in enumerate(all_nodes)}
+    fig_sankey = go.Figure(
+        data=[
+            go.Sankey(
+                node=dict(
+                    pad=15,
+                    thickness=20,
+                    line=dict(color="black", width=0.5),
+                    label=all_nodes,
+                    color="blue",
+                ),
+                link=dict(
+                    source=[node_map[src] for src in top_connections["SRCIP"]],
+                    target=[node_map[dst] for dst in top_connections["DSTIP"]],
+                    value=top_connections["TOTDATA_MB"],
+                ),
             )
-        )
-        fig4.update_layout(
-            title="Hourly Packet Activity Heatmap (with Overlay Line Plot)",
-            xaxis_title="Hour",
-            yaxis_title="Activity (log scale)",
-            template="plotly_dark",
-        )
-        hourly_totals = df[required_hourly_columns].sum(axis=0)
-        fig4.add_trace(
-            go.Scatter(
-                x=required_hourly_columns,
-                y=hourly_totals,
-                mode="lines+markers",
-                line=dict(color="black"),
-                name="Total Packets per Hour",
-                yaxis="y2",
+        ]
+    )
+    fig_sankey.update_layout(title_text="Top 10 IP Data Flows", font_size=10, template="plotly_dark")
+
+    top_connections["norm_data"] = (top_connections["TOTDATA_MB"] - top_connections["TOTDATA_MB"].min()) / (top_connections["TOTDATA_MB"].max() - top_connections["TOTDATA_MB"].min())
+    colorscale = "jet"
+    color_values = colors.sample_colorscale(colorscale, top_connections["norm_data"])
+    fig_sankey_heatmap = go.Figure(
+        data=[
+            go.Sankey(
+                node=dict(
+                    pad=15,
+                    thickness=20,
+                    line=dict(color="black", width=0.5),
+                    label=all_nodes,
+                    color="blue",
+                ),
+                link=dict(
+                    source=[node_map[src] for src in top_connections["SRCIP"]],
+                    target=[node_map[dst] for dst in top_connections["DSTIP"]],
+                    value=top_connections["TOTDATA_MB"],
+                    color=color_values,
+                ),
             )
-        )
-        fig4.update_layout(yaxis2=dict(title="", overlaying="y", side="right", showgrid=False))
-
-        required_daily_columns = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
-        for col in required_daily_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-
-        daily_activity = df[required_daily_columns].sum().values.reshape(1, -1)
-        fig5 = go.Figure(
-            data=go.Heatmap(
-                z=daily_activity,
-                x=required_daily_columns,
-                y=["Activity"],
+        ]
+    )
+    fig_sankey_heatmap.add_trace(
+        go.Scatter(
+            x=[None],
+            y=[None],
+            mode="markers",
+            marker=dict(
                 colorscale="jet",
-                colorbar=dict(title="Number of Packets"),
-            )
-        )
-        fig5.update_layout(
-            title="Daily Activity Heatmap",
-            xaxis_title="Day",
-            yaxis_title="Activity",
-            template="plotly_dark",
-        )
-
-        sankey_data = df.groupby(["SRCIP", "DSTIP"], as_index=False)["TOTDATA_MB"].sum()
-        top_connections = sankey_data.nlargest(10, "TOTDATA_MB")
-        all_nodes = list(set(top_connections["SRCIP"]).union(set(top_connections["DSTIP"])))
-        node_map = {node: idx for idx, node in enumerate(all_nodes)}
-        fig_sankey = go.Figure(
-            data=[
-                go.Sankey(
-                    node=dict(
-                        pad=15,
-                        thickness=20,
-                        line=dict(color="black", width=0.5),
-                        label=all_nodes,
-                        color="blue",
-                    ),
-                    link=dict(
-                        source=[node_map[src] for src in top_connections["SRCIP"]],
-                        target=[node_map[dst] for dst in top_connections["DSTIP"]],
-                        value=top_connections["TOTDATA_MB"],
-                    ),
-                )
-            ]
-        )
-        fig_sankey.update_layout(title_text="Top 10 IP Data Flows", font_size=10, template="plotly_dark")
-
-        top_connections["norm_data"] = (top_connections["TOTDATA_MB"] - top_connections["TOTDATA_MB"].min()) / (top_connections["TOTDATA_MB"].max() - top_connections["TOTDATA_MB"].min())
-        colorscale = "jet"
-        color_values = colors.sample_colorscale(colorscale, top_connections["norm_data"])
-        fig_sankey_heatmap = go.Figure(
-            data=[
-                go.Sankey(
-                    node=dict(
-                        pad=15,
-                        thickness=20,
-                        line=dict(color="black", width=0.5),
-                        label=all_nodes,
-                        color="blue",
-                    ),
-                    link=dict(
-                        source=[node_map[src] for src in top_connections["SRCIP"]],
-                        target=[node_map[dst] for dst in top_connections["DSTIP"]],
-                        value=top_connections["TOTDATA_MB"],
-                        color=color_values,
-                    ),
-                )
-            ]
-        )
-        fig_sankey_heatmap.add_trace(
-            go.Scatter(
-                x=[None],
-                y=[None],
-                mode="markers",
-                marker=dict(
-                    colorscale="jet",
-                    cmin=top_connections["TOTDATA_MB"].min(),
-                    cmax=top_connections["TOTDATA_MB"].max(),
-                    colorbar=dict(
-                        title="TOTDATA_MB",
-                        titleside="right",
-                        tickmode="array",
-                        tickvals=[top_connections["TOTDATA_MB"].min(), top_connections["TOTDATA_MB"].max()],
-                        ticktext=["Low", "High"],
-                    ),
+                cmin=top_connections["TOTDATA_MB"].min(),
+                cmax=top_connections["TOTDATA_MB"].max(),
+                colorbar=dict(
+                    title="TOTDATA_MB",
+                    titleside="right",
+                    tickmode="array",
+                    tickvals=[top_connections["TOTDATA_MB"].min(), top_connections["TOTDATA_MB"].max()],
+                    ticktext=["Low", "High"],
                 ),
-                hoverinfo="none",
-            )
-        )
-        fig_sankey_heatmap.update_layout(
-            title_text="Sankey Diagram with Heatmap",
-            font_size=10,
-            xaxis=dict(showgrid=False, zeroline=False, visible=False),
-            yaxis=dict(showgrid=False, zeroline=False, visible=False),
-            template="plotly_dark",
+            ),
+            hoverinfo="none",
         )
+    )
+    fig_sankey_heatmap.update_layout(
+        title_text="Sankey Diagram with Heatmap",
+        font_size=10,
+        xaxis=dict(showgrid=False, zeroline=False, visible=False),
+        yaxis=dict(showgrid=False, zeroline=False, visible=False),
+        template="plotly_dark",
+    )
+    return fig_sankey, fig_sankey_heatmap
+
+def protocol_pie_figure(by_protocol):
+    fig_protocol_pie = px.pie(
+        by_protocol,
+        names="PROTOCOL",
+        values="ROWS",
+        title="Protocol Usage",
+        hole=0.3,
+        color_discrete_sequence=px.colors.sequential.RdBu,
+        template="plotly_dark",
+    )
+    fig_protocol_pie.update_traces(textinfo="percent+label")
+    return fig_protocol_pie
+
+def parallel_figure(top_rows):
+    return px.parallel_categories(
+        top_rows,
+        dimensions=["SRCIP", "DSTIP", "PROTOCOL"],
+        color="TOTPACKETS",
+        color_continuous_scale=px.colors.sequential.Jet,
+        template="plotly_dark",
+        labels={
+            "SRCIP": "Source IP",
+            "DSTIP": "Destination IP",
+            "PROTOCOL": "Protocol",
+            "TOTPACKETS": "Total Packets",
+        },
+        title="Top 10 Connections by Total Packets",
+    )
+
+def stacked_area_figure(by_protocol):
+    protocol_agg_melted = by_protocol[["PROTOCOL"] + required_hourly_columns].melt(
+        id_vars=["PROTOCOL"], var_name="Hour", value_name="Total Packets"
+    )
+    fig_stacked_area = px.area(
+        protocol_agg_melted,
+        x="Hour",
+        y="Total Packets",
+        color="PROTOCOL",
+        title="Network Traffic by Protocol (Hourly)",
+        template="plotly_dark",
+    )
+    fig_stacked_area.update_layout(xaxis_title="Hour", yaxis_title="Total Packets", legend_title="Protocol")
+    return fig_stacked_area
+
+def anomalies_figure(anomalies):
+    if not anomalies.empty:
+        anomalies = anomalies.nlargest(ANOMALY_POINTS, 'TOTDATA_MB').astype({col: str for col in FLOW_COLUMNS})
+    fig_anomalies = px.scatter(
+        anomalies,
+        x='SRCIP',
+        y='DSTIP',
+        size='TOTDATA_MB',
+        color='PROTOCOL',
+        hover_data=['TOTPACKETS', 'TOTDATA_MB', 'SRCIP', 'DSTIP'],
+        title='Detected Anomalies for TCP connections',
+        template='plotly_dark'
+    )
+    fig_anomalies.update_layout(height=600)
+    return fig_anomalies
 
-        fig_protocol_pie = px.pie(
-            df,
-            names="PROTOCOL",
-            title="Protocol Usage",
-            hole=0.3,
-            color_discrete_sequence=px.colors.sequential.RdBu,
-            template="plotly_dark",
-        )
-        fig_protocol_pie.update_traces(textinfo="percent+label")
-
-        fig_parallel = px.parallel_categories(
-            df.nlargest(10, "TOTPACKETS"),
-            dimensions=["SRCIP", "DSTIP", "PROTOCOL"],
-            color="TOTPACKETS",
-            color_continuous_scale=px.colors.sequential.Jet,
-            template="plotly_dark",
-            labels={
-                "SRCIP": "Source IP",
-                "DSTIP": "Destination IP",
-                "PROTOCOL": "Protocol",
-                "TOTPACKETS": "Total Packets",
-            },
-            title="Top 10 Connections by Total Packets",
-        )
-
-        protocol_agg = df.groupby("PROTOCOL", as_index=False)[required_hourly_columns].sum()
-        protocol_agg_melted = protocol_agg.melt(id_vars=["PROTOCOL"], var_name="Hour", value_name="Total Packets")
+def create_visualizations(all_data, total_cyber9_reports):
+    return build_visualizations(all_data, total_cyber9_reports)[0]
 
-        fig_stacked_area = px.area(
-            protocol_agg_melted,
-            x="Hour",
-            y="Total Packets",
-            color="PROTOCOL",
-            title="Network Traffic by Protocol (Hourly)",
-            template="plotly_dark",
-        )
-        fig_stacked_area.update_layout(xaxis_title="Hour", yaxis_title="Total Packets", legend_title="Protocol")
-
-        df['CONNECTION'] = df['SRCIP'] + '-' + df['DSTIP'] + '-' + df['SRCPORT'].astype(str) + '-' + df['DSTPORT'].astype(str)
-        df['UNIQUE_CONNECTIONS'] = df['CONNECTION'].nunique()
-
-        anomalies = detect_anomalies(df)
-        fig_anomalies = px.scatter(
-            anomalies,
-            x='SRCIP',
-            y='DSTIP',
-            size='TOTDATA_MB',
-            color='PROTOCOL',
-            hover_data=['TOTPACKETS', 'TOTDATA_MB', 'SRCIP', 'DSTIP'],
-            title='Detected Anomalies for TCP connections',
-            template='plotly_dark'
-        )
-        fig_anomalies.update_layout(height=600)
-
-        return (
-            fig_indicator_packets,
-            fig_indicator_data_points,
-            fig_indicator_cyber_reports,
-            fig_treemap_src_dst_protocol,
-            fig3,
-            fig4,
-            fig5,
-            fig_sankey,
-            fig_sankey_heatmap,
-            fig_protocol_pie,
-            fig_parallel,
-            fig_stacked_area,
-            fig_anomalies
+def build_visualizations(all_data, total_cyber9_reports):
+    """(the 13 figures, per-flow packet totals); the totals are kept for the treemap drill-down"""
+    try:
+        start_time = time.time()
+        logger.info("Starting data reading process...")
+        if len(all_data) == 0:
+            logger.error("No data available to create visualizations.")
+            return (go.Figure(),) * 13, None
+
+        df = prepare_frame(all_data)
+        aggregates = aggregate_frame(df)
+        aggregated_time = time.time()
+        figs, flows = aggregated_visualizations(aggregates, total_cyber9_reports)
+        logger.info(
+            f"Built figures for {len(df)} rows in {time.time() - start_time:.2f}s "
+            f"(aggregation {aggregated_time - start_time:.2f}s)"
         )
+        return figs, flows
+    except Exception as e:
+        logger.error(f"Error creating visualizations: {e}", exc_info=True)
+        return (go.Figure(),) * 13, None
+
+def build_folded_visualizations(folded, total_cyber9_reports):
+    """build_visualizations() for records already folded into a FrameAggregates"""
+    try:
+        if not folded.rows:
+            logger.error("No data available to create visualizations.")
+            return (go.Figure(),) * 13, None
+        start_time = time.time()
+        figs, flows = aggregated_visualizations(folded.result(), total_cyber9_reports)
+        logger.info(f"Built figures for {folded.rows} folded rows in {time.time() - start_time:.2f}s")
+        return figs, flows
     except Exception as e:
         logger.error(f"Error creating visualizations: {e}", exc_info=True)
-        return (go.Figure(),) * 13
+        return (go.Figure(),) * 13, None
+
+def aggregated_visualizations(aggregates, total_cyber9_reports):
+    fig_sankey, fig_sankey_heatmap = sankey_figures(aggregates['by_pair'])
+    figs = (
+        indicator_figure(aggregates['total_packets'], "Total Packets"),
+        indicator_figure(aggregates['total_rows'], "Total Connections"),
+        indicator_figure(total_cyber9_reports, "Total Cyber9 Line Reports"),
+        treemap_figure(aggregates['flows']),
+        top_sources_figure(aggregates['by_srcip']),
+        hourly_figure(aggregates['hourly']),
+        daily_figure(aggregates['daily']),
+        fig_sankey,
+        fig_sankey_heatmap,
+        protocol_pie_figure(aggregates['by_protocol']),
+        parallel_figure(aggregates['top_rows']),
+        stacked_area_figure(aggregates['by_protocol']),
+        anomalies_figure(aggregates['anomalies']),
+    )
+    # categorical, so the copy kept in the cache stays small however many flows there are
+    flows = aggregates['flows'][FLOW_COLUMNS + ['TOTPACKETS']].astype({col: 'category' for col in FLOW_COLUMNS})
+    return figs, flows
 
 def read_and_process_file(file_path):
     data, total_cyber9_reports = read_data(file_path=file_path)
-    figs = create_visualizations(data, total_cyber9_reports)
-    return data, figs, total_cyber9_reports
\ No newline at end of file
+    figs, flows = build_visualizations(data, total_cyber9_reports)
+    return data, figs, total_cyber9_reports, flows
\ No newline at end of file
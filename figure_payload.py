@@ -0,0 +1,97 @@
+import base64
+import math
+import numpy as np
+import plotly.io as pio
+
+# every figure is built with this template; it is stripped from each one and applied once in the browser
+THEME = "plotly_dark"
+# significant digits kept for floats; nobody reads a packet count or MB total past that
+FLOAT_DIGITS = 6
+# numeric arrays shorter than this stay plain JSON lists, the base64 form only pays off on longer ones
+TYPED_ARRAY_MIN = 8
+# what plotly.js fills in on its own; plotly express spells some of these out
+LAYOUT_DEFAULTS = {
+    ('legend', 'tracegroupgap'): 0,
+    ('xaxis', 'anchor'): 'y',
+    ('yaxis', 'anchor'): 'x',
+    ('xaxis', 'domain'): [0.0, 1.0],
+    ('yaxis', 'domain'): [0.0, 1.0],
+}
+# smallest plotly.js typed array (its dtype names) each integer range fits in; int64 has none
+INT_TYPES = [('u1', np.uint8), ('i1', np.int8), ('u2', np.uint16), ('i2', np.int16), ('u4', np.uint32), ('i4', np.int32)]
+
+
+def round_float(value):
+    if not math.isfinite(value) or value == 0:
+        return value
+    return round(value, FLOAT_DIGITS - 1 - int(math.floor(math.log10(abs(value)))))
+
+
+def typed_array(array):
+    """A numeric numpy array as a plotly.js typed array spec ({'dtype', 'bdata', 'shape'})"""
+    if array.dtype.kind in 'iu' and array.size:
+        low, high = array.min(), array.max()
+        for dtype, numpy_type in INT_TYPES:
+            info = np.iinfo(numpy_type)
+            if info.min <= low and high <= info.max:
+                array = array.astype(numpy_type)
+                break
+        else:
+            dtype, array = 'f8', array.astype(np.float64)
+    else:
+        # float32 already keeps about seven significant digits, more than FLOAT_DIGITS
+        dtype, array = 'f4', array.astype(np.float32)
+    spec = {'dtype': dtype, 'bdata': base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')}
+    if array.ndim > 1:
+        spec['shape'] = ','.join(str(size) for size in array.shape)
+    return spec
+
+
+def compact_value(value, typed=False):
+    """JSON-ready copy of a figure value: floats rounded, numeric arrays typed (typed=True, trace data only)"""
+    if isinstance(value, dict):
+        return {key: compact_value(item, typed) for key, item in value.items() if item is not None}
+    if isinstance(value, np.ndarray):
+        if typed and value.dtype.kind in 'iuf' and value.size >= TYPED_ARRAY_MIN and np.isfinite(value).all():
+            return typed_array(value)
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [compact_value(item, typed) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return round_float(value)
+    return value
+
+
+def strip_defaults(layout):
+    for (section, key), default in LAYOUT_DEFAULTS.items():
+        if layout.get(section, {}).get(key) == default:
+            del layout[section][key]
+            if not layout[section]:
+                del layout[section]
+    return layout
+
+
+def minimize_figure(fig):
+    """A figure as a compact dict for the cache and the browser, without its template.
+
+    The template comes back on the client from theme_template() (see
+    app.py), so it is sent once per page instead of once per figure.
+    The result is meant for dcc.Graph as is; plotly.py's go.Figure does
+    not take typed array specs, so it should not be rebuilt into one.
+    """
+    figure = fig if isinstance(fig, dict) else fig.to_dict()
+    layout = {key: value for key, value in figure.get('layout', {}).items() if key != 'template'}
+    return {
+        'data': [compact_value(trace, typed=True) for trace in figure.get('data', [])],
+        'layout': strip_defaults(compact_value(layout)),
+    }
+
+
+def empty_figures(count=13):
+    return [{'data': [], 'layout': {}} for _ in range(count)]
+
+
+def theme_template():
+    return compact_value(pio.templates[THEME].to_plotly_json())
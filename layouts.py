@@ -1,7 +1,6 @@
 # layouts.py
 
 from dash import dcc, html
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import logging
 from colorlog import ColoredFormatter
@@ -29,6 +28,7 @@ overview_layout = html.Div([
     # interval + store for overview
     dcc.Interval(id='overview-interval', interval=600*1000, n_intervals=0),
     dcc.Store(id='overview-figs-store', data={}),
+    dcc.Store(id='overview-treemap-store'),
     
     html.Div(
         [
@@ -42,57 +42,57 @@ overview_layout = html.Div([
 
     html.Div(className="row", children=[
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="overview-indicator-packets", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-indicator-packets", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="overview-indicator-data-points", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-indicator-data-points", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="overview-indicator-cyber-reports", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-indicator-cyber-reports", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="overview-treemap", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-treemap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-pie-chart", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-hourly-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-hourly-heatmap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-daily-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-daily-heatmap", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-sankey-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-sankey-diagram", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-sankey-heatmap-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-sankey-heatmap-diagram", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-protocol-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-protocol-pie-chart", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="overview-parallel-categories", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-parallel-categories", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="overview-stacked-area", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-stacked-area", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="overview-anomalies-scatter", figure=go.Figure(), className="card")
+            dcc.Graph(id="overview-anomalies-scatter", className="card")
         ]),
     ]),
 ])
@@ -102,6 +102,7 @@ one_hour_layout = html.Div([
     # interval + store for 1 hour data
     dcc.Interval(id='1h-interval', interval=600*1000, n_intervals=0),
     dcc.Store(id='1h-figs-store', data={}),
+    dcc.Store(id='1h-treemap-store'),
     
     html.Div(
         [
@@ -115,57 +116,57 @@ one_hour_layout = html.Div([
 
     html.Div(className="row", children=[
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="1h-indicator-packets", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-indicator-packets", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="1h-indicator-data-points", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-indicator-data-points", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="1h-indicator-cyber-reports", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-indicator-cyber-reports", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="1h-treemap", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-treemap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-pie-chart", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-hourly-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-hourly-heatmap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-daily-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-daily-heatmap", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-sankey-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-sankey-diagram", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-sankey-heatmap-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-sankey-heatmap-diagram", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-protocol-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-protocol-pie-chart", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="1h-parallel-categories", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-parallel-categories", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="1h-stacked-area", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-stacked-area", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="1h-anomalies-scatter", figure=go.Figure(), className="card")
+            dcc.Graph(id="1h-anomalies-scatter", className="card")
         ]),
     ]),
 ])
@@ -175,6 +176,7 @@ twenty_four_hour_layout = html.Div([
     # interval + store for 24 hour data
     dcc.Interval(id='24h-interval', interval=600*1000, n_intervals=0),
     dcc.Store(id='24h-figs-store', data={}),
+    dcc.Store(id='24h-treemap-store'),
     
     html.Div(
         [
@@ -188,57 +190,57 @@ twenty_four_hour_layout = html.Div([
 
     html.Div(className="row", children=[
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="24h-indicator-packets", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-indicator-packets", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="24h-indicator-data-points", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-indicator-data-points", className="card")
         ]),
         html.Div(className="col-md-4", children=[
-            dcc.Graph(id="24h-indicator-cyber-reports", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-indicator-cyber-reports", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="24h-treemap", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-treemap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-pie-chart", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-hourly-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-hourly-heatmap", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-daily-heatmap", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-daily-heatmap", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-sankey-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-sankey-diagram", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-sankey-heatmap-diagram", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-sankey-heatmap-diagram", className="card")
         ]),
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-protocol-pie-chart", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-protocol-pie-chart", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-6", children=[
-            dcc.Graph(id="24h-parallel-categories", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-parallel-categories", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="24h-stacked-area", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-stacked-area", className="card")
         ]),
     ]),
     html.Div(className="row", children=[
         html.Div(className="col-md-12", children=[
-            dcc.Graph(id="24h-anomalies-scatter", figure=go.Figure(), className="card")
+            dcc.Graph(id="24h-anomalies-scatter", className="card")
         ]),
     ]),
 ])
@@ -251,6 +253,8 @@ custom_layout = html.Div([
     html.Div(id='custom-status-alert'),
     dcc.Store(id='cleanup-dummy'),
     dcc.Store(id='custom-figs-store', data={}),
+    dcc.Store(id='custom-visuals-store'),
+    dcc.Store(id='custom-treemap-store'),
     
     html.Div(
         [
@@ -346,13 +350,13 @@ custom_layout = html.Div([
                     html.Label("Protocol:", style={"color": "white", "padding-right": "2px", "padding-left": "10px"}),
                     dcc.Dropdown(['TCP', 'UDP', 'ARP', 'ICMP', 'IGMP', 'HOPOPT', 'IPv6-ICMP'], id="filter-protocol", placeholder="e.g. TCP", value="", style={"width": "120px"}),
                     html.Label("DSTIP:", style={"color": "white", "padding-right": "2px", "padding-left": "10px"}),
-                    dcc.Input(id="filter-dstip", type="text", placeholder="e.g. 10.0.0.1", value="", style={"width": "120px"}),
+                    dcc.Input(id="filter-dstip", type="text", placeholder="e.g. 10.0.0.1, !10.0.0.2", value="", style={"width": "120px"}),
                     html.Label("SRCIP:", style={"color": "white", "padding-right": "2px", "padding-left": "10px"}),
                     dcc.Input(id="filter-srcip", type="text", placeholder="e.g. 192.168.1.1", value="", style={"width": "120px"}),
                     html.Label("SRCPORT:", style={"color": "white", "padding-right": "2px", "padding-left": "10px"}),
-                    dcc.Input(id="filter-srcport", type="text", placeholder="e.g. 80", value="", style={"width": "120px"}),
+                    dcc.Input(id="filter-srcport", type="text", placeholder="e.g. 80, 8000-8100", value="", style={"width": "120px"}),
                     html.Label("DSTPORT:", style={"color": "white", "padding-right": "2px", "padding-left": "10px"}),
-                    dcc.Input(id="filter-dstport", type="text", placeholder="e.g. 443", value="", style={"width": "120px"})
+                    dcc.Input(id="filter-dstport", type="text", placeholder="e.g. 443, !22", value="", style={"width": "120px"})
                 ],
                 className="filter-controls"
             )
@@ -367,57 +371,57 @@ custom_layout = html.Div([
         children=[
             html.Div(className="row", children=[
                 html.Div(className="col-md-4", children=[
-                    dcc.Graph(id="custom-indicator-packets", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-indicator-packets", className="card")
                 ]),
                 html.Div(className="col-md-4", children=[
-                    dcc.Graph(id="custom-indicator-data-points", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-indicator-data-points", className="card")
                 ]),
                 html.Div(className="col-md-4", children=[
-                    dcc.Graph(id="custom-indicator-cyber-reports", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-indicator-cyber-reports", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-12", children=[
-                    dcc.Graph(id="custom-treemap", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-treemap", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-pie-chart", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-pie-chart", className="card")
                 ]),
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-hourly-heatmap", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-hourly-heatmap", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-daily-heatmap", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-daily-heatmap", className="card")
                 ]),
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-sankey-diagram", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-sankey-diagram", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-sankey-heatmap-diagram", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-sankey-heatmap-diagram", className="card")
                 ]),
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-protocol-pie-chart", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-protocol-pie-chart", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-6", children=[
-                    dcc.Graph(id="custom-parallel-categories", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-parallel-categories", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-12", children=[
-                    dcc.Graph(id="custom-stacked-area", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-stacked-area", className="card")
                 ]),
             ]),
             html.Div(className="row", children=[
                 html.Div(className="col-md-12", children=[
-                    dcc.Graph(id="custom-anomalies-scatter", figure=go.Figure(), className="card")
+                    dcc.Graph(id="custom-anomalies-scatter", className="card")
                 ]),
             ]),
         ]
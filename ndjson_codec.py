@@ -0,0 +1,118 @@
+import os
+import io
+import gzip
+import orjson
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # zstd goes through pyarrow; gzip works without it
+    pa = None
+
+# codec -> suffix after the .json name, e.g. all_data.json.gz; the codec is read back from the name
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+NDJSON_SUFFIXES = (".json",) + tuple(".json" + suffix for suffix in CODECS.values())
+GZIP_LEVEL = 6
+
+
+def available(codec):
+    if codec == "zstd":
+        return pa is not None and pa.Codec.is_available("zstd")
+    return not codec or codec in CODECS
+
+
+def codec_for(path):
+    for codec, suffix in CODECS.items():
+        if path.endswith(".json" + suffix):
+            return codec
+    return None
+
+
+def stored_path(path, codec):
+    """all_data.json -> all_data.json.gz under gzip, unchanged without a codec"""
+    return path + CODECS[codec] if codec else path
+
+
+def logical_path(path):
+    """all_data.json.gz -> all_data.json, the name cache entries and columnar siblings go by"""
+    codec = codec_for(path)
+    return path[:-len(CODECS[codec])] if codec else path
+
+
+def variants(path):
+    path = logical_path(path)
+    return [path] + [path + suffix for suffix in CODECS.values()]
+
+
+def dataset_path(path):
+    """The newest stored copy of an NDJSON dataset, compressed or not; the path itself if none exists"""
+    newest, newest_mtime = path, None
+    for candidate in variants(path):
+        try:
+            mtime = os.path.getmtime(candidate)
+        except OSError:
+            continue
+        if newest_mtime is None or mtime > newest_mtime:
+            newest, newest_mtime = candidate, mtime
+    return newest
+
+
+def remove_variants(path, keep):
+    """Drop copies of a dataset written under another codec, e.g. after the setting changed"""
+    for candidate in variants(path):
+        if candidate != keep and os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def compress(data, codec):
+    """One self-contained gzip member or zstd frame; concatenated ones still read as a single stream"""
+    if not codec or not data:
+        return data
+    if codec == "gzip":
+        return gzip.compress(data, GZIP_LEVEL)
+    return pa.compress(data, codec="zstd", asbytes=True)
+
+
+def decompress(data, codec):
+    if not codec or not data:
+        return data
+    if codec == "gzip":
+        return gzip.decompress(data)
+    return pa.CompressedInputStream(pa.BufferReader(data), "zstd").read()
+
+
+def open_ndjson(path, codec=None):
+    """Open an NDJSON file for streaming binary reads, decompressing by its suffix (or codec)"""
+    codec = codec or codec_for(path)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        return io.BufferedReader(pa.CompressedInputStream(path, "zstd"))
+    return open(path, "rb")
+
+
+def decode_records(data, on_invalid=None):
+    """Parse a block of whole NDJSON lines into dicts, skipping lines that are not JSON objects.
+
+    A line that is not JSON raises, unless on_invalid(line, error) is
+    given, in which case it is reported there and skipped.
+    """
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    try:
+        # one parser call per block; only a block with a bad line pays for going line by line
+        records = orjson.loads(b"[" + b",".join(lines) + b"]")
+    except orjson.JSONDecodeError:
+        if on_invalid is None:
+            raise
+        records = []
+        for line in lines:
+            try:
+                records.append(orjson.loads(line))
+            except orjson.JSONDecodeError as e:
+                on_invalid(line, e)
+    return [record for record in records if isinstance(record, dict)]
+
+
+def decode_frame(data, columns):
+    """NDJSON lines (a spool file, a window segment) as a frame with the given columns"""
+    return pd.DataFrame.from_records(decode_records(data), columns=columns)
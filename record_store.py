@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import pandas as pd
+
+STORE_FILE = "records.sqlite"
+STORE_VERSION = 1
+# filterable fields; each gets an index on its lowercased value (the form the filters compare)
+INDEXED_FIELDS = ["PROTOCOL", "SRCIP", "DSTIP", "SRCPORT", "DSTPORT"]
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def field_clause(field_filter):
+    """SQL for one FieldFilter, with the same semantics as FieldFilter.matches"""
+    column = quote(field_filter.field)
+    # blanks and NULLs read as "" in matches(); an include term is never "", so only excludes care
+    text = f"coalesce(lower({column}), '')"
+    digits = f"({column} GLOB '[0-9]*' AND {column} NOT GLOB '*[^0-9]*')"
+    params = []
+
+    def hits(values, ranges, expression):
+        terms = []
+        if values:
+            terms.append(f"{expression} IN ({', '.join('?' * len(values))})")
+            params.extend(sorted(values))
+        for low, high in ranges:
+            terms.append(f"({digits} AND CAST({column} AS INTEGER) BETWEEN ? AND ?)")
+            params.extend([low, high])
+        return " OR ".join(terms)
+
+    clauses = []
+    if field_filter.include_values or field_filter.include_ranges:
+        # plain lower(), so the expression index on the field can serve it
+        clauses.append(f"({hits(field_filter.include_values, field_filter.include_ranges, f'lower({column})')})")
+    if field_filter.exclude_values or field_filter.exclude_ranges:
+        # a range term on a NULL column is NULL, and NOT NULL would drop the row; matches() keeps it
+        clauses.append(f"NOT coalesce(({hits(field_filter.exclude_values, field_filter.exclude_ranges, text)}), 0)")
+    return " AND ".join(clauses), params
+
+
+def query_clause(query):
+    clauses, params = [], []
+    for field_filter in query.fields:
+        clause, field_params = field_clause(field_filter)
+        clauses.append(clause)
+        params.extend(field_params)
+    return " AND ".join(clauses), params
+
+
+class RecordStore:
+    """File-backed SQLite copy of the cleaned sensor records, for custom searches.
+
+    Records are loaded file by file from the spools of unfiltered passes,
+    so nothing is parsed twice. A files table maps each sensor file to its
+    timestamp, size and mtime, which is how covers() tells whether a
+    search can be answered from the store; otherwise the caller falls
+    back to scanning. Filters become SQL over indexed expressions (see
+    field_clause). WAL mode lets the dashboard read while the collector
+    loads.
+    """
+    def __init__(self, state_dir, columns, retention_days=14):
+        self.path = os.path.join(state_dir, STORE_FILE)
+        self.columns = list(columns)
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.connection = self.connect()
+        self.create_schema()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def create_schema(self):
+        with self.lock, self.connection:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, STORE_VERSION):
+                print(f"\033[33mRecord store version {version} is unknown, rebuilding it\033[0m")
+                self.connection.execute("DROP TABLE IF EXISTS records")
+                self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, timestamp TEXT NOT NULL, "
+                "size INTEGER, mtime REAL, records INTEGER)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_timestamp ON files(timestamp)")
+            columns = ", ".join(quote(column) for column in self.columns)
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS records (file_id INTEGER NOT NULL, {columns})")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS records_file ON records(file_id)")
+            for field in INDEXED_FIELDS:
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS records_{field.lower()} ON records(lower({quote(field)}), file_id)"
+                )
+            self.connection.execute(f"PRAGMA user_version={STORE_VERSION}")
+
+    def file_info(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT name, size, mtime FROM files").fetchall()
+        return {name: (size, mtime) for name, size, mtime in rows}
+
+    def needs(self, file_path, known=None):
+        """True when a sensor file is not loaded yet or changed since it was"""
+        if known is None:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT size, mtime FROM files WHERE name = ?", (os.path.basename(file_path),)
+                ).fetchone()
+        else:
+            row = known.get(os.path.basename(file_path))
+        if row is None:
+            return True
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return row[0] != stat.st_size or row[1] != stat.st_mtime
+
+    def covers(self, file_paths):
+        """True if every one of these sensor files is loaded and unchanged"""
+        known = self.file_info()
+        return all(not self.needs(file_path, known) for file_path in file_paths)
+
+    def add_file(self, file_path, timestamp, frame):
+        """Replace a sensor file's records with a cleaned frame of them"""
+        name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        rows = list(zip(*(frame[column].tolist() for column in self.columns))) if len(frame) else []
+        placeholders = ", ".join("?" * (len(self.columns) + 1))
+        with self.lock, self.connection:
+            self._forget(name)
+            file_id = self.connection.execute(
+                "INSERT INTO files (name, timestamp, size, mtime, records) VALUES (?, ?, ?, ?, ?)",
+                (name, timestamp.isoformat(), stat.st_size, stat.st_mtime, len(rows)),
+            ).lastrowid
+            self.connection.executemany(
+                f"INSERT INTO records VALUES ({placeholders})", ((file_id,) + row for row in rows)
+            )
+
+    def _forget(self, name):
+        row = self.connection.execute("SELECT id FROM files WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM records WHERE file_id = ?", row)
+            self.connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def sync(self, current, oldest):
+        """Drop files that disappeared or aged out; current is [(timestamp, path)]"""
+        present = {os.path.basename(path) for _, path in current}
+        with self.lock:
+            rows = self.connection.execute("SELECT name, timestamp FROM files").fetchall()
+        expired = [name for name, timestamp in rows if name not in present or datetime.fromisoformat(timestamp) < oldest]
+        if expired:
+            with self.lock, self.connection:
+                for name in expired:
+                    self._forget(name)
+            print(f"\033[36mRemoved {len(expired)} expired sensor files from the record store\033[0m")
+        return expired
+
+    def iter_matches(self, file_paths, query):
+        """Yield (name, frame of matching records) per sensor file, in the given order"""
+        clause, params = query_clause(query)
+        columns = ", ".join(quote(column) for column in self.columns)
+        sql = (
+            f"SELECT {columns} FROM records WHERE file_id = (SELECT id FROM files WHERE name = ?)"
+            + (f" AND {clause}" if clause else "") + " ORDER BY rowid"
+        )
+        # a connection of its own, so a search never waits on the loader's lock
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            for file_path in file_paths:
+                name = os.path.basename(file_path)
+                rows = connection.execute(sql, [name] + params).fetchall()
+                yield name, pd.DataFrame.from_records(rows, columns=self.columns)
+        finally:
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from custom_query import CompiledQuery
+from ndjson_codec import stored_path, logical_path
+from state_files import save_json
+
+CACHE_VERSION = 1
+CUSTOM_PREFIX = "custom_"
+
+
+def custom_query_key(start_datetime, end_datetime, query):
+    """Stable key for a custom search: the time range plus the compiled filters"""
+    canonical = json.dumps(
+        [f"{start_datetime:%Y-%m-%dT%H:%M:%S}", f"{end_datetime:%Y-%m-%dT%H:%M:%S}", query.key()],
+        separators=(",", ":"),
+    )
+    return hashlib.md5(canonical.encode()).hexdigest()[:12]
+
+
+def source_digest(file_paths):
+    """Fingerprint of the sensor files a result was built from"""
+    return hashlib.md5("\n".join(os.path.basename(path) for path in file_paths).encode()).hexdigest()
+
+
+def custom_task_id(start_datetime, end_datetime, query):
+    return f"{CUSTOM_PREFIX}{custom_query_key(start_datetime, end_datetime, query)}"
+
+
+class CustomResultCache:
+    """Index of finished custom search results, keyed by the normalized query.
+
+    Each entry remembers which sensor files the result was built from, so
+    a hit is only served while the index still returns the same files for
+    that range (a search that reached into the present goes stale as new
+    files land). Results are evicted by age and then least recently used
+    first once the cache outgrows max_bytes. The index lives in the
+    collector state directory, out of the dashboard watcher's way.
+    Results are written under the collector's codec (custom_<key>.json.gz).
+    """
+    def __init__(self, output_folder, state_dir, max_bytes=2 * 1024 ** 3, max_age=24 * 3600, remove_siblings=None,
+                 codec=None):
+        self.output_folder = output_folder
+        self.codec = codec
+        self.index_path = os.path.join(state_dir, "custom_cache.json")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.remove_siblings = remove_siblings
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                stored = json.load(f)
+            if stored.get("version") == CACHE_VERSION:
+                return stored["entries"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError, KeyError) as e:
+            print(f"\033[33mUnreadable custom result cache, starting empty: {e}\033[0m")
+        return {}
+
+    def save(self):
+        save_json(self.index_path, {"version": CACHE_VERSION, "entries": self.entries})
+
+    def path_for(self, task_id):
+        return stored_path(os.path.join(self.output_folder, f"{task_id}.json"), self.codec)
+
+    def get(self, task_id, sources):
+        """Return the cached result path if it is still valid for these source files"""
+        with self.lock:
+            entry = self.entries.get(task_id)
+            if entry is None:
+                return None
+            path = self.path_for(task_id)
+            if entry["sources"] != sources or not os.path.exists(path):
+                self._drop(task_id)
+                self.save()
+                return None
+            entry["last_access"] = time.time()
+            self.save()
+            return path
+
+    def put(self, task_id, sources, records, **extra):
+        path = self.path_for(task_id)
+        with self.lock:
+            now = time.time()
+            self.entries[task_id] = dict(
+                extra,
+                sources=sources,
+                records=records,
+                size=os.path.getsize(path),
+                created=now,
+                last_access=now,
+            )
+            self._evict(keep=task_id)
+            self.save()
+        return path
+
+    def _drop(self, task_id):
+        self.entries.pop(task_id, None)
+        self._remove_files(self.path_for(task_id))
+
+    def _remove_files(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        if self.remove_siblings:
+            self.remove_siblings(path)
+
+    def _evict(self, keep=None):
+        now = time.time()
+        evicted = [
+            task_id for task_id, entry in self.entries.items()
+            if now - entry["last_access"] > self.max_age
+        ]
+        for task_id in evicted:
+            self._drop(task_id)
+        total = sum(entry["size"] for entry in self.entries.values())
+        for task_id in sorted(self.entries, key=lambda task_id: self.entries[task_id]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if task_id == keep:
+                continue
+            total -= self.entries[task_id]["size"]
+            self._drop(task_id)
+            evicted.append(task_id)
+        return evicted
+
+    def evict(self):
+        """Apply the age and size limits, sweep files the index does not know, return removed file names"""
+        with self.lock:
+            evicted = [os.path.basename(self.path_for(task_id)) for task_id in self._evict()]
+            now = time.time()
+            for entry in os.scandir(self.output_folder):
+                name, ext = os.path.splitext(logical_path(entry.name))
+                if not name.startswith(CUSTOM_PREFIX) or ext != ".json" \
+                        or (name in self.entries and entry.path == self.path_for(name)):
+                    continue
+                try:
+                    # results from before the cache, from a crash between writing and indexing,
+                    # or written under another codec
+                    if now - entry.stat().st_mtime > self.max_age:
+                        self._remove_files(entry.path)
+                        evicted.append(entry.name)
+                except OSError:
+                    continue
+            self.save()
+        return evicted
+
+    def find_superset(self, start_datetime, end_datetime, query, current_sources):
+        """Return (task_id, entry) of the smallest cached result that contains this query's answer.
+
+        A result qualifies if its time range covers the new one, its filters
+        are implied by the new ones and current_sources(start, end) says its
+        own source files have not changed since it was built.
+        """
+        with self.lock:
+            candidates = sorted(
+                (entry["size"], task_id, entry) for task_id, entry in self.entries.items()
+                if "segments" in entry
+                and datetime.fromisoformat(entry["start"]) <= start_datetime
+                and end_datetime <= datetime.fromisoformat(entry["end"])
+                and query.narrows(CompiledQuery.from_key(entry["filters"]))
+            )
+        for _, task_id, entry in candidates:
+            start, end = datetime.fromisoformat(entry["start"]), datetime.fromisoformat(entry["end"])
+            if entry["sources"] == current_sources(start, end) and os.path.exists(self.path_for(task_id)):
+                with self.lock:
+                    if task_id in self.entries:
+                        entry["last_access"] = time.time()
+                        return task_id, entry
+        return None, None
+
+    def __contains__(self, task_id):
+        with self.lock:
+            return task_id in self.entries and os.path.exists(self.path_for(task_id))
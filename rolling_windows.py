@@ -0,0 +1,395 @@
+import os
+import json
+from datetime import datetime
+from ndjson_codec import compress, stored_path, logical_path, remove_variants, open_ndjson, decode_frame
+from state_files import save_json
+
+MANIFEST_VERSION = 1
+# cleaned records of the snapshots merged timeframes are rebuilt from, under the state directory
+SNAPSHOT_DIR = "merge_snapshots"
+
+
+def copy_range(src, dst, start, end, chunk_size=8 * 1024 * 1024):
+    """Copy bytes [start, end) of an open file into another, kernel-side when possible"""
+    remaining = end - start
+    if hasattr(os, "copy_file_range"):
+        dst.flush()
+        offset = start
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+            return
+        except OSError:
+            # fall back to a userspace copy for whatever is left
+            start = offset
+        finally:
+            dst.seek(0, os.SEEK_END)
+    src.seek(start)
+    while remaining > 0:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def append_file(src_path, dst, codec=None):
+    """Append a whole file to an open binary file and return the number of bytes written.
+
+    With a codec the file goes in as one compressed frame of its own, so
+    its byte range can still be copied or cut out without touching the rest.
+    """
+    if codec:
+        with open(src_path, "rb") as src:
+            data = compress(src.read(), codec)
+        dst.write(data)
+        return len(data)
+    with open(src_path, "rb") as src:
+        length = os.fstat(src.fileno()).st_size
+        copy_range(src, dst, 0, length)
+    return length
+
+
+class RollingWindowEngine:
+    """Maintain the timeframe outputs incrementally across collector cycles.
+
+    A manifest in the state directory records every ingested sensor file
+    (size, mtime, record count) and, per timeframe, the byte range each
+    file's records occupy in the window output. Each cycle only parses
+    newly arrived files: they are appended after the current window, and
+    expired segments are dropped by copying the surviving byte ranges
+    without re-parsing them. Either way the new window is written to a
+    temp file and swapped in, so readers only ever see a whole one. Under a codec every segment is compressed on
+    its own (see append_file), so the same byte ranges hold.
+    """
+    def __init__(self, aggregator, state_dir=None):
+        self.aggregator = aggregator
+        self.state_dir = state_dir or aggregator.state_dir
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.state_dir, "manifest.json")
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+            print("\033[33mManifest version changed, rebuilding timeframes\033[0m")
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            print(f"\033[33mUnreadable manifest, rebuilding timeframes: {e}\033[0m")
+        return {"version": MANIFEST_VERSION, "files": {}, "windows": {}}
+
+    def save_manifest(self):
+        save_json(self.manifest_path, self.manifest)
+
+    def scan_sensor_files(self, oldest_cutoff):
+        """Return {name: info} for sensor files at or after the oldest cutoff"""
+        current = {}
+        for timestamp, file_path in self.aggregator.index.lookup(start=oldest_cutoff):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            current[os.path.basename(file_path)] = {
+                "path": file_path,
+                "timestamp": timestamp,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+        return current
+
+    def window_state(self, timeframe_key, output_path):
+        """Return the manifest entry for a window, resetting it if the output no longer matches"""
+        window = self.manifest["windows"].get(timeframe_key)
+        try:
+            size = os.path.getsize(output_path)
+        except OSError:
+            size = None
+        if not window or window.get("path") != output_path or window.get("size") != size:
+            if window:
+                print(f"\033[33m{timeframe_key} output does not match manifest, rebuilding\033[0m")
+            window = {"path": output_path, "size": None, "segments": []}
+            self.manifest["windows"][timeframe_key] = window
+        return window
+
+    def update(self, cutoffs):
+        """Bring every timeframe output up to date with the given cutoffs"""
+        if not cutoffs:
+            return
+        if self.aggregator.merge_connections:
+            return self.update_merged(cutoffs)
+
+        oldest_cutoff = min(cutoffs.values())
+        current = self.scan_sensor_files(oldest_cutoff)
+        known = self.manifest["files"]
+
+        # sensor files that were rewritten after we ingested them must be re-read
+        changed = {
+            name for name, info in current.items()
+            if name in known and (known[name]["size"] != info["size"] or known[name]["mtime"] != info["mtime"])
+        }
+
+        plans = {}
+        for timeframe_key, cutoff in cutoffs.items():
+            output_path = stored_path(
+                os.path.join(self.aggregator.output_folder, f"{timeframe_key}_data.json"), self.aggregator.compression
+            )
+            window = self.window_state(timeframe_key, output_path)
+            segments = window["segments"]
+            kept = [
+                seg for seg in segments
+                if datetime.fromisoformat(seg["timestamp"]) >= cutoff and seg["name"] not in changed
+            ]
+            kept_names = {seg["name"] for seg in kept}
+            new_names = sorted(
+                (name for name, info in current.items() if info["timestamp"] >= cutoff and name not in kept_names),
+                key=lambda name: current[name]["timestamp"],
+            )
+            if len(kept) == len(segments) and not new_names and window["size"] is not None:
+                print(f"\033[32m{timeframe_key} data unchanged ({sum(s['records'] for s in kept)} records)\033[0m")
+                self.aggregator.publish_columnar(logical_path(output_path), only_if_stale=True)
+                continue
+            plans[timeframe_key] = {
+                "window": window,
+                "kept": kept,
+                "new": new_names,
+                # nothing dropped and the file is intact: just append to it
+                "append": len(kept) == len(segments) and window["size"] is not None,
+            }
+
+        if not plans:
+            self.prune_files(oldest_cutoff)
+            self.save_manifest()
+            return
+
+        writers = {}
+        try:
+            for timeframe_key, plan in plans.items():
+                writers[timeframe_key] = self.open_writer(plan)
+
+            pending = sorted(
+                {name for plan in plans.values() for name in plan["new"]},
+                key=lambda name: current[name]["timestamp"],
+            )
+            paths = [current[name]["path"] for name in pending]
+            for file_path, count, spool_path in self.aggregator.iter_spooled_files(paths):
+                name = os.path.basename(file_path)
+                info = current[name]
+                known[name] = {
+                    "timestamp": info["timestamp"].isoformat(),
+                    "size": info["size"],
+                    "mtime": info["mtime"],
+                    "records": count,
+                }
+                for timeframe_key, plan in plans.items():
+                    if name in plan["new"]:
+                        self.append_segment(writers[timeframe_key], name, known[name], spool_path)
+        except Exception as e:
+            print(f"\033[31mError updating {', '.join(plans)} data: {e}\033[0m")
+            # the outputs were never touched, so the manifest still describes them
+            for writer in writers.values():
+                self.discard_writer(writer)
+            self.save_manifest()
+            return
+
+        for timeframe_key, writer in writers.items():
+            self.commit_writer(timeframe_key, plans[timeframe_key], writer)
+
+        self.prune_files(oldest_cutoff)
+        self.save_manifest()
+
+    def update_merged(self, cutoffs):
+        """update() for timeframes that keep one merged row per connection.
+
+        A merged row cannot give back the share of a snapshot that expired,
+        so a window whose snapshots changed is merged again from its
+        baseline on (see generate_merged_timeframes). The snapshots come from
+        cleaned copies kept in the state directory, so only new or rewritten
+        sensor files are parsed. Windows with the same snapshots and output
+        as last cycle are left alone.
+        """
+        oldest_cutoff = min(cutoffs.values())
+        current = {}
+        for timestamp, file_path in self.aggregator.merged_sources(oldest_cutoff):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            current[os.path.basename(file_path)] = (timestamp, [stat.st_size, stat.st_mtime])
+
+        merged = self.manifest.setdefault("merged", {})
+        signatures = {}
+        changed = {}
+        for timeframe_key, cutoff in cutoffs.items():
+            before = [name for name, (timestamp, _) in current.items() if timestamp < cutoff]
+            inside = [name for name, (timestamp, _) in current.items() if timestamp >= cutoff]
+            signatures[timeframe_key] = {name: current[name][1] for name in before[-1:] + inside}
+            output_path = stored_path(
+                os.path.join(self.aggregator.output_folder, f"{timeframe_key}_data.json"), self.aggregator.compression
+            )
+            try:
+                size = os.path.getsize(output_path)
+            except OSError:
+                size = None
+            if size is not None and merged.get(timeframe_key) == {"size": size, "files": signatures[timeframe_key]}:
+                print(f"\033[32m{timeframe_key} data unchanged ({len(inside)} snapshots)\033[0m")
+                self.aggregator.publish_columnar(logical_path(output_path), only_if_stale=True)
+            else:
+                changed[timeframe_key] = cutoff
+
+        if changed:
+            committed = self.aggregator.generate_merged_timeframes(changed, read_frames=self.snapshot_frames)
+            for timeframe_key in changed:
+                merged.pop(timeframe_key, None)
+                if timeframe_key in committed:
+                    output_path = stored_path(
+                        os.path.join(self.aggregator.output_folder, f"{timeframe_key}_data.json"),
+                        self.aggregator.compression,
+                    )
+                    merged[timeframe_key] = {"size": os.path.getsize(output_path), "files": signatures[timeframe_key]}
+
+        self.prune_snapshots(current)
+        self.save_manifest()
+
+    def snapshot_path(self, name, codec):
+        return stored_path(os.path.join(self.state_dir, SNAPSHOT_DIR, name), codec)
+
+    def snapshot_frames(self, file_paths, columns):
+        """Yield (file_path, frame) of cleaned records, parsing only files without a current copy.
+
+        This is the read_frames generate_merged_timeframes is given; the
+        copies are the spool files, compressed like the outputs.
+        """
+        cached = self.manifest.setdefault("snapshots", {})
+        codec = self.aggregator.compression
+        os.makedirs(os.path.join(self.state_dir, SNAPSHOT_DIR), exist_ok=True)
+        stats = {}
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            name = os.path.basename(file_path)
+            stats[file_path] = [stat.st_size, stat.st_mtime]
+            entry = cached.get(name)
+            if entry is not None and (entry["stat"] != stats[file_path]
+                                      or not os.path.exists(self.snapshot_path(name, entry["codec"]))):
+                # rewritten since, or its copy went missing
+                del cached[name]
+
+        stale = [file_path for file_path in stats if os.path.basename(file_path) not in cached]
+        for file_path, count, spool_path in self.aggregator.iter_spooled_files(stale):
+            name = os.path.basename(file_path)
+            path = self.snapshot_path(name, codec)
+            with open(path + ".tmp", "wb") as dst:
+                append_file(spool_path, dst, codec)
+            os.replace(path + ".tmp", path)
+            cached[name] = {"stat": stats[file_path], "codec": codec, "records": count}
+
+        for file_path in stats:
+            entry = cached.get(os.path.basename(file_path))
+            if entry is None:
+                continue
+            with open_ndjson(self.snapshot_path(os.path.basename(file_path), entry["codec"])) as f:
+                yield file_path, decode_frame(f.read(), columns)
+
+    def prune_snapshots(self, current):
+        """Drop the copies of snapshots no merged window reaches any more"""
+        cached = self.manifest.setdefault("snapshots", {})
+        for name in [name for name in cached if name not in current]:
+            del cached[name]
+        keep = {os.path.basename(self.snapshot_path(name, entry["codec"])) for name, entry in cached.items()}
+        try:
+            entries = os.scandir(os.path.join(self.state_dir, SNAPSHOT_DIR))
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.name not in keep:
+                    os.remove(entry.path)
+
+    def open_writer(self, plan):
+        window = plan["window"]
+        output_path = window["path"]
+        # even an append is staged in a temp file and swapped in on commit, so the
+        # dashboard never reads a window with a half-written segment at its end
+        temp_path = output_path + ".tmp"
+        f = open(temp_path, "wb")
+        segments = []
+        offset = 0
+        if plan["append"]:
+            # nothing is dropped, so the current window goes over as one range
+            with open(output_path, "rb") as src:
+                copy_range(src, f, 0, window["size"])
+            segments = list(plan["kept"])
+            offset = window["size"]
+        elif plan["kept"]:
+            # carry the surviving segments over byte for byte
+            with open(output_path, "rb") as src:
+                for seg in plan["kept"]:
+                    copy_range(src, f, seg["start"], seg["end"])
+                    length = seg["end"] - seg["start"]
+                    segments.append(dict(seg, start=offset, end=offset + length))
+                    offset += length
+        return {"file": f, "temp_path": temp_path, "segments": segments, "offset": offset}
+
+    def append_segment(self, writer, name, file_info, spool_path):
+        length = append_file(spool_path, writer["file"], self.aggregator.compression)
+        start = writer["offset"]
+        writer["offset"] += length
+        writer["segments"].append({
+            "name": name,
+            "timestamp": file_info["timestamp"],
+            "records": file_info["records"],
+            "start": start,
+            "end": writer["offset"],
+        })
+
+    def commit_writer(self, timeframe_key, plan, writer):
+        window = plan["window"]
+        record_count = sum(seg["records"] for seg in writer["segments"])
+        try:
+            writer["file"].close()
+            if record_count > 0:
+                os.replace(writer["temp_path"], window["path"])
+                if plan["append"]:
+                    print(f"\033[32mAppended {len(plan['new'])} files to {timeframe_key} data ({record_count} records)\033[0m")
+                else:
+                    print(f"\033[32mGenerated {timeframe_key} data with {record_count} records\033[0m")
+            else:
+                print(f"\033[33mNo data found for {timeframe_key}, skipping file creation\033[0m")
+                os.remove(writer["temp_path"])
+                window["size"] = None
+                window["segments"] = []
+                return
+            window["segments"] = writer["segments"]
+            window["size"] = writer["offset"]
+            remove_variants(window["path"], keep=window["path"])
+            self.aggregator.publish_columnar(logical_path(window["path"]))
+        except Exception as e:
+            print(f"\033[31mError generating {timeframe_key} data: {e}\033[0m")
+            self.discard_writer(writer)
+            window["size"] = None
+            window["segments"] = []
+
+    def discard_writer(self, writer):
+        writer["file"].close()
+        if os.path.exists(writer["temp_path"]):
+            os.remove(writer["temp_path"])
+
+    def prune_files(self, oldest_cutoff):
+        """Forget ingested files that no window references any more"""
+        referenced = {
+            seg["name"] for window in self.manifest["windows"].values() for seg in window["segments"]
+        }
+        self.manifest["files"] = {
+            name: info for name, info in self.manifest["files"].items()
+            if name in referenced or datetime.fromisoformat(info["timestamp"]) >= oldest_cutoff
+        }
@@ -0,0 +1,233 @@
+import os
+import json
+import shutil
+from datetime import datetime
+import pandas as pd
+from columnar import available as columnar_available, DAILY_COLUMNS, HOURLY_COLUMNS
+from ndjson_codec import dataset_path
+from state_files import save_json
+
+ROLLUP_DIR = ".rollups"
+ROLLUP_VERSION = 1
+DIMENSIONS = ["SRCIP", "DSTIP", "PROTOCOL", "SRCPORT", "DSTPORT"]
+# ROWS counts the raw connection records folded into each cube row
+MEASURES = ["ROWS", "TOTPACKETS", "TOTDATA"] + HOURLY_COLUMNS + DAILY_COLUMNS
+
+
+def rollup_pointer_path(ndjson_path):
+    """all_data.json -> all_data.rollup"""
+    return os.path.splitext(ndjson_path)[0] + ".rollup"
+
+
+def empty_cube():
+    return pd.DataFrame({column: pd.Series(dtype="object") for column in DIMENSIONS}
+                        | {column: pd.Series(dtype="float64") for column in MEASURES})
+
+
+def build_cube(frame):
+    """Group cleaned connection records by DIMENSIONS and sum the measures"""
+    cube = pd.DataFrame(index=frame.index)
+    for column in DIMENSIONS:
+        cube[column] = frame[column] if column in frame else None
+    for column in ["SRCIP", "DSTIP", "PROTOCOL"]:
+        cube[column] = cube[column].fillna("Unknown")
+    cube["ROWS"] = 1
+    for column in MEASURES[1:]:
+        values = frame[column] if column in frame else 0
+        cube[column] = pd.to_numeric(values, errors="coerce")
+        cube[column] = cube[column].fillna(0)
+    return cube.groupby(DIMENSIONS, dropna=False, sort=False, as_index=False)[MEASURES].sum()
+
+
+def merge_cubes(cubes):
+    cubes = [cube for cube in cubes if len(cube)]
+    if not cubes:
+        return empty_cube()
+    if len(cubes) == 1:
+        return cubes[0]
+    merged = pd.concat(cubes, ignore_index=True)
+    return merged.groupby(DIMENSIONS, dropna=False, sort=False, as_index=False)[MEASURES].sum()
+
+
+def write_cube(cube, path):
+    temp_path = path + ".tmp"
+    cube.to_parquet(temp_path, index=False, compression="zstd")
+    os.replace(temp_path, path)
+
+
+def read_cube(path):
+    return pd.read_parquet(path)
+
+
+def load_rollup(pointer_path):
+    """Merge the hour and file cubes a window's pointer file lists into one cube"""
+    with open(pointer_path, "r") as f:
+        pointer = json.load(f)
+    rollup_dir = os.path.join(os.path.dirname(pointer_path), ROLLUP_DIR)
+    paths = [os.path.join(rollup_dir, "hours", f"{hour}.{revision}.parquet")
+             for hour, revision in pointer["hours"].items()]
+    paths += [os.path.join(rollup_dir, "files", f"{name}.parquet") for name in pointer["files"]]
+    return merge_cubes([read_cube(path) for path in paths])
+
+
+def hour_key(timestamp):
+    return timestamp.strftime("%Y%m%d%H")
+
+
+def hour_start(key):
+    return datetime.strptime(key, "%Y%m%d%H")
+
+
+class RollupStore:
+    """Per-sensor-file and per-hour rollup cubes for the standard timeframes.
+
+    Every parsed sensor file leaves a cube of its records grouped by
+    DIMENSIONS. Cubes of the same hour are merged into an hour cube, so a
+    window is the hour cubes it fully covers plus the file cubes of the
+    hour its cutoff falls in. Each window gets a <name>.rollup pointer
+    listing exactly those cubes, which the dashboard merges instead of
+    scanning the records.
+    """
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.rollup_dir = os.path.join(output_folder, ROLLUP_DIR)
+        self.files_dir = os.path.join(self.rollup_dir, "files")
+        self.hours_dir = os.path.join(self.rollup_dir, "hours")
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.hours_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.rollup_dir, "manifest.json")
+        self.manifest = self.load_manifest()
+        self.dirty_hours = set()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == ROLLUP_VERSION:
+                return manifest
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            print(f"\033[33mUnreadable rollup manifest, rebuilding cubes: {e}\033[0m")
+        # whatever is on disk is not described by a manifest we can trust
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+        shutil.rmtree(self.hours_dir, ignore_errors=True)
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.hours_dir, exist_ok=True)
+        return {"version": ROLLUP_VERSION, "files": {}, "hours": {}}
+
+    def save_manifest(self):
+        save_json(self.manifest_path, self.manifest)
+
+    def cube_path(self, name):
+        return os.path.join(self.files_dir, f"{name}.parquet")
+
+    def hour_path(self, hour, revision):
+        return os.path.join(self.hours_dir, f"{hour}.{revision}.parquet")
+
+    def needs(self, file_path):
+        """True when a sensor file has no cube yet or changed since it was rolled up"""
+        info = self.manifest["files"].get(os.path.basename(file_path))
+        if info is None:
+            return True
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return info["size"] != stat.st_size or info["mtime"] != stat.st_mtime
+
+    def add_file(self, file_path, timestamp, cube_path):
+        """Take ownership of a freshly built file cube (None when the file had no records)"""
+        name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        if cube_path is not None and os.path.exists(cube_path):
+            os.replace(cube_path, self.cube_path(name))
+            has_cube = True
+        else:
+            if os.path.exists(self.cube_path(name)):
+                os.remove(self.cube_path(name))
+            has_cube = False
+        hour = hour_key(timestamp)
+        self.manifest["files"][name] = {
+            "timestamp": timestamp.isoformat(),
+            "hour": hour,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "cube": has_cube,
+        }
+        self.dirty_hours.add(hour)
+
+    def forget_file(self, name):
+        info = self.manifest["files"].pop(name, None)
+        if info is None:
+            return
+        if os.path.exists(self.cube_path(name)):
+            os.remove(self.cube_path(name))
+        self.dirty_hours.add(info["hour"])
+
+    def sync(self, current, oldest_cutoff):
+        """Drop cubes of files that expired or disappeared; current is [(timestamp, path)]"""
+        present = {os.path.basename(path) for _, path in current}
+        for name, info in list(self.manifest["files"].items()):
+            if name not in present or datetime.fromisoformat(info["timestamp"]) < oldest_cutoff:
+                self.forget_file(name)
+
+    def flush_hours(self):
+        """Rebuild the hour cubes whose file set changed"""
+        members = {}
+        for name, info in self.manifest["files"].items():
+            if info["cube"]:
+                members.setdefault(info["hour"], []).append(name)
+        for hour in sorted(self.dirty_hours):
+            previous = self.manifest["hours"].pop(hour, None)
+            names = members.get(hour)
+            if names:
+                revision = (previous["revision"] + 1) if previous else 1
+                write_cube(merge_cubes([read_cube(self.cube_path(name)) for name in names]), self.hour_path(hour, revision))
+                self.manifest["hours"][hour] = {"revision": revision, "files": sorted(names)}
+            if previous and os.path.exists(self.hour_path(hour, previous["revision"])):
+                os.remove(self.hour_path(hour, previous["revision"]))
+        self.dirty_hours.clear()
+
+    def window_selection(self, cutoff):
+        """Hour cubes fully inside the window plus file cubes of the hour the cutoff splits"""
+        hours = {
+            hour: entry["revision"] for hour, entry in self.manifest["hours"].items()
+            if hour_start(hour) >= cutoff
+        }
+        files = sorted(
+            name for name, info in self.manifest["files"].items()
+            if info["cube"] and info["hour"] not in hours and datetime.fromisoformat(info["timestamp"]) >= cutoff
+        )
+        return {"hours": dict(sorted(hours.items())), "files": files}
+
+    def publish_window(self, output_path, cutoff):
+        """Point a window's .rollup file at its cubes, touching it only when something changed"""
+        pointer_path = rollup_pointer_path(output_path)
+        selection = self.window_selection(cutoff)
+        if not selection["hours"] and not selection["files"]:
+            # nothing to show, leave the dashboard on whatever the NDJSON side has
+            remove_rollup_pointer(output_path)
+            return
+        try:
+            with open(pointer_path, "r") as f:
+                current = json.load(f)
+            # a rewritten NDJSON must not end up newer than the pointer that supersedes it;
+            # output_path is the logical name, the stored copy may be all_data.json.gz
+            stored_path = dataset_path(output_path)
+            fresh = not os.path.exists(stored_path) or os.path.getmtime(pointer_path) >= os.path.getmtime(stored_path)
+            if current == selection and fresh:
+                return
+        except (OSError, ValueError):
+            pass
+        save_json(pointer_path, selection)
+
+
+def remove_rollup_pointer(output_path):
+    pointer_path = rollup_pointer_path(output_path)
+    if os.path.exists(pointer_path):
+        os.remove(pointer_path)
+
+
+def rollups_available():
+    return columnar_available()
@@ -0,0 +1,348 @@
+import os
+import json
+from datetime import datetime, timedelta
+from columnar import available as columnar_available, SCHEMA
+from state_files import save_json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the archive needs pyarrow; without it the collector reads raw files only
+    pa = None
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_VERSION = 1
+# an archived sensor file is addressed as <partition>.parquet#/<sensor file name>
+MEMBER_MARKER = "#/"
+SUMMARY_FIELDS = ["PROTOCOL", "SRCIP", "DSTIP", "SRCPORT", "DSTPORT"]
+# beyond this many distinct values a field is not summarized and never prunes
+SUMMARY_LIMIT = 2048
+
+if pa is not None:
+    ARCHIVE_SCHEMA = SCHEMA.append(pa.field("FILE", pa.string()))
+
+
+def member_path(partition_path, name):
+    return f"{partition_path}{MEMBER_MARKER}{name}"
+
+
+def split_member(path):
+    """(partition path, sensor file name) for an archived member, None for a raw file"""
+    partition_path, marker, name = path.partition(MEMBER_MARKER)
+    return (partition_path, name) if marker else None
+
+
+def read_member(path, columns):
+    """Cleaned records of one archived sensor file (a single row group of its partition)"""
+    partition_path, name = split_member(path)
+    table = pq.read_table(partition_path, filters=[("FILE", "==", name)], columns=list(columns))
+    return table.to_pandas()
+
+
+def summarize(frame):
+    """Distinct lowercased values per filterable field, or None where there are too many"""
+    summary = {}
+    for field in SUMMARY_FIELDS:
+        values = frame[field].fillna("").astype(str).str.lower().unique()
+        summary[field] = sorted(values.tolist()) if len(values) <= SUMMARY_LIMIT else None
+    return summary
+
+
+def merge_summaries(summaries):
+    merged = {}
+    for field in SUMMARY_FIELDS:
+        values = set()
+        for summary in summaries:
+            if summary[field] is None:
+                values = None
+                break
+            values.update(summary[field])
+        merged[field] = sorted(values) if values is not None and len(values) <= SUMMARY_LIMIT else None
+    return merged
+
+
+def hour_key(timestamp):
+    return timestamp.strftime("%Y%m%d%H")
+
+
+class SensorArchive:
+    """Hourly zstd Parquet partitions of the cleaned sensor records.
+
+    Once an hour is closed, its sensor files are compacted into one
+    partition with one row group per file, so reading a single archived
+    file touches only its own rows. The manifest records each partition's
+    files and min/max time; a summary of the values each field takes sits
+    next to the partition. Searches use both to skip partitions that
+    cannot match.
+    Partitions older than retention_days are deleted. Raw files older
+    than raw_days are removed only once they are safely archived.
+    """
+    def __init__(self, state_dir, retention_days=90, raw_days=0, grace=timedelta(minutes=10), file_timestamp=None):
+        self.archive_dir = os.path.join(state_dir, ARCHIVE_DIR)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.archive_dir, "manifest.json")
+        self.retention_days = retention_days
+        self.raw_days = raw_days
+        self.grace = grace
+        # sensor file name -> timestamp, for rebuilding the manifest from the partitions
+        self.file_timestamp = file_timestamp
+        self.manifest_mtime = None
+        self.summaries = {}
+        self.manifest = self.load_manifest()
+
+    def read_manifest(self):
+        mtime = os.path.getmtime(self.manifest_path)
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        return manifest, mtime
+
+    def load_manifest(self):
+        """The manifest on disk, or one rebuilt from the partitions; archived data is never deleted here"""
+        try:
+            manifest, mtime = self.read_manifest()
+        except FileNotFoundError:
+            return self.rebuild_manifest()
+        except (ValueError, OSError) as e:
+            print(f"\033[33mUnreadable archive manifest, rebuilding it from the partitions: {e}\033[0m")
+            return self.rebuild_manifest()
+        if manifest.get("version") != ARCHIVE_VERSION:
+            self.set_aside(manifest.get("version"))
+            return {"version": ARCHIVE_VERSION, "partitions": {}}
+        self.manifest_mtime = mtime
+        return manifest
+
+    def rebuild_manifest(self):
+        """Manifest entries for the newest revision of each partition on disk.
+
+        Each row group holds one sensor file, so its FILE value names the
+        file. The raw file's size and mtime are not known any more, so a
+        closed hour whose raw files are still around is compacted again,
+        and its raw files are not removed until then. The result is only
+        kept in memory; the next save_manifest() writes it.
+        """
+        manifest = {"version": ARCHIVE_VERSION, "partitions": {}}
+        newest = {}
+        for name in os.listdir(self.archive_dir):
+            parts = name.split(".")
+            if len(parts) == 3 and parts[2] == "parquet" and parts[1].isdigit():
+                hour, revision = parts[0], int(parts[1])
+                newest[hour] = max(revision, newest.get(hour, 0))
+        if newest and self.file_timestamp is None:
+            print("\033[33mArchive manifest missing and no way to date the archived files, ignoring the partitions\033[0m")
+            return manifest
+        for hour, revision in newest.items():
+            path = self.partition_path(hour, revision)
+            try:
+                parquet = pq.ParquetFile(path)
+                files = {}
+                for group in range(parquet.num_row_groups):
+                    table = parquet.read_row_group(group, columns=["FILE"])
+                    if table.num_rows:
+                        name = table.column("FILE")[0].as_py()
+                        files[name] = {
+                            "timestamp": self.file_timestamp(name).isoformat(), "size": 0, "mtime": None,
+                            "records": table.num_rows,
+                        }
+            except Exception as e:
+                print(f"\033[33mSkipping unreadable archive partition {os.path.basename(path)}: {e}\033[0m")
+                continue
+            if files:
+                timestamps = [info["timestamp"] for info in files.values()]
+                manifest["partitions"][hour] = {
+                    "revision": revision, "min_time": min(timestamps), "max_time": max(timestamps), "files": files,
+                }
+        if manifest["partitions"]:
+            print(f"\033[33mRebuilt the archive manifest from {len(manifest['partitions'])} partitions\033[0m")
+        return manifest
+
+    def set_aside(self, version):
+        """Move an archive written by another version out of the way, keeping its data"""
+        aside = f"{self.archive_dir}.v{version}-{datetime.now():%Y%m%d%H%M%S}"
+        print(f"\033[33mArchive version {version} is not {ARCHIVE_VERSION}, moved it to {aside}\033[0m")
+        os.replace(self.archive_dir, aside)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.summaries = {}
+
+    def refresh(self):
+        """Pick up partitions another process (the collector) compacted since we last looked"""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return
+        if mtime == self.manifest_mtime:
+            return
+        try:
+            manifest, mtime = self.read_manifest()
+        except (ValueError, OSError) as e:
+            # keep what we have, the next refresh tries again
+            print(f"\033[33mCould not reload the archive manifest: {e}\033[0m")
+            return
+        if manifest.get("version") == ARCHIVE_VERSION:
+            self.manifest, self.manifest_mtime = manifest, mtime
+
+    def save_manifest(self):
+        save_json(self.manifest_path, self.manifest)
+        self.manifest_mtime = os.path.getmtime(self.manifest_path)
+
+    def partition_path(self, hour, revision):
+        return os.path.join(self.archive_dir, f"{hour}.{revision}.parquet")
+
+    def summary_path(self, partition_path):
+        return os.path.splitext(partition_path)[0] + ".summary.json"
+
+    def summary(self, partition_path):
+        if partition_path not in self.summaries:
+            try:
+                with open(self.summary_path(partition_path), "r") as f:
+                    self.summaries[partition_path] = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return self.summaries[partition_path]
+
+    def closed_hours(self, current, now):
+        """{hour: [(timestamp, path)]} of raw files in hours that ended at least `grace` ago"""
+        hours = {}
+        for timestamp, file_path in current:
+            hour = hour_key(timestamp)
+            end = datetime.strptime(hour, "%Y%m%d%H") + timedelta(hours=1)
+            if end + self.grace <= now:
+                hours.setdefault(hour, []).append((timestamp, file_path))
+        return hours
+
+    def pending(self, current, now):
+        """Closed hours whose raw files are not all archived as they are now"""
+        stale = {}
+        for hour, files in self.closed_hours(current, now).items():
+            archived = self.manifest["partitions"].get(hour, {}).get("files", {})
+            for _, file_path in files:
+                info = archived.get(os.path.basename(file_path))
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if info is None or info["size"] != stat.st_size or info["mtime"] != stat.st_mtime:
+                    stale[hour] = files
+                    break
+        return stale
+
+    def write_partition(self, hour, frames):
+        """Write one hour's partition from [(timestamp, file_path, cleaned frame)], merging in what it held"""
+        previous = self.manifest["partitions"].get(hour)
+        incoming = {os.path.basename(file_path) for _, file_path, _ in frames}
+        members = []
+        if previous:
+            old_path = self.partition_path(hour, previous["revision"])
+            # files whose raw copy is already gone live on only in the old partition
+            for name, info in previous["files"].items():
+                if name not in incoming:
+                    frame = read_member(member_path(old_path, name), SCHEMA.names)
+                    members.append((datetime.fromisoformat(info["timestamp"]), name, frame, info))
+        for timestamp, file_path, frame in frames:
+            stat = os.stat(file_path)
+            info = {"size": stat.st_size, "mtime": stat.st_mtime}
+            members.append((timestamp, os.path.basename(file_path), frame, info))
+        members.sort(key=lambda member: (member[0], member[1]))
+
+        revision = previous["revision"] + 1 if previous else 1
+        path = self.partition_path(hour, revision)
+        temp_path = path + ".tmp"
+        writer = pq.ParquetWriter(temp_path, ARCHIVE_SCHEMA, compression="zstd")
+        files, summaries = {}, []
+        try:
+            for timestamp, name, frame, info in members:
+                frame = frame.assign(FILE=name)
+                writer.write_table(pa.Table.from_pandas(frame, schema=ARCHIVE_SCHEMA, preserve_index=False))
+                files[name] = {
+                    "timestamp": timestamp.isoformat(), "size": info["size"], "mtime": info["mtime"],
+                    "records": len(frame),
+                }
+                summaries.append(summarize(frame))
+            writer.close()
+            with open(self.summary_path(path), "w") as f:
+                json.dump(merge_summaries(summaries), f)
+            os.replace(temp_path, path)
+        except Exception:
+            writer.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        timestamps = [timestamp for timestamp, _, _, _ in members]
+        self.manifest["partitions"][hour] = {
+            "revision": revision,
+            "min_time": min(timestamps).isoformat(),
+            "max_time": max(timestamps).isoformat(),
+            "files": files,
+        }
+        if previous:
+            self.remove_partition(hour, previous["revision"])
+
+    def remove_partition(self, hour, revision):
+        path = self.partition_path(hour, revision)
+        for stale in (path, self.summary_path(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        self.summaries.pop(path, None)
+
+    def expire(self, now):
+        oldest = now - timedelta(days=self.retention_days)
+        expired = [
+            hour for hour, partition in self.manifest["partitions"].items()
+            if datetime.fromisoformat(partition["max_time"]) < oldest
+        ]
+        for hour in expired:
+            partition = self.manifest["partitions"].pop(hour)
+            self.remove_partition(hour, partition["revision"])
+        return expired
+
+    def archived(self, timestamp, file_path):
+        """True if the raw file is archived exactly as it is on disk"""
+        partition = self.manifest["partitions"].get(hour_key(timestamp))
+        info = partition and partition["files"].get(os.path.basename(file_path))
+        if not info:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return info["size"] == stat.st_size and info["mtime"] == stat.st_mtime
+
+    def remove_raw(self, current, now):
+        """Delete raw files past raw_days that the archive already holds; returns how many went"""
+        if not self.raw_days:
+            return 0
+        cutoff = now - timedelta(days=self.raw_days)
+        removed = 0
+        for timestamp, file_path in current:
+            if timestamp < cutoff and self.archived(timestamp, file_path):
+                os.remove(file_path)
+                removed += 1
+        return removed
+
+    def lookup(self, start, end):
+        """[(timestamp, member path)] of archived files in range, pruned by partition min/max time"""
+        found = []
+        for hour, partition in self.manifest["partitions"].items():
+            if datetime.fromisoformat(partition["max_time"]) < start or datetime.fromisoformat(partition["min_time"]) > end:
+                continue
+            path = self.partition_path(hour, partition["revision"])
+            for name, info in partition["files"].items():
+                timestamp = datetime.fromisoformat(info["timestamp"])
+                if start <= timestamp <= end:
+                    found.append((timestamp, member_path(path, name)))
+        return found
+
+    def member_size(self, path):
+        """Size the raw file had when it was archived"""
+        partition_path, name = split_member(path)
+        hour = os.path.basename(partition_path).split(".")[0]
+        info = self.manifest["partitions"].get(hour, {}).get("files", {}).get(name)
+        return info["size"] if info else 0
+
+    def may_match(self, path, query):
+        """False when the value summary of an archived file's partition rules out any match"""
+        summary = self.summary(split_member(path)[0])
+        return summary is None or query.may_match(summary)
+
+
+def archive_available():
+    return columnar_available()
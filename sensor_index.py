@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from state_files import save_json
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+SENSOR_SUFFIX = "jsonALLConnections.json"
+INDEX_VERSION = 1
+
+
+class SensorFileIndex:
+    """Sorted index of the sensor files in the watch directory, keyed by filename timestamp.
+
+    The index is loaded from disk, reconciled with one directory scan and
+    then kept current from filesystem events, so time-range lookups are a
+    bisect instead of a scandir plus a strptime per file. Without events
+    (start_watching not called) a lookup rescans only when the
+    directory's mtime moved since the last scan.
+    """
+    def __init__(self, watch_directory, index_path, extract_timestamp, save_interval=30):
+        self.watch_directory = watch_directory
+        self.index_path = index_path
+        self.extract_timestamp = extract_timestamp
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.timestamps = []
+        self.names = []
+        self.known = {}
+        self.observer = None
+        self.dirty = False
+        self.last_save = 0.0
+        # directory mtime the last scan saw, None when it has to scan again regardless
+        self.scanned_mtime = None
+        self.warned_unwatched = False
+        self.load()
+        self.rebuild()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            print(f"\033[33mUnreadable sensor index, rescanning: {e}\033[0m")
+            return
+        if stored.get("version") != INDEX_VERSION or stored.get("watch_directory") != self.watch_directory:
+            return
+        with self.lock:
+            for timestamp, name in stored.get("entries", []):
+                self._insert(datetime.fromisoformat(timestamp), name)
+
+    def save(self):
+        with self.lock:
+            entries = [[ts.isoformat(), name] for ts, name in zip(self.timestamps, self.names)]
+            self.dirty = False
+            self.last_save = time.time()
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        save_json(self.index_path, {"version": INDEX_VERSION, "watch_directory": self.watch_directory, "entries": entries})
+
+    def maybe_save(self):
+        if self.dirty and time.time() - self.last_save >= self.save_interval:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"\033[33mCould not persist sensor index: {e}\033[0m")
+
+    def rebuild(self):
+        """Reconcile the index with the directory contents in one scan"""
+        mtime = os.stat(self.watch_directory).st_mtime_ns
+        on_disk = set()
+        for entry in os.scandir(self.watch_directory):
+            if entry.is_file() and entry.name.endswith(SENSOR_SUFFIX):
+                on_disk.add(entry.name)
+        with self.lock:
+            before = len(self.known)
+            gone = set(self.known) - on_disk
+            for name in gone:
+                self._remove(name)
+            for name in on_disk - set(self.known):
+                try:
+                    self._insert(self.extract_timestamp(name), name)
+                except ValueError as e:
+                    print(f"\033[33mSkipping {name}: {e}\033[0m")
+            if gone or len(self.known) != before - len(gone):
+                self.dirty = True
+            # an mtime this recent could still be shared by a file created right after the scan
+            self.scanned_mtime = mtime if time.time_ns() - mtime > 2 * 10 ** 9 else None
+        self.maybe_save()
+
+    def _insert(self, timestamp, name):
+        if name in self.known:
+            return
+        pos = bisect_right(self.timestamps, timestamp)
+        self.timestamps.insert(pos, timestamp)
+        self.names.insert(pos, name)
+        self.known[name] = timestamp
+
+    def _remove(self, name):
+        timestamp = self.known.pop(name, None)
+        if timestamp is None:
+            return
+        pos = bisect_left(self.timestamps, timestamp)
+        while pos < len(self.names) and self.names[pos] != name:
+            pos += 1
+        if pos < len(self.names):
+            del self.timestamps[pos]
+            del self.names[pos]
+
+    def add(self, name):
+        if not name.endswith(SENSOR_SUFFIX):
+            return
+        try:
+            timestamp = self.extract_timestamp(name)
+        except ValueError as e:
+            print(f"\033[33mSkipping {name}: {e}\033[0m")
+            return
+        with self.lock:
+            self._insert(timestamp, name)
+            self.dirty = True
+        self.maybe_save()
+
+    def remove(self, name):
+        with self.lock:
+            if name in self.known:
+                self._remove(name)
+                self.dirty = True
+        self.maybe_save()
+
+    def lookup(self, start=None, end=None):
+        """Return [(timestamp, path)] for sensor files with start <= timestamp <= end, oldest first"""
+        if self.observer is None:
+            # nothing is feeding us events, so the directory is the only source of truth
+            if not self.warned_unwatched:
+                self.warned_unwatched = True
+                print(f"\033[33mSensor index is not watching {self.watch_directory}, "
+                      f"rescanning it whenever it changes\033[0m")
+            try:
+                changed = os.stat(self.watch_directory).st_mtime_ns != self.scanned_mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.rebuild()
+        with self.lock:
+            lo = 0 if start is None else bisect_left(self.timestamps, start)
+            hi = len(self.timestamps) if end is None else bisect_right(self.timestamps, end)
+            return [
+                (self.timestamps[i], os.path.join(self.watch_directory, self.names[i]))
+                for i in range(lo, hi)
+            ]
+
+    def start_watching(self):
+        """Follow filesystem events so lookups no longer need to rescan the directory"""
+        if self.observer is not None:
+            return
+        observer = Observer()
+        observer.schedule(SensorFileEventHandler(self), path=self.watch_directory, recursive=False)
+        observer.daemon = True
+        observer.start()
+        # catch anything that landed between the initial scan and the observer starting
+        self.observer = observer
+        self.rebuild()
+        print(f"\033[36mIndexing sensor files in {self.watch_directory}\033[0m")
+
+    def stop_watching(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.dirty:
+            self.save()
+
+
+class SensorFileEventHandler(FileSystemEventHandler):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.index.add(os.path.basename(event.src_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.index.remove(os.path.basename(event.src_path))
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.index.remove(os.path.basename(event.src_path))
+            watched = os.path.abspath(self.index.watch_directory)
+            if os.path.dirname(os.path.abspath(event.dest_path)) == watched:
+                self.index.add(os.path.basename(event.dest_path))
@@ -0,0 +1,23 @@
+import os
+import json
+import tempfile
+
+
+def save_json(path, data):
+    """Write data as JSON to path atomically, through a temp file next to it.
+
+    The collector and the dashboard keep their state in the same
+    directory, so the temp name is unique per write; a shared name lets
+    one process rename the other's half-written copy into place.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        # mkstemp makes the file owner-only; state files are read like any other output
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,285 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+
+class JobCancelled(Exception):
+    """Raised inside a custom job once its cancel event is set"""
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def check_cancelled(cancel):
+    """Checkpoint for long jobs: bail out if the scheduler cancelled this one"""
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled()
+
+
+class CustomTaskScheduler:
+    """Runs custom searches on a pool of worker threads.
+
+    Jobs wait in a priority heap (lower runs first) and workers block on a
+    condition instead of polling. Sensor parsing inside a job goes to the
+    aggregator's process pool, so the workers themselves only orchestrate
+    and several jobs parse in parallel without contending for the GIL.
+
+    Each task keeps the set of waiters, (user, client) pairs, polling for
+    it. A client that submits a different search, or that stops polling
+    for heartbeat_timeout seconds, drops out; a task nobody waits on any
+    more is cancelled. Admission is bounded by max_queue pending tasks
+    overall and per_user active tasks per user.
+
+    A submission may carry a cost estimate ({'files', 'bytes'}). Searches
+    over max_bytes are rejected outright, and those over heavy_bytes run
+    one at a time so a few large scans cannot take every worker. Jobs
+    report progress(done, total) as they go, which becomes the task's
+    progress fraction and ETA, and may publish partial(result, done,
+    total) snapshots, kept until the job ends and versioned in the
+    task's 'partial' entry.
+    """
+    def __init__(self, run_job, workers=2, max_queue=20, per_user=1, heartbeat_timeout=60, task_ttl=3600,
+                 max_bytes=0, heavy_bytes=0):
+        self.run_job = run_job
+        self.workers = max(1, int(workers))
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.max_bytes = max_bytes
+        self.heavy_bytes = heavy_bytes
+        self.heartbeat_timeout = heartbeat_timeout
+        self.task_ttl = task_ttl
+        self.condition = threading.Condition()
+        self.active_tasks = {}
+        self.jobs = {}
+        self.partials = {}
+        self.heap = []
+        self.sequence = itertools.count()
+        self.threads = []
+        self.stopped = False
+
+    @property
+    def lock(self):
+        return self.condition
+
+    def submit(self, task_id, args, waiter=(None, None), priority=0, reusable=None, cost=None):
+        """Queue a job (or join an identical one) and return its task id.
+
+        reusable(task) decides whether a completed task may be handed out
+        again, e.g. only while its result file is still cached.
+        """
+        now = time.time()
+        with self.condition:
+            self._release_waiter(waiter, keep=task_id)
+            task = self.active_tasks.get(task_id)
+            job = self.jobs.get(task_id)
+            if job is not None:
+                job['waiting'][waiter] = now
+                return task_id
+            if task is not None and task['status'] == 'complete' and (reusable is None or reusable(task)):
+                return task_id
+
+            message = None
+            pending = sum(1 for task in self.active_tasks.values() if task['status'] == 'pending')
+            if self.max_bytes and cost and cost['bytes'] > self.max_bytes:
+                message = (f"This search would read {format_bytes(cost['bytes'])} of sensor data "
+                           f"(limit {format_bytes(self.max_bytes)}), please narrow the time range")
+            elif pending >= self.max_queue:
+                message = 'Too many searches queued, please try again shortly'
+            elif self.per_user and self._user_load(waiter[0]) >= self.per_user:
+                message = 'You already have a search running'
+            if message:
+                self.active_tasks[task_id] = self._status('rejected', task_id, message=message, cost=cost)
+                return task_id
+
+            self.active_tasks[task_id] = self._status('pending', task_id, priority=priority, cost=cost)
+            self.jobs[task_id] = {'args': args, 'cancel': threading.Event(), 'waiting': {waiter: now}}
+            heapq.heappush(self.heap, (priority, next(self.sequence), task_id))
+            self.condition.notify()
+        return task_id
+
+    def _status(self, status, task_id, message=None, priority=0, cost=None):
+        return {
+            'status': status,
+            'filename': f"{task_id}.json",
+            'created_at': datetime.now(),
+            'message': message,
+            'priority': priority,
+            'cost': cost,
+            'progress': 0.0,
+            'eta': None,
+            'partial': None,
+        }
+
+    def _heavy(self, task_id):
+        cost = self.active_tasks[task_id].get('cost')
+        return bool(self.heavy_bytes and cost and cost['bytes'] > self.heavy_bytes)
+
+    def _user_load(self, user):
+        return sum(1 for job in self.jobs.values() if any(waiter[0] == user for waiter in job['waiting']))
+
+    def _release_waiter(self, waiter, keep=None):
+        """A new submission replaces whatever else this client was waiting on"""
+        for task_id, job in list(self.jobs.items()):
+            if task_id != keep and waiter in job['waiting']:
+                del job['waiting'][waiter]
+                if not job['waiting']:
+                    self._cancel(task_id, 'Replaced by a newer search')
+
+    def _cancel(self, task_id, message):
+        # a pending job is skipped when it comes off the heap, a running one stops at its next check
+        job = self.jobs.pop(task_id, None)
+        if job is None:
+            return
+        job['cancel'].set()
+        self.partials.pop(task_id, None)
+        task = self.active_tasks[task_id]
+        task['status'] = 'cancelled'
+        task['message'] = message
+        task['partial'] = None
+
+    def heartbeat(self, task_id, waiter=(None, None)):
+        """Called while a client's page is still polling for a task"""
+        with self.condition:
+            job = self.jobs.get(task_id)
+            if job is not None:
+                job['waiting'][waiter] = time.time()
+
+    def cancel(self, task_id, waiter=(None, None)):
+        with self.condition:
+            job = self.jobs.get(task_id)
+            if job is not None:
+                job['waiting'].pop(waiter, None)
+                if not job['waiting']:
+                    self._cancel(task_id, 'Cancelled')
+
+    def _reap(self):
+        now = time.time()
+        for task_id, job in list(self.jobs.items()):
+            for waiter, seen in list(job['waiting'].items()):
+                if now - seen > self.heartbeat_timeout:
+                    del job['waiting'][waiter]
+            if not job['waiting']:
+                self._cancel(task_id, 'Nobody is waiting for this search any more')
+        expired = [
+            task_id for task_id, task in self.active_tasks.items()
+            if task_id not in self.jobs and (datetime.now() - task['created_at']).total_seconds() > self.task_ttl
+        ]
+        for task_id in expired:
+            del self.active_tasks[task_id]
+
+    def _next_job(self):
+        """Block until a job can run and claim it; returns None once stopped"""
+        with self.condition:
+            while not self.stopped:
+                self._reap()
+                heavy_running = any(
+                    self.active_tasks[task_id]['status'] == 'processing' and self._heavy(task_id) for task_id in self.jobs
+                )
+                deferred = []
+                claimed = None
+                while self.heap and claimed is None:
+                    entry = heapq.heappop(self.heap)
+                    task_id = entry[2]
+                    job = self.jobs.get(task_id)
+                    if job is None or job['cancel'].is_set() or self.active_tasks[task_id]['status'] != 'pending':
+                        continue
+                    if heavy_running and self._heavy(task_id):
+                        # wait for the running large scan; lighter jobs behind it may go first
+                        deferred.append(entry)
+                        continue
+                    self.active_tasks[task_id]['status'] = 'processing'
+                    self.active_tasks[task_id]['started_at'] = datetime.now()
+                    claimed = task_id, job
+                for entry in deferred:
+                    heapq.heappush(self.heap, entry)
+                if claimed is not None:
+                    return claimed
+                # wake up now and then to notice users who stopped polling
+                self.condition.wait(timeout=min(self.heartbeat_timeout, 30))
+        return None
+
+    def _progress(self, task_id, job, done, total):
+        with self.condition:
+            if self.jobs.get(task_id) is not job or not total:
+                return
+            task = self.active_tasks[task_id]
+            fraction = min(done / total, 1.0)
+            elapsed = (datetime.now() - task['started_at']).total_seconds()
+            task['progress'] = fraction
+            task['eta'] = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+
+    def _partial(self, task_id, job, result, done, total):
+        with self.condition:
+            if self.jobs.get(task_id) is not job:
+                return
+            task = self.active_tasks[task_id]
+            version = (task['partial'] or {}).get('version', 0) + 1
+            task['partial'] = {'version': version, 'done': done, 'total': total}
+            self.partials[task_id] = result
+
+    def partial_result(self, task_id):
+        """Latest partial snapshot of a running task, or None"""
+        with self.condition:
+            return self.partials.get(task_id)
+
+    def _finish(self, task_id, job, status, filename=None, message=None):
+        with self.condition:
+            if self.jobs.get(task_id) is not job:
+                # cancelled meanwhile, and maybe already resubmitted as a new job
+                return
+            del self.jobs[task_id]
+            self.partials.pop(task_id, None)
+            task = self.active_tasks[task_id]
+            task['partial'] = None
+            task['status'] = status
+            task['message'] = message
+            if status == 'complete':
+                task['progress'], task['eta'] = 1.0, 0
+            # a heavy job may have been holding others back
+            self.condition.notify_all()
+            if filename:
+                task['filename'] = filename
+
+    def worker(self):
+        while True:
+            claimed = self._next_job()
+            if claimed is None:
+                return
+            task_id, job = claimed
+            try:
+                result = self.run_job(
+                    *job['args'], cancel=job['cancel'],
+                    progress=lambda done, total: self._progress(task_id, job, done, total),
+                    partial=lambda result, done, total: self._partial(task_id, job, result, done, total),
+                )
+                if result:
+                    self._finish(task_id, job, 'complete', filename=os.path.basename(result))
+                elif job['cancel'].is_set():
+                    self._finish(task_id, job, 'cancelled')
+                else:
+                    self._finish(task_id, job, 'failed', message='No data found in timeframe')
+            except JobCancelled:
+                self._finish(task_id, job, 'cancelled')
+            except Exception as e:
+                self._finish(task_id, job, 'failed', message=str(e))
+
+    def start(self):
+        for i in range(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self.worker, name=f"custom-task-{len(self.threads)}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            for job in self.jobs.values():
+                job['cancel'].set()
+            self.condition.notify_all()
@@ -0,0 +1,31 @@
+"""Helpers for writing small sensor files (header row, then records) into a test watch directory"""
+import json
+import os
+from datetime import datetime, timedelta
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+HOURS = ['12AM', '1AM', '2AM', '3AM', '4AM', '5AM', '6AM', '7AM', '8AM', '9AM', '10AM', '11AM',
+         '12PM', '1PM', '2PM', '3PM', '4PM', '5PM', '6PM', '7PM', '8PM', '9PM', '10PM', '11PM']
+DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+HEADER = ['PROTOCOL', 'SRCIP', 'DSTIP', 'SRCPORT', 'DSTPORT', 'SRCMAC', 'DSTMAC', 'SRCCC', 'DSTCC',
+          'TOTPACKETS', 'TOTDATA'] + DAYS + HOURS
+
+
+def sensor_name(minute):
+    return f"sensor-FM1-{START + timedelta(minutes=minute):%Y-%m-%d-%H-%M-%S}_jsonALLConnections.json"
+
+
+def sensor_record(**fields):
+    record = dict({field: 0 for field in DAYS + HOURS}, PROTOCOL="TCP", SRCIP="10.0.0.2", DSTIP="10.0.0.1",
+                  SRCPORT="443", DSTPORT="51000", SRCMAC="", DSTMAC="", SRCCC="", DSTCC="",
+                  TOTPACKETS=100, TOTDATA="1.5 MB")
+    record.update(fields)
+    return record
+
+
+def write_sensor_file(watch, minute, rows=3, packets=100, records=None):
+    """A sensor file whose records (by default) all carry SRCIP 10.<minute>.0.<n>, so each can be told apart"""
+    if records is None:
+        records = [sensor_record(SRCIP=f"10.{minute}.0.{n}", TOTPACKETS=packets + n) for n in range(rows)]
+    with open(os.path.join(watch, sensor_name(minute)), "w") as f:
+        json.dump([HEADER] + records, f)
@@ -0,0 +1,109 @@
+import os
+from datetime import timedelta
+
+import orjson
+import pandas as pd
+import pytest
+
+from collector import NetworkDataAggregator
+from connection_merge import ConnectionMerger
+from ndjson_codec import open_ndjson, stored_path
+from rolling_windows import RollingWindowEngine
+from sensor_files import START, sensor_name, sensor_record, write_sensor_file
+
+COLUMNS = ["PROTOCOL", "SRCIP", "DSTIP", "SRCPORT", "DSTPORT", "TOTPACKETS", "TOTDATA"]
+
+
+def snapshot(*connections):
+    """(source address, packets, data) per connection, all TCP to 10.0.1.1:80"""
+    return pd.DataFrame([
+        {"PROTOCOL": "TCP", "SRCIP": srcip, "DSTIP": "10.0.1.1", "SRCPORT": "443", "DSTPORT": "80",
+         "TOTPACKETS": packets, "TOTDATA": data}
+        for srcip, packets, data in connections
+    ], columns=COLUMNS)
+
+
+def at(minute):
+    return START + timedelta(minutes=minute)
+
+
+def test_deltas_across_baseline_growth_resets_and_gaps():
+    merger = ConnectionMerger(COLUMNS)
+    merger.seed(snapshot(("steady", 100, 1.0), ("reset", 500, 5.0), ("gone", 70, 0.5)))
+    merger.add(snapshot(("steady", 130, 1.5), ("reset", 520, 5.5), ("new", 40, 0.25)), at(0))
+    # the counters of "reset" went backwards: the whole current value is the interval's traffic
+    merger.add(snapshot(("steady", 150, 2.0), ("reset", 10, 0.125), ("new", 60, 0.5), ("new", 5, 0.0)), at(10))
+    # "new" sits one snapshot out and comes back; its delta is against the last snapshot it was in
+    merger.add(snapshot(("steady", 150, 2.0), ("reset", 25, 0.25)), at(20))
+    merger.add(snapshot(("new", 90, 1.0)), at(30))
+
+    result = merger.result().set_index("SRCIP")
+    assert sorted(result.index) == ["new", "reset", "steady"]
+    assert result.loc["steady", ["TOTPACKETS", "DELTAPACKETS", "SNAPSHOTS"]].tolist() == [150, 50, 3]
+    assert result.loc["steady", "DELTADATA"] == pytest.approx(1.0)
+    assert result.loc["reset", ["TOTPACKETS", "DELTAPACKETS", "SNAPSHOTS"]].tolist() == [25, 20 + 10 + 15, 3]
+    assert result.loc["reset", "DELTADATA"] == pytest.approx(0.5 + 0.125 + 0.125)
+    # duplicate rows of one tuple in a snapshot add up: 65 at minute 10
+    assert result.loc["new", ["TOTPACKETS", "DELTAPACKETS", "SNAPSHOTS"]].tolist() == [90, 40 + 25 + 25, 3]
+    assert result.loc["new", ["FIRSTSEEN", "LASTSEEN"]].tolist() == [at(0).isoformat(), at(30).isoformat()]
+    assert result.loc["steady", ["FIRSTSEEN", "LASTSEEN"]].tolist() == [at(0).isoformat(), at(20).isoformat()]
+    assert result["TOTPACKETS"].dtype == "int64" and result["DELTAPACKETS"].dtype == "int64"
+
+
+def test_nothing_counted_without_a_snapshot_in_the_window():
+    merger = ConnectionMerger(COLUMNS)
+    assert merger.result().empty
+    merger.seed(snapshot(("baseline", 10, 1.0)))
+    assert merger.result().empty
+
+
+def write_snapshot(watch, minute, packets):
+    records = [sensor_record(SRCIP=f"10.0.0.{n}", TOTPACKETS=packets * (n + 1)) for n in range(4)]
+    write_sensor_file(watch, minute, records=records)
+
+
+def merged_records(aggregator):
+    path = stored_path(os.path.join(aggregator.output_folder, "all_data.json"), aggregator.compression)
+    with open_ndjson(path) as f:
+        return sorted((orjson.loads(line) for line in f if line.strip()), key=lambda record: record["SRCIP"])
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_incremental_merge_matches_a_full_rebuild(tmp_path, monkeypatch, compression):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    for minute, packets in [(0, 100), (10, 150), (20, 180)]:
+        write_snapshot(str(watch), minute, packets)
+    engine_side = NetworkDataAggregator(str(watch), str(tmp_path / "engine"), workers=1, compression=compression,
+                                        merge_connections=True)
+    rebuilt = NetworkDataAggregator(str(watch), str(tmp_path / "rebuilt"), workers=1, compression=compression,
+                                    merge_connections=True)
+    parsed = []
+    spool = engine_side.iter_spooled_files
+    monkeypatch.setattr(engine_side, "iter_spooled_files",
+                        lambda paths: spool([parsed.append(os.path.basename(path)) or path for path in paths]))
+    try:
+        engine = RollingWindowEngine(engine_side)
+        # (oldest cutoff minute, new snapshot written first, sensor files the engine has to parse)
+        cycles = [
+            (5, None, [0, 10, 20]),
+            (5, None, []),
+            (5, (30, 260), [30]),
+            # the baseline moves to minute 10, which is cached like the rest
+            (15, None, []),
+        ]
+        for oldest_minute, new_snapshot, expect_parsed in cycles:
+            if new_snapshot:
+                write_snapshot(str(watch), *new_snapshot)
+            parsed.clear()
+            cutoffs = {"all": at(oldest_minute)}
+            engine.update(cutoffs)
+            rebuilt.generate_timeframes(cutoffs)
+            assert merged_records(engine_side) == merged_records(rebuilt)
+            assert parsed == [sensor_name(minute) for minute in expect_parsed]
+        # minute 0 is out of reach once minute 10 is the baseline
+        assert sorted(engine.manifest["snapshots"]) == [sensor_name(minute) for minute in (10, 20, 30)]
+        assert len(os.listdir(os.path.join(engine.state_dir, "merge_snapshots"))) == 3
+    finally:
+        engine_side.close()
+        rebuilt.close()
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+import orjson
+import pytest
+
+from collector import NetworkDataAggregator
+from ndjson_codec import open_ndjson
+from sensor_files import START, sensor_record, write_sensor_file
+
+PORTS = ["22", "80", "85", "90", "443", "8080", ""]
+PROTOCOLS = ["TCP", "udp", "ICMP"]
+
+# (wider cached search, narrower search, minutes cut off the start, whether it can be derived)
+CASES = [
+    ({"PROTOCOL": "tcp"}, {"PROTOCOL": "TCP", "DSTPORT": "!80-90"}, 0, True),
+    ({"DSTPORT": "1-1024"}, {"DSTPORT": "80-90, 443"}, 0, True),
+    ({}, {"PROTOCOL": "udp", "SRCPORT": "!443, !8000-9000"}, 0, True),
+    ({"PROTOCOL": "tcp, udp"}, {"PROTOCOL": "udp"}, 25, True),
+    ({"SRCPORT": "!22"}, {"SRCPORT": "!22"}, 25, True),
+    # implies() is deliberately conservative with exclude terms and with ranges against plain values
+    ({"DSTPORT": "!80"}, {"DSTPORT": "!80, !443"}, 0, False),
+    ({"DSTPORT": "80, 85"}, {"DSTPORT": "80-85"}, 0, False),
+    ({"PROTOCOL": "!icmp"}, {"PROTOCOL": "tcp"}, 0, False),
+]
+
+
+def write_sensor_files(watch):
+    for minute in range(0, 60, 10):
+        records = [
+            sensor_record(PROTOCOL=PROTOCOLS[n % 3], SRCIP=f"10.{minute}.0.{n}", SRCPORT=PORTS[(n + 3) % 7],
+                          DSTPORT=PORTS[n % 7], TOTPACKETS=minute * 100 + n)
+            for n in range(14)
+        ]
+        write_sensor_file(watch, minute, records=records)
+
+
+def records(path):
+    with open_ndjson(path) as f:
+        return sorted((orjson.loads(line) for line in f if line.strip()), key=lambda record: record["SRCIP"])
+
+
+@pytest.fixture
+def watch(tmp_path):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    write_sensor_files(str(watch))
+    return str(watch)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("wide, narrow, skip, derivable", CASES)
+def test_derived_result_equals_a_fresh_scan(tmp_path, watch, monkeypatch, compression, wide, narrow, skip, derivable):
+    start, end = START, START + timedelta(hours=1)
+    scanner = NetworkDataAggregator(watch, str(tmp_path / "scan"), workers=1, compression=compression)
+    deriver = NetworkDataAggregator(watch, str(tmp_path / "derive"), workers=1, compression=compression)
+    try:
+        expected = scanner.generate_custom_dataset(start + timedelta(minutes=skip), end, filters=narrow)
+        assert deriver.generate_custom_dataset(start, end, filters=wide)
+
+        scans = []
+        build = deriver.build_custom_dataset
+        monkeypatch.setattr(deriver, "build_custom_dataset", lambda *args: scans.append(args) or build(*args))
+        result = deriver.generate_custom_dataset(start + timedelta(minutes=skip), end, filters=narrow)
+
+        assert records(result) == records(expected)
+        assert len(records(expected)) > 0
+        assert (not scans) == derivable
+    finally:
+        scanner.close()
+        deriver.close()
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from custom_query import CompiledQuery
+from record_store import RecordStore, INDEXED_FIELDS
+
+PORTS = ["80", "080", "80.0", "8e1", "+80", "-80", "79", "81", "443", "65535", "", None, "abc", "٨٠"]
+PROTOCOLS = ["TCP", "tcp", "UDP", "icmp", None, ""]
+
+ROWS = [
+    {"PROTOCOL": PROTOCOLS[n % len(PROTOCOLS)], "SRCIP": f"10.0.0.{n}", "DSTIP": "10.0.1.1",
+     "SRCPORT": PORTS[(n * 5) % len(PORTS)], "DSTPORT": PORTS[n % len(PORTS)]}
+    for n in range(len(PORTS) * 3)
+]
+
+FILTERS = [
+    {"DSTPORT": "79-81"},
+    {"DSTPORT": "80"},
+    {"DSTPORT": "!79-81"},
+    {"DSTPORT": "!80, 0-1000"},
+    {"SRCPORT": "443, 60000-70000"},
+    {"SRCPORT": "!0-100, !443"},
+    {"PROTOCOL": "tcp", "DSTPORT": "1-100"},
+    {"PROTOCOL": "!udp", "SRCPORT": "!80"},
+    {"DSTPORT": "80.0"},
+    {"DSTPORT": "!abc"},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    sensor_file = tmp_path / "sensor-FM1-2026-01-01-00-00-00_jsonALLConnections.json"
+    sensor_file.write_text("[]")
+    store = RecordStore(str(tmp_path), INDEXED_FIELDS)
+    store.add_file(str(sensor_file), datetime(2026, 1, 1), pd.DataFrame(ROWS, columns=INDEXED_FIELDS))
+    yield store, str(sensor_file)
+    store.close()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_mask_matches_and_sql_agree(store, filters):
+    store, sensor_file = store
+    query = CompiledQuery(filters)
+    expected = [row["SRCIP"] for row in ROWS if query.matches(row)]
+
+    frame = pd.DataFrame(ROWS, columns=INDEXED_FIELDS)
+    assert frame.loc[query.mask(frame), "SRCIP"].tolist() == expected
+
+    (_, matched), = store.iter_matches([sensor_file], query)
+    assert matched["SRCIP"].tolist() == expected
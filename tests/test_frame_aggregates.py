@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import data_processing
+from data_processing import FrameAggregates, aggregate_frame, prepare_frame
+
+
+def records(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'SRCIP': rng.integers(0, 40, count).astype(str), 'DSTIP': rng.integers(0, 10, count).astype(str),
+        'PROTOCOL': rng.choice(['TCP', 'UDP', 'ICMP'], count), 'SRCPORT': rng.integers(0, 2000, count).astype(str),
+        'DSTPORT': rng.integers(0, 100, count).astype(str),
+        'TOTPACKETS': rng.integers(1, 10 ** 6, count), 'TOTDATA': rng.random(count) * 100,
+    })
+
+
+def fold(data, pieces):
+    folded = FrameAggregates()
+    for part in np.array_split(np.arange(len(data)), pieces):
+        folded.add(data.iloc[part].reset_index(drop=True))
+    return folded
+
+
+def test_fold_matches_a_single_pass():
+    data = records(3000)
+    whole = aggregate_frame(prepare_frame(data))
+    folded = fold(data, 17).result()
+    for key in ['flows', 'by_srcip', 'by_pair', 'by_protocol']:
+        pd.testing.assert_frame_equal(folded[key].reset_index(drop=True), whole[key].reset_index(drop=True),
+                                      check_dtype=False)
+    for key in ['hourly', 'daily']:
+        pd.testing.assert_series_equal(folded[key], whole[key], check_dtype=False)
+    assert (folded['total_packets'], folded['total_rows']) == (whole['total_packets'], whole['total_rows'])
+    assert folded['top_rows']['TOTPACKETS'].tolist() == whole['top_rows']['TOTPACKETS'].tolist()
+
+
+def test_anomaly_rows_stay_bounded(monkeypatch):
+    monkeypatch.setattr(data_processing, 'ANOMALY_SAMPLE', 200)
+    monkeypatch.setattr(data_processing, 'ANOMALY_CANDIDATES', 50)
+    data = records(5000, seed=1)
+    folded = fold(data, 25)
+    assert len(folded.anomaly_rows) <= 200 + 2 * 50
+    # the largest rows are always kept as candidates for the scatter
+    assert set(data.nlargest(50, 'TOTPACKETS').index) <= set(folded.anomaly_rows['ROW'])
+    assert len(folded.result()['anomalies']) > 0
@@ -0,0 +1,65 @@
+import os
+
+import orjson
+import pytest
+
+from ndjson_codec import (
+    available, compress, dataset_path, decode_records, decompress, logical_path, open_ndjson, stored_path,
+)
+
+CODECS = [None, "gzip", pytest.param("zstd", marks=pytest.mark.skipif(not available("zstd"), reason="no zstd codec"))]
+
+
+def segment(first, count):
+    return b"".join(orjson.dumps({"SRCIP": f"10.0.0.{n}", "TOTPACKETS": n}) + b"\n" for n in range(first, first + count))
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compress_round_trips_through_open_ndjson(tmp_path, codec):
+    data = segment(0, 500)
+    path = stored_path(str(tmp_path / "all_data.json"), codec)
+    with open(path, "wb") as f:
+        f.write(compress(data, codec))
+    with open_ndjson(path) as f:
+        assert f.read() == data
+    assert decompress(compress(data, codec), codec) == data
+    assert logical_path(path) == str(tmp_path / "all_data.json")
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_segments_can_be_cut_out_of_the_stream(tmp_path, codec):
+    # each segment is compressed on its own, so dropping one by its byte range leaves a valid stream
+    segments = [segment(first, 40 + first) for first in range(0, 400, 100)]
+    frames = [compress(data, codec) for data in segments]
+    kept = frames[:1] + frames[2:]
+    path = stored_path(str(tmp_path / "24_hours_data.json"), codec)
+    with open(path, "wb") as f:
+        f.write(b"".join(kept))
+
+    with open_ndjson(path) as f:
+        records = decode_records(f.read())
+    expected = decode_records(b"".join(segments[:1] + segments[2:]))
+    assert records == expected
+    assert [record["TOTPACKETS"] for record in records][:41] == list(range(40)) + [200]
+
+
+def test_dataset_path_prefers_the_newest_copy(tmp_path):
+    path = str(tmp_path / "1_hour_data.json")
+    assert dataset_path(path) == path
+    for age, name in [(3000, path), (2000, path + ".gz")]:
+        with open(name, "wb"):
+            pass
+        os.utime(name, (age, age))
+    assert dataset_path(path) == path
+    os.utime(path + ".gz", (4000, 4000))
+    assert dataset_path(path) == path + ".gz"
+    assert dataset_path(path + ".gz") == path + ".gz"
+
+
+def test_decode_records_reports_bad_lines():
+    data = b'{"a": 1}\nnot json\n[1, 2]\n\n{"a": 2}\n'
+    with pytest.raises(orjson.JSONDecodeError):
+        decode_records(data)
+    invalid = []
+    assert decode_records(data, on_invalid=lambda line, e: invalid.append(line)) == [{"a": 1}, {"a": 2}]
+    assert invalid == [b"not json"]
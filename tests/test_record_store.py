@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from custom_query import CompiledQuery
+from record_store import RecordStore, INDEXED_FIELDS
+
+ROWS = [
+    {"PROTOCOL": "TCP", "SRCIP": "10.0.0.1", "DSTIP": "10.0.0.2", "SRCPORT": "443", "DSTPORT": "51000"},
+    {"PROTOCOL": "udp", "SRCIP": "10.0.0.3", "DSTIP": "10.0.0.2", "SRCPORT": None, "DSTPORT": None},
+    {"PROTOCOL": "ICMP", "SRCIP": "10.0.0.4", "DSTIP": None, "SRCPORT": "", "DSTPORT": "80"},
+    {"PROTOCOL": None, "SRCIP": "10.0.0.5", "DSTIP": "10.0.0.6", "SRCPORT": "22", "DSTPORT": None},
+    {"PROTOCOL": "TCP", "SRCIP": "10.0.0.7", "DSTIP": "10.0.0.8", "SRCPORT": "8080", "DSTPORT": "8443"},
+]
+
+FILTERS = [
+    {"DSTPORT": "!0-1024"},
+    {"SRCPORT": "!20-30, !443"},
+    {"DSTPORT": "80-9000"},
+    {"SRCPORT": "!"},
+    {"PROTOCOL": "!tcp"},
+    {"DSTIP": "!10.0.0.2"},
+    {"PROTOCOL": "tcp, udp", "DSTPORT": "!50000-60000"},
+    {"SRCPORT": "443, 8000-9000", "DSTIP": "!10.0.0.6"},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    sensor_file = tmp_path / "sensor-FM1-2026-01-01-00-00-00_jsonALLConnections.json"
+    sensor_file.write_text("[]")
+    store = RecordStore(str(tmp_path), INDEXED_FIELDS)
+    store.add_file(str(sensor_file), datetime(2026, 1, 1), pd.DataFrame(ROWS, columns=INDEXED_FIELDS))
+    yield store, str(sensor_file)
+    store.close()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_sql_matches_python_filters(store, filters):
+    store, sensor_file = store
+    query = CompiledQuery(filters)
+    (_, frame), = store.iter_matches([sensor_file], query)
+    expected = [row["SRCIP"] for row in ROWS if query.matches(row)]
+    assert frame["SRCIP"].tolist() == expected
@@ -0,0 +1,106 @@
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from custom_query import CompiledQuery
+from result_cache import CustomResultCache, custom_task_id, source_digest
+
+START, END = datetime(2026, 1, 1, 8, 0), datetime(2026, 1, 1, 20, 0)
+
+EQUIVALENT = [
+    ({"PROTOCOL": "tcp, udp"}, {"PROTOCOL": "UDP,TCP"}),
+    ({"DSTPORT": "443, 80-90"}, {"DSTPORT": " 90-80 ,443"}),
+    ({"SRCIP": "!10.0.0.1", "PROTOCOL": "tcp"}, {"PROTOCOL": "TCP", "SRCIP": "! 10.0.0.1", "DSTIP": ""}),
+    ({}, {"PROTOCOL": " , "}),
+]
+
+DIFFERENT = [
+    ({"PROTOCOL": "tcp"}, {"PROTOCOL": "!tcp"}),
+    ({"DSTPORT": "80-90"}, {"DSTPORT": "80, 90"}),
+    ({"SRCIP": "10.0.0.1"}, {"DSTIP": "10.0.0.1"}),
+]
+
+
+@pytest.mark.parametrize("first, second", EQUIVALENT)
+def test_equivalent_filters_share_one_id(first, second):
+    assert custom_task_id(START, END, CompiledQuery(first)) == custom_task_id(START, END, CompiledQuery(second))
+
+
+@pytest.mark.parametrize("first, second", DIFFERENT)
+def test_different_filters_get_different_ids(first, second):
+    assert custom_task_id(START, END, CompiledQuery(first)) != custom_task_id(START, END, CompiledQuery(second))
+
+
+def test_time_range_is_part_of_the_id():
+    query = CompiledQuery({"PROTOCOL": "tcp"})
+    assert custom_task_id(START, END, query) != custom_task_id(START, datetime(2026, 1, 1, 21, 0), query)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    removed = []
+    cache = CustomResultCache(str(tmp_path), str(tmp_path / "state"), max_bytes=250, max_age=3600,
+                              remove_siblings=removed.append)
+    os.makedirs(tmp_path / "state")
+    return cache, removed
+
+
+def write_result(cache, task_id, size=100):
+    path = cache.path_for(task_id)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_changed_sources_drop_the_entry_and_its_file(cache):
+    cache, removed = cache
+    sources = source_digest(["/watch/a.json", "/watch/b.json"])
+    path = write_result(cache, "custom_one")
+    cache.put("custom_one", sources, records=10)
+    assert cache.get("custom_one", sources) == path
+
+    assert cache.get("custom_one", source_digest(["/watch/a.json", "/watch/b.json", "/watch/c.json"])) is None
+    assert "custom_one" not in cache.entries
+    assert not os.path.exists(path)
+    assert removed == [path]
+    # and the drop is persisted
+    assert "custom_one" not in CustomResultCache(cache.output_folder, os.path.dirname(cache.index_path)).entries
+
+
+def test_evicts_expired_first_then_least_recently_used(cache):
+    cache, _ = cache
+    now = time.time()
+    for task_id, last_access in [("custom_stale", now - 7200), ("custom_lru", now - 30),
+                                 ("custom_mid", now - 20), ("custom_recent", now - 10)]:
+        write_result(cache, task_id)
+        cache.entries[task_id] = {"sources": "sources", "records": 1, "size": 100,
+                                  "created": last_access, "last_access": last_access}
+
+    evicted = cache.evict()
+    # the stale one goes by age, then the least recently used until 250 bytes fit
+    assert sorted(evicted) == ["custom_lru.json", "custom_stale.json"]
+    assert sorted(cache.entries) == ["custom_mid", "custom_recent"]
+    assert sorted(name for name in os.listdir(cache.output_folder) if name.endswith(".json")) == \
+        ["custom_mid.json", "custom_recent.json"]
+
+
+def test_expired_results_go_even_when_they_fit(cache):
+    cache, _ = cache
+    now = time.time()
+    for task_id, last_access in [("custom_stale", now - 7200), ("custom_fresh", now)]:
+        write_result(cache, task_id)
+        cache.entries[task_id] = {"sources": "sources", "records": 1, "size": 100,
+                                  "created": last_access, "last_access": last_access}
+    assert cache.evict() == ["custom_stale.json"]
+    assert sorted(cache.entries) == ["custom_fresh"]
+
+
+def test_put_never_evicts_the_result_it_stores(cache):
+    cache, _ = cache
+    write_result(cache, "custom_old")
+    cache.put("custom_old", "sources", records=1)
+    write_result(cache, "custom_huge", size=1000)
+    cache.put("custom_huge", "sources", records=1)
+    assert sorted(cache.entries) == ["custom_huge"]
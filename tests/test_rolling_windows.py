@@ -0,0 +1,111 @@
+import json
+import os
+from datetime import timedelta
+
+import orjson
+import pytest
+
+import rolling_windows
+from collector import NetworkDataAggregator
+from ndjson_codec import decompress, stored_path
+from rolling_windows import RollingWindowEngine
+from sensor_files import START, sensor_name, write_sensor_file
+
+
+def cutoffs(oldest_minute):
+    return {"all": START + timedelta(minutes=oldest_minute)}
+
+
+def segment_sources(data, segments, codec):
+    """The SRCIP octet (the file's minute) of every record, per segment, read back from the window bytes"""
+    found = []
+    for seg in segments:
+        text = decompress(data[seg["start"]:seg["end"]], codec)
+        found.append({int(orjson.loads(line)["SRCIP"].split(".")[1]) for line in text.splitlines() if line})
+    return found
+
+
+@pytest.fixture(params=[None, "gzip"])
+def setup(request, tmp_path):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    aggregator = NetworkDataAggregator(str(watch), str(tmp_path / "out"), workers=1, compression=request.param)
+    yield str(watch), aggregator
+    aggregator.close()
+    aggregator.remove_spool()
+
+
+def window(aggregator):
+    path = stored_path(os.path.join(aggregator.output_folder, "all_data.json"), aggregator.compression)
+    with open(path, "rb") as f:
+        return path, f.read()
+
+
+def check_window(engine, aggregator, minutes):
+    path, data = window(aggregator)
+    state = engine.manifest["windows"]["all"]
+    segments = state["segments"]
+    assert state["path"] == path and state["size"] == len(data)
+    assert [seg["name"] for seg in segments] == [sensor_name(minute) for minute in minutes]
+    # segments tile the file with no gaps, each holding exactly its own file's records
+    assert [seg["start"] for seg in segments] == [0] + [seg["end"] for seg in segments[:-1]]
+    assert segments[-1]["end"] == len(data)
+    assert segment_sources(data, segments, aggregator.compression) == [{minute} for minute in minutes]
+    return data
+
+
+def test_cycles_append_expire_and_reingest(setup):
+    watch, aggregator = setup
+    for minute in (0, 10, 20):
+        write_sensor_file(watch, minute)
+    engine = RollingWindowEngine(aggregator)
+    engine.update(cutoffs(0))
+    first = check_window(engine, aggregator, [0, 10, 20])
+
+    # a restarted collector picks the manifest up and has nothing to redo
+    engine = RollingWindowEngine(aggregator)
+    engine.update(cutoffs(0))
+    assert check_window(engine, aggregator, [0, 10, 20]) == first
+
+    # a new file is appended after the existing bytes
+    write_sensor_file(watch, 30)
+    engine.update(cutoffs(0))
+    appended = check_window(engine, aggregator, [0, 10, 20, 30])
+    assert appended.startswith(first)
+
+    # expired segments are cut out and the rest keep their bytes
+    engine.update(cutoffs(15))
+    expired = check_window(engine, aggregator, [20, 30])
+    assert len(expired) < len(appended) and appended.endswith(expired)
+    assert sensor_name(0) not in engine.manifest["files"]
+
+    # a sensor file rewritten after ingestion is read again
+    write_sensor_file(watch, 20, rows=5)
+    engine.update(cutoffs(15))
+    check_window(engine, aggregator, [30, 20])
+    assert engine.manifest["files"][sensor_name(20)]["records"] == 5
+
+
+def test_failed_append_leaves_window_untouched(setup, monkeypatch):
+    watch, aggregator = setup
+    for minute in (0, 10):
+        write_sensor_file(watch, minute)
+    engine = RollingWindowEngine(aggregator)
+    engine.update(cutoffs(0))
+    before = check_window(engine, aggregator, [0, 10])
+    manifest_before = json.loads(json.dumps(engine.manifest["windows"]))
+
+    def failing_append(src_path, dst, codec=None):
+        dst.write(b'{"PROTOCOL": "TCP", "SRC')
+        raise OSError(28, "No space left on device")
+
+    write_sensor_file(watch, 20)
+    monkeypatch.setattr(rolling_windows, "append_file", failing_append)
+    engine.update(cutoffs(0))
+    assert window(aggregator)[1] == before
+    assert engine.manifest["windows"] == manifest_before
+    assert not [name for name in os.listdir(aggregator.output_folder) if name.endswith(".tmp")]
+
+    monkeypatch.undo()
+    engine.update(cutoffs(0))
+    assert check_window(engine, aggregator, [0, 10, 20]).startswith(before)
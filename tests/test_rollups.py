@@ -0,0 +1,32 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from rollups import RollupStore, rollup_pointer_path
+
+SELECTION = {"hours": {"2026010112": 1}, "files": []}
+
+
+@pytest.mark.parametrize("stored_name", ["1_hour_data.json", "1_hour_data.json.gz", "1_hour_data.json.zst"])
+def test_pointer_is_touched_when_the_stored_dataset_is_newer(tmp_path, monkeypatch, stored_name):
+    store = RollupStore(str(tmp_path))
+    monkeypatch.setattr(store, "window_selection", lambda cutoff: SELECTION)
+    output_path = str(tmp_path / "1_hour_data.json")
+    pointer_path = rollup_pointer_path(output_path)
+
+    store.publish_window(output_path, datetime(2026, 1, 1))
+    os.utime(pointer_path, (1000, 1000))
+    stored_path = str(tmp_path / stored_name)
+    with open(stored_path, "wb"):
+        pass
+
+    # the NDJSON was rewritten after the pointer: same cubes, but the pointer has to win again
+    os.utime(stored_path, (2000, 2000))
+    store.publish_window(output_path, datetime(2026, 1, 1))
+    assert os.path.getmtime(pointer_path) > 2000
+
+    # and left alone once it is the newer of the two
+    os.utime(pointer_path, (3000, 3000))
+    store.publish_window(output_path, datetime(2026, 1, 1))
+    assert os.path.getmtime(pointer_path) == 3000
@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import sensor_archive
+from collector import clean_batch
+from custom_query import CompiledQuery
+from sensor_archive import SensorArchive, hour_key, read_member, split_member
+from sensor_files import START, sensor_name, sensor_record, write_sensor_file
+
+COLUMNS = ["PROTOCOL", "SRCIP", "TOTPACKETS"]
+
+
+def file_timestamp(name):
+    return datetime.strptime(name[len("sensor-FM1-"):].split("_")[0], "%Y-%m-%d-%H-%M-%S")
+
+
+def records(minute, protocol="TCP", rows=3):
+    return [sensor_record(PROTOCOL=protocol, SRCIP=f"10.{minute}.0.{n}", TOTPACKETS=minute * 10 + n)
+            for n in range(rows)]
+
+
+@pytest.fixture
+def watch(tmp_path):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    return str(watch)
+
+
+def archive_files(archive, watch, minutes, protocol="TCP"):
+    """Write raw sensor files at these minutes and archive them, each hour into its partition"""
+    frames = {}
+    for minute in minutes:
+        write_sensor_file(watch, minute, records=records(minute, protocol))
+        timestamp = START + timedelta(minutes=minute)
+        frame = clean_batch(records(minute, protocol))
+        frames.setdefault(hour_key(timestamp), []).append((timestamp, os.path.join(watch, sensor_name(minute)), frame))
+    for hour, hour_frames in frames.items():
+        archive.write_partition(hour, hour_frames)
+    archive.save_manifest()
+
+
+def member_sources(archive, start=START, end=START + timedelta(hours=3)):
+    """{archived file name: SRCIPs read back from its row group}"""
+    return {split_member(path)[1]: read_member(path, COLUMNS)["SRCIP"].tolist()
+            for _, path in archive.lookup(start, end)}
+
+
+def test_write_partition_keeps_one_row_group_per_file(tmp_path, watch):
+    archive = SensorArchive(str(tmp_path / "state"), file_timestamp=file_timestamp)
+    archive_files(archive, watch, [0, 10, 70])
+    assert sorted(archive.manifest["partitions"]) == ["2026010112", "2026010113"]
+    assert member_sources(archive) == {
+        sensor_name(minute): [f"10.{minute}.0.{n}" for n in range(3)] for minute in (0, 10, 70)
+    }
+    partition = archive.manifest["partitions"]["2026010112"]
+    assert (partition["min_time"], partition["max_time"]) == (START.isoformat(), (START + timedelta(minutes=10)).isoformat())
+
+    # compacting the hour again: a rewritten file replaces its rows, a file whose raw copy is gone is carried over
+    os.remove(os.path.join(watch, sensor_name(0)))
+    write_sensor_file(watch, 10, records=records(10, rows=5))
+    archive.write_partition("2026010112", [(START + timedelta(minutes=10), os.path.join(watch, sensor_name(10)),
+                                            clean_batch(records(10, rows=5)))])
+    assert archive.manifest["partitions"]["2026010112"]["revision"] == 2
+    assert member_sources(archive)[sensor_name(0)] == [f"10.0.0.{n}" for n in range(3)]
+    assert len(member_sources(archive)[sensor_name(10)]) == 5
+    assert sorted(name for name in os.listdir(archive.archive_dir) if name.startswith("2026010112")) == \
+        ["2026010112.2.parquet", "2026010112.2.summary.json"]
+
+
+def test_rebuild_manifest_from_the_partitions(tmp_path, watch):
+    state = str(tmp_path / "state")
+    archive = SensorArchive(state, file_timestamp=file_timestamp)
+    archive_files(archive, watch, [0, 10, 70])
+    written = archive.manifest
+    os.remove(archive.manifest_path)
+
+    rebuilt = SensorArchive(state, file_timestamp=file_timestamp)
+    assert sorted(rebuilt.manifest["partitions"]) == sorted(written["partitions"])
+    for hour, partition in rebuilt.manifest["partitions"].items():
+        for key in ("revision", "min_time", "max_time"):
+            assert partition[key] == written["partitions"][hour][key]
+        assert {name: (info["timestamp"], info["records"]) for name, info in partition["files"].items()} == \
+            {name: (info["timestamp"], info["records"]) for name, info in written["partitions"][hour]["files"].items()}
+    assert member_sources(rebuilt) == member_sources(archive)
+    # the raw files' stats are lost, so they count as not archived: compacted again, never removed
+    current = [(START + timedelta(minutes=minute), os.path.join(watch, sensor_name(minute))) for minute in (0, 10, 70)]
+    assert not any(rebuilt.archived(timestamp, path) for timestamp, path in current)
+    assert sorted(rebuilt.pending(current, START + timedelta(hours=3))) == ["2026010112", "2026010113"]
+
+    # the rebuilt manifest is only written by the next save; without a way to date
+    # the files the partitions are left alone rather than guessed at
+    assert not os.path.exists(archive.manifest_path)
+    assert SensorArchive(state).manifest["partitions"] == {}
+
+
+def test_remove_raw_deletes_only_archived_old_files(tmp_path, watch):
+    archive = SensorArchive(str(tmp_path / "state"), raw_days=1, file_timestamp=file_timestamp)
+    archive_files(archive, watch, [0, 10, 20])
+    write_sensor_file(watch, 30)  # never archived
+    write_sensor_file(watch, 20, records=records(20, rows=6))  # changed after it was archived
+    current = [(START + timedelta(minutes=minute), os.path.join(watch, sensor_name(minute))) for minute in (0, 10, 20, 30)]
+
+    # nothing is old enough yet
+    assert archive.remove_raw(current, START + timedelta(hours=12)) == 0
+    assert archive.remove_raw(current, START + timedelta(days=1, minutes=15)) == 2
+    assert sorted(os.listdir(watch)) == [sensor_name(20), sensor_name(30)]
+    assert SensorArchive(str(tmp_path / "other"), raw_days=0).remove_raw(current, datetime.max) == 0
+
+
+def test_may_match_prunes_by_the_partition_summary(tmp_path, watch, monkeypatch):
+    monkeypatch.setattr(sensor_archive, "SUMMARY_LIMIT", 4)
+    archive = SensorArchive(str(tmp_path / "state"), file_timestamp=file_timestamp)
+    archive_files(archive, watch, [0, 10], protocol="TCP")
+    archive_files(archive, watch, [70], protocol="UDP")
+    paths = {split_member(path)[1]: path for _, path in archive.lookup(START, START + timedelta(hours=3))}
+    tcp_member, udp_member = paths[sensor_name(0)], paths[sensor_name(70)]
+
+    assert archive.may_match(tcp_member, CompiledQuery({"PROTOCOL": "tcp"}))
+    assert not archive.may_match(udp_member, CompiledQuery({"PROTOCOL": "tcp"}))
+    assert not archive.may_match(tcp_member, CompiledQuery({"PROTOCOL": "!tcp"}))
+    assert archive.may_match(udp_member, CompiledQuery({"DSTIP": "10.0.0.1", "PROTOCOL": "udp"}))
+    # six addresses in the first hour is past the limit, so SRCIP is not summarized there and never prunes
+    assert archive.may_match(tcp_member, CompiledQuery({"SRCIP": "192.168.0.1"}))
+    assert not archive.may_match(udp_member, CompiledQuery({"SRCIP": "192.168.0.1"}))
+    # a partition without a summary is always read
+    os.remove(archive.summary_path(split_member(udp_member)[0]))
+    archive.summaries.clear()
+    assert archive.may_match(udp_member, CompiledQuery({"PROTOCOL": "tcp"}))
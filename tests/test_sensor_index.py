@@ -0,0 +1,44 @@
+import os
+from datetime import datetime, timedelta
+
+from sensor_files import START, sensor_name, write_sensor_file
+from sensor_index import SensorFileIndex
+
+
+def file_timestamp(name):
+    return datetime.strptime(name[len("sensor-FM1-"):].split("_")[0], "%Y-%m-%d-%H-%M-%S")
+
+
+def settle(directory):
+    """Date the directory back, as if its last change were long past"""
+    os.utime(directory, (1_000_000, 1_000_000))
+
+
+def test_unwatched_lookups_rescan_only_when_the_directory_changed(tmp_path, monkeypatch, capsys):
+    watch = tmp_path / "watch"
+    watch.mkdir()
+    for minute in (0, 10):
+        write_sensor_file(str(watch), minute)
+    settle(watch)
+    index = SensorFileIndex(str(watch), str(tmp_path / "state" / "sensor_index.json"), file_timestamp)
+
+    scans = []
+    rebuild = index.rebuild
+    monkeypatch.setattr(index, "rebuild", lambda: scans.append(1) or rebuild())
+    assert [path for _, path in index.lookup()] == [str(watch / sensor_name(minute)) for minute in (0, 10)]
+    assert index.lookup(start=START + timedelta(minutes=5)) == [(START + timedelta(minutes=10), str(watch / sensor_name(10)))]
+    assert scans == []
+
+    # a new file moves the directory mtime, and the next lookup picks it up
+    write_sensor_file(str(watch), 20)
+    assert len(index.lookup()) == 3 and len(scans) == 1
+    # a change this recent is not trusted yet, so it is checked again until it settles
+    index.lookup()
+    settle(watch)
+    index.lookup()
+    index.lookup()
+    assert len(scans) == 3
+
+    os.remove(watch / sensor_name(0))
+    assert [path for _, path in index.lookup()] == [str(watch / sensor_name(minute)) for minute in (10, 20)]
+    assert capsys.readouterr().out.count("not watching") == 1
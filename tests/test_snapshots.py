@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+
+from columnar import open_snapshot, publish_snapshot, snapshot_pointer_path
+from data_processing import TIME_FIELDS, prepare_frame
+from sensor_files import sensor_record
+
+
+def write_dataset(path, count, **fields):
+    with open(path, "w") as f:
+        for n in range(count):
+            record = sensor_record(SRCIP=f"10.0.{n // 250}.{n % 250}", TOTPACKETS=n, TOTDATA=1.5, **fields)
+            f.write(json.dumps(record) + "\n")
+
+
+def test_counters_are_mapped_int32_views(tmp_path):
+    path = str(tmp_path / "all_data.json")
+    write_dataset(path, 3000, **{"1AM": 7})
+    # small blocks, so the snapshot has to be stitched back into one batch
+    publish_snapshot(path, block_size=16 * 1024)
+
+    df = prepare_frame(open_snapshot(snapshot_pointer_path(path)))
+    assert len(df) == 3000 and df["1AM"].sum() == 7 * 3000
+    for col in TIME_FIELDS + ["TOTPACKETS"]:
+        values = df[col].to_numpy()
+        # read-only means it is still the mapped file, not a copy
+        assert not values.flags.writeable
+    assert all(df[col].dtype == np.int32 for col in TIME_FIELDS)
+
+
+def test_counters_past_int32_stay_int64(tmp_path):
+    path = str(tmp_path / "all_data.json")
+    write_dataset(path, 10, **{"1AM": 2 ** 40})
+    publish_snapshot(path)
+    df = open_snapshot(snapshot_pointer_path(path))
+    assert df["1AM"].dtype == np.int64 and df["1AM"].iloc[0] == 2 ** 40
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+from task_scheduler import CustomTaskScheduler, JobCancelled
+
+TIMEOUT = 5
+
+
+class FakeJob:
+    """Job arguments for run_job below: it signals started, then blocks until released"""
+    def __init__(self, result):
+        self.result = result
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+
+def run_job(job, cancel=None, progress=None, partial=None):
+    job.started.set()
+    assert job.release.wait(TIMEOUT)
+    if job.result is None and cancel.is_set():
+        raise JobCancelled()
+    return job.result
+
+
+def wait_for(check):
+    deadline = time.time() + TIMEOUT
+    while not check():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        scheduler = CustomTaskScheduler(run_job, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+        for job in list(scheduler.jobs.values()):
+            job['args'][0].release.set()
+
+
+def status(scheduler, task_id):
+    return scheduler.active_tasks[task_id]['status']
+
+
+def test_rejects_searches_over_max_bytes(make_scheduler):
+    scheduler = make_scheduler(max_bytes=1000)
+    scheduler.submit("big", (FakeJob("/out/big.json"),), waiter=("a", 1), cost={"files": 3, "bytes": 5000})
+    assert status(scheduler, "big") == 'rejected'
+    assert "limit" in scheduler.active_tasks["big"]['message']
+    scheduler.submit("small", (FakeJob("/out/small.json"),), waiter=("a", 1), cost={"files": 1, "bytes": 500})
+    assert status(scheduler, "small") == 'pending'
+
+
+def test_rejects_past_max_queue(make_scheduler):
+    scheduler = make_scheduler(max_queue=2, per_user=0)
+    for n in range(2):
+        scheduler.submit(f"t{n}", (FakeJob(None),), waiter=(f"user{n}", n))
+    scheduler.submit("t2", (FakeJob(None),), waiter=("user2", 2))
+    assert [status(scheduler, f"t{n}") for n in range(3)] == ['pending', 'pending', 'rejected']
+
+
+def test_per_user_limit_and_waiter_replacement(make_scheduler):
+    scheduler = make_scheduler(per_user=1)
+    scheduler.submit("first", (FakeJob(None),), waiter=("alice", "tab1"))
+    # another tab of the same user is turned away while the first search is live
+    scheduler.submit("second", (FakeJob(None),), waiter=("alice", "tab2"))
+    assert status(scheduler, "second") == 'rejected'
+    # the same tab submitting again replaces its own search
+    scheduler.submit("third", (FakeJob(None),), waiter=("alice", "tab1"))
+    assert status(scheduler, "first") == 'cancelled'
+    assert scheduler.active_tasks["first"]['message'] == 'Replaced by a newer search'
+    assert status(scheduler, "third") == 'pending'
+    # an identical search from someone else joins the existing job
+    scheduler.submit("third", (FakeJob(None),), waiter=("bob", "tab1"))
+    assert set(scheduler.jobs["third"]['waiting']) == {("alice", "tab1"), ("bob", "tab1")}
+
+
+def test_reaps_jobs_nobody_polls(make_scheduler):
+    scheduler = make_scheduler(heartbeat_timeout=60)
+    scheduler.submit("kept", (FakeJob(None),), waiter=("a", 1))
+    scheduler.submit("dropped", (FakeJob(None),), waiter=("b", 2))
+    for job in scheduler.jobs.values():
+        for waiter in job['waiting']:
+            job['waiting'][waiter] = time.time() - 120
+    scheduler.heartbeat("kept", waiter=("a", 1))
+    with scheduler.condition:
+        scheduler._reap()
+    assert status(scheduler, "kept") == 'pending'
+    assert status(scheduler, "dropped") == 'cancelled'
+    assert "dropped" not in scheduler.jobs
+
+
+def test_heavy_jobs_run_one_at_a_time(make_scheduler):
+    scheduler = make_scheduler(workers=3, per_user=0, heavy_bytes=1000)
+    heavy = {"files": 10, "bytes": 5000}
+    jobs = {name: FakeJob(f"/out/{name}.json") for name in ("heavy1", "heavy2", "light")}
+    scheduler.submit("heavy1", (jobs["heavy1"],), waiter=("a", 1), priority=1, cost=heavy)
+    scheduler.submit("heavy2", (jobs["heavy2"],), waiter=("b", 2), priority=2, cost=heavy)
+    scheduler.submit("light", (jobs["light"],), waiter=("c", 3), priority=3, cost={"files": 1, "bytes": 10})
+    scheduler.start()
+
+    # the light job overtakes the second heavy one while the first heavy scan runs
+    assert jobs["heavy1"].started.wait(TIMEOUT) and jobs["light"].started.wait(TIMEOUT)
+    assert not jobs["heavy2"].started.is_set()
+    assert status(scheduler, "heavy2") == 'pending'
+
+    jobs["heavy1"].release.set()
+    assert jobs["heavy2"].started.wait(TIMEOUT)
+    wait_for(lambda: status(scheduler, "heavy1") == 'complete')
+    assert scheduler.active_tasks["heavy1"]['filename'] == "heavy1.json"
+
+
+def test_finish_of_cancelled_job_does_not_touch_its_resubmission(make_scheduler):
+    scheduler = make_scheduler(workers=1)
+    old, new = FakeJob("/out/old.json"), FakeJob("/out/new.json")
+    scheduler.submit("task", (old,), waiter=("a", 1))
+    scheduler.start()
+    assert old.started.wait(TIMEOUT)
+
+    scheduler.cancel("task", waiter=("a", 1))
+    assert status(scheduler, "task") == 'cancelled'
+    scheduler.submit("task", (new,), waiter=("a", 1))
+    assert status(scheduler, "task") == 'pending'
+
+    # the cancelled run still returns a result, which must not complete the new job
+    old.release.set()
+    assert new.started.wait(TIMEOUT)
+    assert status(scheduler, "task") == 'processing'
+    assert scheduler.jobs["task"]['args'] == (new,)
+
+    new.release.set()
+    wait_for(lambda: status(scheduler, "task") == 'complete')
+    assert scheduler.active_tasks["task"]['filename'] == "new.json"
@@ -6,9 +6,16 @@ import logging
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from cache_config import update_cache_for_file
+from columnar import available as columnar_available
+from ndjson_codec import NDJSON_SUFFIXES
 
 logger = logging.getLogger(__name__)
 
+# the collector publishes these in order, so only the last one present needs to be acted on
+COLUMNAR_SUFFIXES = ('.parquet', '.snapshot', '.rollup') if columnar_available() else ()
+# an NDJSON dataset is stored under one of these, plain or compressed (.json.gz, .json.zst)
+WATCHED_SUFFIXES = NDJSON_SUFFIXES + COLUMNAR_SUFFIXES
+
 class FileChangeHandler(FileSystemEventHandler):
     def __init__(self, server, directory_to_watch):
         super().__init__()
@@ -16,23 +23,36 @@ class FileChangeHandler(FileSystemEventHandler):
         self.directory_to_watch = directory_to_watch
 
     def on_created(self, event):
-        if not event.is_directory and event.src_path.endswith('.json'):
+        if not event.is_directory and event.src_path.endswith(WATCHED_SUFFIXES):
             logger.info(f"File created: {event.src_path}")
             self.handle_change(event.src_path)
 
     def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith('.json'):
+        if not event.is_directory and event.src_path.endswith(WATCHED_SUFFIXES):
             logger.info(f"File modified: {event.src_path}")
             self.handle_change(event.src_path)
 
     def on_moved(self, event):
-        if not event.is_directory and event.dest_path.endswith('.json'):
+        if not event.is_directory and event.dest_path.endswith(WATCHED_SUFFIXES):
             logger.info(f"File moved from {event.src_path} to {event.dest_path}")
             self.handle_change(event.dest_path)
 
     def handle_change(self, file_path):
         # just call our update func directly
-        filename = os.path.basename(file_path)
+        if os.path.basename(file_path).startswith('custom_'):
+            # custom jobs cache their own figures from the records they already hold
+            return
+        suffix = max((suffix for suffix in WATCHED_SUFFIXES if file_path.endswith(suffix)), key=len)
+        base = file_path[:-len(suffix)]
+        # the NDJSON variants are alternatives, not steps; only the columnar copies come after them
+        later = COLUMNAR_SUFFIXES
+        if suffix in COLUMNAR_SUFFIXES:
+            later = COLUMNAR_SUFFIXES[COLUMNAR_SUFFIXES.index(suffix) + 1:]
+        if any(os.path.exists(base + suffix) for suffix in later):
+            # the collector rewrites that copy right after, wait for its event instead
+            return
+        # cache entries stay keyed by the .json name whichever format got read
+        filename = os.path.basename(base + '.json')
         update_cache_for_file(filename)
 
 def start_watchdog(directory_to_watch, server):